@@ -5,6 +5,7 @@ Created on Apr 5, 2018
 '''
 from .daq_do_dev import DAQCOTask,DAQSimpleDOTask
 import numpy as np
+import time
 
 
 class DAQMotorDev(object):
@@ -32,7 +33,17 @@ class DAQMotorDev(object):
         self.co_task1 = DAQCOTask(self.counter[0],self.term[0],self.freq,self.dc)
         self.co_task2 = DAQCOTask(self.counter[1],self.term[1],self.freq,self.dc)
         
+        #perf_counter time the last move started and sent its last pulse
+        self.start_time = np.nan
+        self.done_time = np.nan
+        
     def send_pulses(self,num_pulses = [100,100]):
+        '''
+        send pulses to both motors and wait until the last pulse is out
+        
+        num_pulses: number of pulses of each motor
+        '''
+        self.start_time = time.perf_counter()
         self.co_task1.set_pulses(num_pulses[0])
         self.co_task2.set_pulses(num_pulses[1])
         if not num_pulses[0] == 0:
@@ -41,6 +52,7 @@ class DAQMotorDev(object):
             self.co_task2.start()
         while not self.done():
             pass
+        self.done_time = time.perf_counter()
         if not num_pulses[0] == 0:
             self.co_task1.stop()
         if not num_pulses[1] == 0:
@@ -55,6 +67,12 @@ class DAQMotorDev(object):
     def done(self):
         return (self.co_task1.done() and self.co_task2.done())
     
+    def get_move_times(self):
+        '''
+        return: perf_counter time the last move started and sent its last pulse
+        '''
+        return self.start_time, self.done_time
+    
     def close(self):
         self.do_task.close()
         self.co_task1.close()
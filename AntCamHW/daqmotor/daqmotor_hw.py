@@ -83,6 +83,9 @@ class DAQMotorHW(HardwareComponent):
         self.add_operation('move_to',self.move_to)
         self.add_operation('zero',self.zero)
         self.add_operation('home',self.home)
+        
+        #True while an external controller (the stage of ant_watch) counts the steps
+        self.external = False
     def connect(self):
         #connect to the camera device
         do_chans = self.settings.do_chans.value()
@@ -99,7 +102,22 @@ class DAQMotorHW(HardwareComponent):
                               term = terminals, freq = frequency, 
                               dc = duty_cycle)
         
+    def set_external(self, external):
+        '''
+        hand the motors to an external controller or take them back. While
+        external the manual moves and reset are disabled, the controller
+        counts the steps and writes them to the settings
+        '''
+        self.external = external
+        if external:
+            self.settings.manual.update_value(False)
+        for name in ('manual', 'manual_steps', 'move_to_x', 'move_to_y'):
+            self.settings.get_lq(name).change_readonly(external)
+        
     def reset(self):
+        if self.external:
+            print('Error: the motors are controlled by ant_watch, reset is disabled')
+            return
         self.settings.x_steps.update_value(0)
         self.settings.y_steps.update_value(0)
         self.update_cord()
@@ -5,7 +5,13 @@ Created on Mar 26, 2018
 '''
 
 import numpy as np
+import time
 import PySpin
+from .frame_pool import FramePool, FrameStats
+# demosaic algorithms that can be chosen for Bayer cameras, from the cheapest
+# to the most expensive
+DEMOSAIC_ALGORITHMS = ['NEAREST_NEIGHBOR', 'BILINEAR', 'EDGE_SENSING', 'HQ_LINEAR', 'DIRECTIONAL_FILTER']
+
 '''
 FLIRCamDev is the FoundryScope Driver for Point-Grey cameras. It is calling the 
 FLIR Spinnaker Python binding PySpin. The newest version of PySpin can be
@@ -45,6 +51,10 @@ class FLIRCamDev(object):
             
             #read camera control information
             self.nodemap = self.cam.GetNodeMap()
+            
+            #node handles are resolved once per connection
+            self.node_cache = {}
+            self.acquisition_mode_continuous = self.read_acquisition_mode_continuous()
         
             
             #enable auto exposure
@@ -55,6 +65,21 @@ class FLIRCamDev(object):
             #get height and width of the field of view
             self.height = self.get_height()
             self.width = self.get_width()
+            self.offset_x = self.get_offset_x()
+            self.offset_y = self.get_offset_y()
+            self.acquiring = False
+            
+            #tag every frame with the region of interest it was taken with
+            self.chunk_offsets = self.enable_chunk_offsets()
+            
+            #detect the pixel format once, native Mono8 needs no conversion
+            self.pixel_format = self.read_pixel_format()
+            self.native_mono8 = (self.pixel_format == 'Mono8')
+            self.set_demosaic('BILINEAR')
+            
+            #reusable frame buffers filled by read_frame
+            self.frame_pool = FramePool((self.height,self.width),np.uint8)
+            self.frame_stats = FrameStats()
 
         except PySpin.SpinnakerException as ex:
             print("Error: %s" % ex)
@@ -64,31 +89,44 @@ class FLIRCamDev(object):
         '''
         Start the continuous acquisition mode
         '''
+        try:
+            if self.acquisition_mode_continuous is None:
+                print("Unable to set acquisition mode to continuous. Aborting...")
+                return False
+            self.get_node(self.nodemap,"AcquisitionMode",PySpin.CEnumerationPtr).SetIntValue(self.acquisition_mode_continuous)
+            
+            #Begin Acquisition
+            self.frame_stats.reset()
+            self.cam.BeginAcquisition()
+            self.acquiring = True
+            
+        except PySpin.SpinnakerException as ex:
+            print("Error: %s" % ex)
+            
+    def read_acquisition_mode_continuous(self):
+        '''
+        resolve the enumeration value of the continuous acquisition mode
+        
+        return: integer value of the entry, None if it is not available
+        '''
         try:
             #get handle for acquisition mode
-            node_acquisition_mode = PySpin.CEnumerationPtr(self.nodemap.GetNode("AcquisitionMode"))
+            node_acquisition_mode = self.get_node(self.nodemap,"AcquisitionMode",PySpin.CEnumerationPtr)
             if not PySpin.IsAvailable(node_acquisition_mode) or not PySpin.IsWritable(node_acquisition_mode):
-                print("Unable to set acquisition mode to continuous (enum retrieval). Aborting...")
-                return False
+                print("Unable to set acquisition mode to continuous (enum retrieval)")
+                return None
                  
             # Retrieve entry node from enumeration node
             node_acquisition_mode_continuous = node_acquisition_mode.GetEntryByName("Continuous")
             if not PySpin.IsAvailable(node_acquisition_mode_continuous) or not PySpin.IsReadable(node_acquisition_mode_continuous):
-                print("Unable to set acquisition mode to continuous (entry retrieval). Aborting...")
-                return False
+                print("Unable to set acquisition mode to continuous (entry retrieval)")
+                return None
                  
-             
             # Retrieve integer value from entry node
-            acquisition_mode_continuous = node_acquisition_mode_continuous.GetValue()
-                 
-            # Set integer value from entry node as new value of enumeration node
-            node_acquisition_mode.SetIntValue(acquisition_mode_continuous)
-            
-            #Begin Acquisition
-            self.cam.BeginAcquisition()
-            
+            return node_acquisition_mode_continuous.GetValue()
         except PySpin.SpinnakerException as ex:
             print("Error: %s" % ex)
+            return None
             
     def stop(self):
         '''
@@ -96,6 +134,7 @@ class FLIRCamDev(object):
         '''
         try:
             self.cam.EndAcquisition()
+            self.acquiring = False
         except PySpin.SpinnakerException as ex:
                 print("Error: %s" % ex)
         
@@ -104,6 +143,8 @@ class FLIRCamDev(object):
         close the camera instance and delete itself
         '''
         try:
+            #node handles are invalid once the camera is released
+            self.node_cache = {}
             #release the devices properly
             self.cam.DeInit()
             num_cam = self.cam_list.GetSize()
@@ -133,10 +174,90 @@ class FLIRCamDev(object):
         read and return the next frame from the camera
         '''
         image = self.cam.GetNextImage()
-        image_converted = image.Convert(PySpin.PixelFormat_Mono8,PySpin.HQ_LINEAR)
+        self.frame_stats.count(image.GetFrameID())
+        image_converted = image.Convert(PySpin.PixelFormat_Mono8,self.demosaic_algorithm)
         image.Release()
         return image_converted
     
+    def read_frame(self):
+        '''
+        read the next frame from the camera into a buffer of the frame pool,
+        the data is copied once from the camera buffer and no array is
+        allocated. The caller owns one lease on the frame and has to release it
+        
+        return: Frame carrying the camera timestamp (ns), frame id and host
+        receive time (time.perf_counter), frame.data is filled with ones and
+        frame.valid is False if the image is corrupted
+        '''
+        #lease once the image arrived, a timeout or a SpinnakerException of
+        #GetNextImage does not hold a buffer of the pool
+        image = self.cam.GetNextImage()
+        host_time = time.perf_counter()
+        frame = self.frame_pool.lease()
+        frame.host_time = host_time
+        try:
+            frame.timestamp = image.GetTimeStamp()
+            frame.frame_id = image.GetFrameID()
+            self.frame_stats.count(frame.frame_id)
+            if self.chunk_offsets:
+                chunk_data = image.GetChunkData()
+                frame.offset_x = chunk_data.GetOffsetX()
+                frame.offset_y = chunk_data.GetOffsetY()
+            else:
+                frame.offset_x = self.offset_x
+                frame.offset_y = self.offset_y
+            status = image.GetImageStatus()
+            if not status == 0 or image.IsIncomplete():
+                print('incomplete image %i, returning ones' % status)
+                self.frame_stats.incomplete += 1
+                frame.valid = False
+            elif self.native_mono8:
+                frame.valid = self.fill_frame(image,frame)
+            else:
+                image_converted = image.Convert(PySpin.PixelFormat_Mono8,self.demosaic_algorithm)
+                frame.valid = self.fill_frame(image_converted,frame)
+        except PySpin.SpinnakerException as ex:
+            print("Error: %s, returning ones" % ex)
+            self.frame_stats.convert_failures += 1
+            frame.valid = False
+        finally:
+            image.Release()
+        if not frame.valid:
+            frame.data[:] = 1
+        return frame
+    
+    def fill_frame(self,image,frame):
+        '''
+        copy the data of an image object into a frame buffer
+        
+        return: True if the image has the right size
+        '''
+        data = image.GetNDArray()
+        if data.size != frame.data.size:
+            print('Error: Data size %i is not the right size, returning ones' % data.size)
+            self.frame_stats.convert_failures += 1
+            return False
+        np.copyto(frame.data,data.reshape(frame.data.shape))
+        return True
+    
+    def get_frame_stats(self):
+        '''
+        return: dict with the frame counters since the acquisition started
+        '''
+        return self.frame_stats.as_dict()
+    
+    def get_frames_acquired(self):
+        return self.frame_stats.acquired
+    
+    def get_frames_dropped(self):
+        return self.frame_stats.dropped
+    
+    def get_frames_incomplete(self):
+        return self.frame_stats.incomplete
+    
+    def get_convert_failures(self):
+        return self.frame_stats.convert_failures
+    
     def to_numpy(self,image):
         '''
         Convert an image object to data
@@ -159,7 +280,8 @@ class FLIRCamDev(object):
             print('corrupted image %i' % buffer_size)
             return np.ones((self.height,self.width),dtype = np.uint8)
         if image.IsIncomplete():
-            print('incomplete iamge, returning ones')
+            print('incomplete image, returning ones')
+            self.frame_stats.incomplete += 1
             return np.ones((self.height,self.width),dtype = np.uint8)
         try:
             data = image.GetData()
@@ -198,26 +320,14 @@ class FLIRCamDev(object):
         """
         This function get the model name
         """
-        try:
-            node_device_information = PySpin.CCategoryPtr(self.nodemap_tldevice.GetNode("DeviceInformation"))
-    
-            if PySpin.IsAvailable(node_device_information) and PySpin.IsReadable(node_device_information):
-                features = node_device_information.GetFeatures()
-                for feature in features:
-                    node_feature = PySpin.CValuePtr(feature)
-                    if node_feature.GetName() == 'DeviceModelName':
-                        return node_feature.ToString()
-    
-            else:
-                return 'N/A'
-            
-        except PySpin.SpinnakerException as ex:
-            print("Error: %s" % ex)
+        model = self.get_feature(self.nodemap_tldevice,'DeviceInformation','DeviceModelName')
+        if model is None:
             return 'N/A'
+        return model
         
     def get_width(self):
         try:
-            node_width = PySpin.CIntegerPtr(self.nodemap.GetNode("Width"))
+            node_width = self.get_node(self.nodemap,"Width",PySpin.CIntegerPtr)
             if PySpin.IsAvailable(node_width):
                 return node_width.GetValue()
         except PySpin.SpinnakerException as ex:
@@ -225,12 +335,210 @@ class FLIRCamDev(object):
     
     def get_height(self):
         try:
-            node_height = PySpin.CIntegerPtr(self.nodemap.GetNode("Height"))
+            node_height = self.get_node(self.nodemap,"Height",PySpin.CIntegerPtr)
             if PySpin.IsAvailable(node_height):
                 return node_height.GetValue()
         except PySpin.SpinnakerException as ex:
             print("Error: %s" % ex)
             
+    def get_sensor_width(self):
+        '''
+        get the width of the full sensor, in camera pixels after binning
+        '''
+        try:
+            return self.cam.WidthMax.GetValue()
+        except PySpin.SpinnakerException as ex:
+            print("Error: %s" % ex)
+    
+    def get_sensor_height(self):
+        '''
+        get the height of the full sensor, in camera pixels after binning
+        '''
+        try:
+            return self.cam.HeightMax.GetValue()
+        except PySpin.SpinnakerException as ex:
+            print("Error: %s" % ex)
+            
+    def get_offset_x(self):
+        try:
+            return self.cam.OffsetX.GetValue()
+        except PySpin.SpinnakerException as ex:
+            print("Error: %s" % ex)
+            return 0
+    
+    def get_offset_y(self):
+        try:
+            return self.cam.OffsetY.GetValue()
+        except PySpin.SpinnakerException as ex:
+            print("Error: %s" % ex)
+            return 0
+            
+    def get_sensor_binning(self):
+        '''
+        get the on-sensor binning factor
+        '''
+        try:
+            return self.cam.BinningVertical.GetValue()
+        except PySpin.SpinnakerException as ex:
+            print("Error: %s" % ex)
+            return 1
+    
+    def set_sensor_binning(self,binning):
+        '''
+        set the on-sensor binning factor of both axes, only possible while
+        the camera is not acquiring. The region of interest is reset to the
+        full sensor
+        
+        binning: binning factor, e.g. 1, 2 or 4
+        '''
+        if self.acquiring:
+            print('Unable to set sensor binning during acquisition')
+            return None
+        try:
+            self.cam.OffsetX.SetValue(0)
+            self.cam.OffsetY.SetValue(0)
+            self.cam.BinningVertical.SetValue(int(binning))
+            if self.cam.BinningHorizontal.GetAccessMode() == PySpin.RW:
+                self.cam.BinningHorizontal.SetValue(int(binning))
+        except PySpin.SpinnakerException as ex:
+            print("Error: %s" % ex)
+        self.reset_roi()
+            
+    def set_roi(self,width,height,offset_x = None,offset_y = None):
+        '''
+        set the size of the region of interest read out from the sensor, only
+        possible while the camera is not acquiring. The frame pool is
+        reallocated for the new frame size
+        
+        width, height: size of the region in camera pixels, rounded down to
+                       the increments of the camera
+        offset_x, offset_y: top left corner of the region, centered on the
+                            sensor if None
+        '''
+        if self.acquiring:
+            print('Unable to set the region of interest during acquisition')
+            return None
+        try:
+            #offsets first, a larger region might not fit at the old offset
+            self.cam.OffsetX.SetValue(0)
+            self.cam.OffsetY.SetValue(0)
+            width = self.snap(self.cam.Width, width)
+            height = self.snap(self.cam.Height, height)
+            self.cam.Width.SetValue(width)
+            self.cam.Height.SetValue(height)
+        except PySpin.SpinnakerException as ex:
+            print("Error: %s" % ex)
+        
+        self.height = self.get_height()
+        self.width = self.get_width()
+        self.frame_pool = FramePool((self.height,self.width),np.uint8)
+        if offset_x is None:
+            offset_x = (self.get_sensor_width() - self.width) // 2
+        if offset_y is None:
+            offset_y = (self.get_sensor_height() - self.height) // 2
+        self.offset_x = 0
+        self.offset_y = 0
+        self.move_roi(offset_x, offset_y)
+        
+    def reset_roi(self):
+        '''
+        read out the full sensor
+        '''
+        self.set_roi(self.get_sensor_width(),self.get_sensor_height(),0,0)
+    
+    def move_roi(self,offset_x,offset_y):
+        '''
+        move the region of interest without changing its size, the offsets are
+        clamped to the sensor and only written when they changed. Most cameras
+        allow this between frames during acquisition
+        
+        offset_x, offset_y: top left corner of the region in camera pixels
+        return: True if the region is at the requested offsets
+        '''
+        try:
+            offset_x = self.snap(self.cam.OffsetX, offset_x)
+            offset_y = self.snap(self.cam.OffsetY, offset_y)
+            if offset_x != self.offset_x:
+                if self.cam.OffsetX.GetAccessMode() != PySpin.RW:
+                    return False
+                self.cam.OffsetX.SetValue(offset_x)
+                self.offset_x = offset_x
+            if offset_y != self.offset_y:
+                if self.cam.OffsetY.GetAccessMode() != PySpin.RW:
+                    return False
+                self.cam.OffsetY.SetValue(offset_y)
+                self.offset_y = offset_y
+            return True
+        except PySpin.SpinnakerException as ex:
+            print("Error: %s" % ex)
+            return False
+        
+    def snap(self,node,value):
+        '''
+        clamp a value to the range of an integer node and round it down to
+        the node increment
+        '''
+        vmin = node.GetMin()
+        vmax = node.GetMax()
+        inc = node.GetInc()
+        value = min(max(int(value), vmin), vmax)
+        return vmin + ((value - vmin) // inc) * inc
+    
+    def enable_chunk_offsets(self):
+        '''
+        send the region offsets as chunk data with every image, so frames
+        taken before a move of the region are not attributed to the new one
+        
+        return: True if the camera supports it
+        '''
+        try:
+            self.cam.ChunkModeActive.SetValue(True)
+            for selector in (PySpin.ChunkSelector_OffsetX, PySpin.ChunkSelector_OffsetY):
+                self.cam.ChunkSelector.SetValue(selector)
+                self.cam.ChunkEnable.SetValue(True)
+            return True
+        except (PySpin.SpinnakerException, AttributeError) as ex:
+            print('Chunk data not available, using the last written offsets: %s' % ex)
+            return False
+            
+    def read_pixel_format(self):
+        '''
+        read the pixel format the camera streams in, e.g. Mono8 or BayerRG8
+        '''
+        try:
+            node_pixel_format = self.get_node(self.nodemap,"PixelFormat",PySpin.CEnumerationPtr)
+            if PySpin.IsAvailable(node_pixel_format) and PySpin.IsReadable(node_pixel_format):
+                return node_pixel_format.GetCurrentEntry().GetSymbolic()
+            return 'N/A'
+        except PySpin.SpinnakerException as ex:
+            print("Error: %s" % ex)
+            return 'N/A'
+            
+    def get_pixel_format(self):
+        '''
+        get the pixel format detected when the camera was opened
+        '''
+        return self.pixel_format
+    
+    def get_demosaic(self):
+        '''
+        get the name of the algorithm used to convert Bayer images to Mono8
+        '''
+        return self.demosaic
+    
+    def set_demosaic(self,name):
+        '''
+        set the algorithm used to convert Bayer images to Mono8, has no
+        effect on cameras streaming Mono8
+        
+        name: one of DEMOSAIC_ALGORITHMS
+        '''
+        if name not in DEMOSAIC_ALGORITHMS:
+            print('Unknown demosaic algorithm %s' % name)
+            return None
+        self.demosaic = name
+        self.demosaic_algorithm = getattr(PySpin,name)
+            
     def get_exp_min(self):
         '''
         get min exposure time in microseconds
@@ -343,7 +651,7 @@ class FLIRCamDev(object):
         get the video mode of the camera
         '''
         try:
-            node_video_mode = PySpin.CEnumerationPtr(self.nodemap.GetNode("VideoMode"))
+            node_video_mode = self.get_node(self.nodemap,"VideoMode",PySpin.CEnumerationPtr)
             return int(node_video_mode.GetCurrentEntry().GetSymbolic()[4])
         except PySpin.SpinnakerException as ex:
             print("Error: %s" % ex)
@@ -356,7 +664,7 @@ class FLIRCamDev(object):
         mode_number: integer number of the video mode
         '''
         try:
-            node_video_mode = PySpin.CEnumerationPtr(self.nodemap.GetNode("VideoMode"))
+            node_video_mode = self.get_node(self.nodemap,"VideoMode",PySpin.CEnumerationPtr)
             Mode0 = node_video_mode.GetEntryByName("Mode0")
             Mode1 = node_video_mode.GetEntryByName("Mode1")
             Mode2 = node_video_mode.GetEntryByName("Mode2")
@@ -369,6 +677,54 @@ class FLIRCamDev(object):
     '''
     Streaming information
     '''
+    def get_node(self,nodemap,name,ptr_type = PySpin.CValuePtr):
+        '''
+        get the handle of a node by name, handles are looked up once and
+        cached until the camera is reopened
+        
+        nodemap: the node map holding the node, e.g. self.nodemap
+        name: name of the node, e.g. Width
+        ptr_type: PySpin pointer class of the node, e.g. PySpin.CIntegerPtr
+        '''
+        key = (id(nodemap),name,ptr_type)
+        node = self.node_cache.get(key)
+        if node is None:
+            node = ptr_type(nodemap.GetNode(name))
+            self.node_cache[key] = node
+        return node
+    
+    def find_feature(self,nodemap,node_name,feature_name):
+        '''
+        get the handle of a feature, the category is only scanned if the
+        feature cannot be looked up by name. The handle is cached
+        
+        nodemap: the node map of a collection of camera properties,
+                e.g. TLDEVICE
+        
+        node_name: Name of the specific node, such as DeviceInformation
+        
+        feature_name: Name of the specific feature, such as ModelNumber
+        
+        return: CValuePtr of the feature, None if it is not found
+        '''
+        key = (id(nodemap),node_name,feature_name)
+        if key in self.node_cache:
+            return self.node_cache[key]
+        node_feature = PySpin.CValuePtr(nodemap.GetNode(feature_name))
+        if not PySpin.IsAvailable(node_feature):
+            node_feature = None
+            node = PySpin.CCategoryPtr(nodemap.GetNode(node_name))
+            if PySpin.IsAvailable(node) and PySpin.IsReadable(node):
+                for feature in node.GetFeatures():
+                    if PySpin.CValuePtr(feature).GetName() == feature_name:
+                        node_feature = PySpin.CValuePtr(feature)
+                        break
+        if node_feature is None:
+            print('No feature named %s found' % feature_name)
+            return None
+        self.node_cache[key] = node_feature
+        return node_feature
+    
     def get_feature(self,nodemap,node_name,feature_name):
         '''
         method to get any stt from a camera
@@ -381,16 +737,10 @@ class FLIRCamDev(object):
         feature_name: Name of the specific feature, such as ModelNumber
         '''
         try:
-            node = PySpin.CCategoryPtr(nodemap.GetNode(node_name))
-            if PySpin.IsAvailable(node) and PySpin.IsReadable(node):
-                features = node.GetFeatures()
-                for feature in features:
-                    node_feature = PySpin.CValuePtr(feature)
-                    if node_feature.GetName() == feature_name:
-                        return node_feature.ToString()
-            else:
-                print('No feature named %s found' % feature_name)
-                return None
+            node_feature = self.find_feature(nodemap,node_name,feature_name)
+            if node_feature is not None:
+                return node_feature.ToString()
+            return None
         except PySpin.SpinnakerException as ex:
             print("Error: %s" % ex)         
 
@@ -406,17 +756,10 @@ class FLIRCamDev(object):
         feature_name: Name of the specific feature, such as ModelNumber
         '''
         try:
-            node = PySpin.CCategoryPtr(nodemap.GetNode(node_name))
-            if PySpin.IsAvailable(node) and PySpin.IsReadable(node):
-                features = node.GetFeatures()
-                for feature in features:
-                    node_feature = PySpin.CValuePtr(feature)
-                    if node_feature.GetName() == feature_name:
-                            node_feature.FromString(value)
-                            
-            else:
-                print('No feature named %s found' % feature_name)
-                return None
+            node_feature = self.find_feature(nodemap,node_name,feature_name)
+            if node_feature is not None:
+                node_feature.FromString(value)
+            return None
         except PySpin.SpinnakerException as ex:
             print("Error: %s" % ex)            
             
@@ -5,7 +5,14 @@ Created on Aug 9, 2017
 '''
 
 from ScopeFoundry import HardwareComponent
-from .flircam_dev import FLIRCamDev
+from .flircam_sim_dev import FLIRCamSimDev
+try:
+    from .flircam_dev import FLIRCamDev, DEMOSAIC_ALGORITHMS
+except ImportError as ex:
+    #PySpin is not installed, only the simulated camera can be used
+    print('Warning: %s, only simulated cameras are available' % ex)
+    FLIRCamDev = None
+    DEMOSAIC_ALGORITHMS = ['BILINEAR']
 
 class FLIRCamHW(HardwareComponent):
     '''
@@ -23,12 +30,44 @@ class FLIRCamHW(HardwareComponent):
         self.settings.New(name = 'exposure_time', dtype = float, initial = 1000, ro = False)
         self.settings.New(name = 'video_mode', dtype = int, initial = 0, ro = False, vmin = 0, vmax = 2)
         self.settings.New(name = 'frame_rate', dtype = float, initial = 60, ro = False, vmin = 0, vmax = 100)
+        self.settings.New(name = 'pixel_format', dtype = str, initial = 'N/A', ro = True)
+        self.settings.New(name = 'demosaic', dtype = str, initial = 'BILINEAR', ro = False,
+                          choices = DEMOSAIC_ALGORITHMS)
+        
+        #simulated camera, replays an avi file or renders a walking ant
+        self.settings.New(name = 'simulated', dtype = bool, initial = FLIRCamDev is None, ro = False)
+        self.settings.New(name = 'sim_source', dtype = 'file', initial = '', ro = False)
+        self.settings.New(name = 'sim_drop_rate', dtype = float, initial = 0, ro = False, vmin = 0, vmax = 1)
+        self.settings.New(name = 'sim_incomplete_rate', dtype = float, initial = 0, ro = False, vmin = 0, vmax = 1)
+        
+        #region of interest read out from the sensor, in camera pixels
+        self.settings.New(name = 'sensor_width', dtype = int, initial = 1920, ro = True)
+        self.settings.New(name = 'sensor_height', dtype = int, initial = 1200, ro = True)
+        self.settings.New(name = 'sensor_binning', dtype = int, initial = 1, ro = False, vmin = 1, vmax = 4)
+        self.settings.New(name = 'roi', dtype = bool, initial = False, ro = False)
+        self.settings.New(name = 'roi_width', dtype = int, initial = 256, ro = False, vmin = 8)
+        self.settings.New(name = 'roi_height', dtype = int, initial = 256, ro = False, vmin = 8)
+        self.settings.New(name = 'offset_x', dtype = int, initial = 0, ro = True)
+        self.settings.New(name = 'offset_y', dtype = int, initial = 0, ro = True)
+        
+        #frame counters since the acquisition started
+        self.settings.New(name = 'frames_acquired', dtype = int, initial = 0, ro = True)
+        self.settings.New(name = 'frames_dropped', dtype = int, initial = 0, ro = True)
+        self.settings.New(name = 'frames_incomplete', dtype = int, initial = 0, ro = True)
+        self.settings.New(name = 'convert_failures', dtype = int, initial = 0, ro = True)
         
         
                 
     def connect(self):
         #connect to the camera device
-        self._dev=FLIRCamDev(self.settings.camera_sn.value())
+        if self.settings.simulated.value():
+            self._dev=FLIRCamSimDev(self.settings.camera_sn.value(),
+                                    source = self.settings.sim_source.value(),
+                                    frame_rate = self.settings.frame_rate.value(),
+                                    drop_rate = self.settings.sim_drop_rate.value(),
+                                    incomplete_rate = self.settings.sim_incomplete_rate.value())
+        else:
+            self._dev=FLIRCamDev(self.settings.camera_sn.value())
         
         #define read functions
         self.settings.model.hardware_read_func = self._dev.get_model
@@ -38,12 +77,31 @@ class FLIRCamHW(HardwareComponent):
         self.settings.exposure_time.hardware_read_func = self._dev.get_exp
         self.settings.video_mode.hardware_read_func = self._dev.get_video_mode
         self.settings.frame_rate.hardware_read_func = self._dev.get_frame_rate
+        self.settings.pixel_format.hardware_read_func = self._dev.get_pixel_format
+        self.settings.demosaic.hardware_read_func = self._dev.get_demosaic
+        self.settings.sensor_width.hardware_read_func = self._dev.get_sensor_width
+        self.settings.sensor_height.hardware_read_func = self._dev.get_sensor_height
+        self.settings.sensor_binning.hardware_read_func = self._dev.get_sensor_binning
+        self.settings.offset_x.hardware_read_func = self._dev.get_offset_x
+        self.settings.offset_y.hardware_read_func = self._dev.get_offset_y
+        self.settings.frames_acquired.hardware_read_func = self._dev.get_frames_acquired
+        self.settings.frames_dropped.hardware_read_func = self._dev.get_frames_dropped
+        self.settings.frames_incomplete.hardware_read_func = self._dev.get_frames_incomplete
+        self.settings.convert_failures.hardware_read_func = self._dev.get_convert_failures
         
         #define set functions
         self.settings.auto_exposure.hardware_set_func = self._dev.set_auto_exposure
         self.settings.exposure_time.hardware_set_func = self._dev.set_exp
         self.settings.video_mode.hardware_set_func = self._dev.set_video_mode
         self.settings.frame_rate.hardware_set_func = self._dev.set_frame_rate
+        self.settings.demosaic.hardware_set_func = self._dev.set_demosaic
+        self.settings.sensor_binning.hardware_set_func = self.set_sensor_binning
+        self.settings.roi.hardware_set_func = self.apply_roi
+        
+        #apply the chosen demosaic before reading the camera info
+        self._dev.set_demosaic(self.settings.demosaic.value())
+        if self.settings.roi.value():
+            self._dev.set_roi(self.settings.roi_width.value(),self.settings.roi_height.value())
         
         #read camera info
         self.read_from_hardware()
@@ -59,6 +117,54 @@ class FLIRCamHW(HardwareComponent):
     def read(self):
         return self._dev.read()
     
+    def read_frame(self):
+        return self._dev.read_frame()
+    
+    def apply_roi(self,enable = None):
+        '''
+        read out a region of roi_width x roi_height centered on the sensor,
+        or the full sensor, only possible while the camera is not acquiring
+        
+        enable: use the region of interest, defaults to the roi setting
+        '''
+        if enable is None:
+            enable = self.settings.roi.value()
+        if enable:
+            self._dev.set_roi(self.settings.roi_width.value(),self.settings.roi_height.value())
+        else:
+            self._dev.reset_roi()
+        for name in ('width','height','offset_x','offset_y'):
+            self.settings.get_lq(name).read_from_hardware()
+    
+    def set_sensor_binning(self,binning):
+        self._dev.set_sensor_binning(binning)
+        for name in ('sensor_width','sensor_height'):
+            self.settings.get_lq(name).read_from_hardware()
+        self.apply_roi()
+        
+    def move_roi(self,offset_x,offset_y):
+        '''
+        move the region of interest during acquisition, see FLIRCamDev.move_roi
+        '''
+        return self._dev.move_roi(offset_x,offset_y)
+    
+    def read_roi(self):
+        '''
+        update the offset settings from the camera
+        '''
+        self.settings.offset_x.read_from_hardware()
+        self.settings.offset_y.read_from_hardware()
+    
+    def read_frame_stats(self):
+        '''
+        update the frame counter settings from the camera
+        '''
+        for name in ('frames_acquired','frames_dropped','frames_incomplete','convert_failures'):
+            self.settings.get_lq(name).read_from_hardware()
+    
+    def get_frame_stats(self):
+        return self._dev.get_frame_stats()
+    
     def empty(self):
         return self._dev.empty()
     
@@ -81,11 +187,25 @@ class FLIRCamHW(HardwareComponent):
             self.settings.exposure_time.hardware_read_func = None
             self.settings.video_mode.hardware_read_func = None
             self.settings.frame_rate.hardware_read_func = None
+            self.settings.pixel_format.hardware_read_func = None
+            self.settings.demosaic.hardware_read_func = None
+            self.settings.sensor_width.hardware_read_func = None
+            self.settings.sensor_height.hardware_read_func = None
+            self.settings.sensor_binning.hardware_read_func = None
+            self.settings.offset_x.hardware_read_func = None
+            self.settings.offset_y.hardware_read_func = None
+            self.settings.frames_acquired.hardware_read_func = None
+            self.settings.frames_dropped.hardware_read_func = None
+            self.settings.frames_incomplete.hardware_read_func = None
+            self.settings.convert_failures.hardware_read_func = None
             #remove set functions
             self.settings.auto_exposure.hardware_set_func = None
             self.settings.exposure_time.hardware_set_func = None
             self.settings.video_mode.hardware_set_func = None
             self.settings.frame_rate.hardware_set_func = None
+            self.settings.demosaic.hardware_set_func = None
+            self.settings.sensor_binning.hardware_set_func = None
+            self.settings.roi.hardware_set_func = None
             
             self._dev.close()
             del self._dev
@@ -0,0 +1,450 @@
+import time
+import numpy as np
+from .frame_pool import FramePool, FrameStats
+
+'''
+FLIRCamSimDev is a drop-in replacement of FLIRCamDev that does not need
+PySpin or a camera. It serves frames at the set frame rate, either replayed
+from a recorded avi file (needs opencv) or rendered as a dark ant walking on a
+bright arena. Dropped and incomplete frames can be injected to test the
+processing pipeline
+'''
+
+class SimImage(object):
+    '''
+    Image object with the part of the PySpin image interface used by AntCam
+    '''
+    def __init__(self, data, frame_id, timestamp, incomplete = False):
+        self.data = data
+        self.frame_id = frame_id
+        self.timestamp = timestamp
+        self.incomplete = incomplete
+
+    def GetImageStatus(self):
+        #3 is the Spinnaker status for missing packets
+        return 3 if self.incomplete else 0
+
+    def IsIncomplete(self):
+        return self.incomplete
+
+    def GetBufferSize(self):
+        return self.data.nbytes
+
+    def GetWidth(self):
+        return self.data.shape[1]
+
+    def GetHeight(self):
+        return self.data.shape[0]
+
+    def GetData(self):
+        return self.data.ravel().copy()
+
+    def GetNDArray(self):
+        return self.data
+
+    def GetFrameID(self):
+        return self.frame_id
+
+    def GetTimeStamp(self):
+        return self.timestamp
+
+    def Convert(self, pixel_format = None, algorithm = None):
+        return self
+
+    def Release(self):
+        pass
+
+    def Save(self, fname):
+        np.save(fname, self.data)
+
+class SyntheticAnt(object):
+    '''
+    Renders a dark elliptical ant walking a smooth random path in a bright,
+    noisy arena
+    '''
+    def __init__(self, height, width, speed = 6.0, length = 60, ant_width = 20,
+                 background = 200, ant = 20, noise = 5, seed = 0):
+        '''
+        speed: distance walked between two frames in pixels
+        length, ant_width: size of the ant in pixels
+        background, ant: pixel values of the arena and of the ant
+        noise: standard deviation of the pixel noise
+        '''
+        self.height = height
+        self.width = width
+        self.speed = speed
+        self.length = length
+        self.ant_width = ant_width
+        self.ant = ant
+        self.rng = np.random.default_rng(seed)
+        #a few noise patterns are rendered once and cycled, drawing new noise
+        #for every frame would be slower than the camera
+        self.backgrounds = [np.clip(self.rng.normal(background, noise, (height, width)), 0, 255).astype(np.uint8)
+                            for i in range(4)]
+        self.position = np.array([height / 2.0, width / 2.0])
+        self.heading = 0.0
+        self.count = 0
+        half = int(length // 2) + 1
+        self.box_rows, self.box_cols = np.mgrid[-half:half + 1, -half:half + 1]
+
+    def step(self):
+        '''
+        walk one frame, turning back from the walls
+        '''
+        self.heading += self.rng.normal(0, 0.15)
+        direction = np.array([np.cos(self.heading), np.sin(self.heading)])
+        new_position = self.position + self.speed * direction
+        margin = self.length
+        if not (margin < new_position[0] < self.height - margin and
+                margin < new_position[1] < self.width - margin):
+            self.heading += np.pi
+            new_position = self.position - self.speed * direction
+        self.position = new_position
+
+    def render(self, out):
+        '''
+        draw the next frame into out
+        '''
+        self.step()
+        np.copyto(out, self.backgrounds[self.count % len(self.backgrounds)])
+        self.count += 1
+
+        r = int(self.position[0])
+        c = int(self.position[1])
+        c_h, s_h = np.cos(self.heading), np.sin(self.heading)
+        rows = self.box_rows + (r - self.position[0])
+        cols = self.box_cols + (c - self.position[1])
+        along = rows * c_h + cols * s_h
+        across = -rows * s_h + cols * c_h
+        body = (along / (self.length / 2))**2 + (across / (self.ant_width / 2))**2 <= 1
+
+        half = self.box_rows.shape[0] // 2
+        r0 = r - half
+        c0 = c - half
+        box = out[max(r0, 0):r0 + 2 * half + 1, max(c0, 0):c0 + 2 * half + 1]
+        body = body[max(-r0, 0):max(-r0, 0) + box.shape[0], max(-c0, 0):max(-c0, 0) + box.shape[1]]
+        box[body] = self.ant
+
+class AviSource(object):
+    '''
+    Replays the frames of an avi file, e.g. a recorded track_mov, in a loop
+    '''
+    def __init__(self, fname):
+        import cv2
+        self.cv2 = cv2
+        self.fname = fname
+        self.cap = cv2.VideoCapture(fname)
+        if not self.cap.isOpened():
+            raise IOError('Unable to open %s' % fname)
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+
+    def render(self, out):
+        ret, frame = self.cap.read()
+        if not ret:
+            #rewind at the end of the file
+            self.cap.set(self.cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read()
+            if not ret:
+                raise IOError('Unable to read a frame from %s' % self.fname)
+        if frame.ndim == 3:
+            frame = self.cv2.cvtColor(frame, self.cv2.COLOR_BGR2GRAY)
+        np.copyto(out, frame)
+
+    def close(self):
+        self.cap.release()
+
+class FLIRCamSimDev(object):
+    '''
+    Simulated camera with the same interface as FLIRCamDev
+    '''
+    def __init__(self, camera_sn, source = '', width = 1024, height = 1024,
+                 frame_rate = 50, drop_rate = 0.0, incomplete_rate = 0.0, seed = 0):
+        '''
+        camera_sn: serial number, only used for messages
+        source: path to an avi file to replay, synthetic frames if empty
+        width, height: size of synthetic frames
+        frame_rate: frame rate in fps
+        drop_rate: probability that a frame is dropped by the camera
+        incomplete_rate: probability that a frame arrives incomplete
+        seed: seed of the random generator
+        '''
+        self.camera_sn = camera_sn
+        self.source = source
+        self.width = width
+        self.height = height
+        self.frame_rate = frame_rate
+        self.drop_rate = drop_rate
+        self.incomplete_rate = incomplete_rate
+        self.rng = np.random.default_rng(seed)
+        self.seed = seed
+        self.exposure = 500
+        self.auto_exposure = False
+        self.video_mode = 0
+        self.buffer_count = 10
+        self.demosaic = 'BILINEAR'
+        self.pixel_format = 'Mono8'
+        self.native_mono8 = True
+        self.open()
+
+    '''
+    Camera operations
+    '''
+    def open(self):
+        '''
+        open the frame source
+        '''
+        if self.source:
+            self.frame_source = AviSource(self.source)
+            self.height = self.frame_source.height
+            self.width = self.frame_source.width
+        else:
+            self.frame_source = SyntheticAnt(self.height, self.width, seed = self.seed)
+        self.sensor_height = self.height
+        self.sensor_width = self.width
+        self.sensor_binning = 1
+        self.offset_x = 0
+        self.offset_y = 0
+        #full sensor image, only used when a region of interest is set
+        self.sensor_buffer = None
+        self.frame_pool = FramePool((self.height,self.width),np.uint8)
+        self.frame_stats = FrameStats()
+        self.acquiring = False
+        self.frame_id = 0
+        self.start_time = None
+
+    def start(self):
+        '''
+        start the acquisition, frames are due at a fixed rate from now on
+        '''
+        self.frame_stats.reset()
+        self.start_time = time.perf_counter()
+        self.next_frame = 0
+        self.acquiring = True
+
+    def stop(self):
+        self.acquiring = False
+
+    def close(self):
+        self.stop()
+        if hasattr(self.frame_source, 'close'):
+            self.frame_source.close()
+        print('Simulated camera %s closed' % self.camera_sn)
+
+    '''
+    Data operations
+    '''
+    def wait_for_frame(self):
+        '''
+        wait until the next frame is due, the way GetNextImage blocks
+
+        return: frame id and camera timestamp in ns of the frame
+        '''
+        if not self.acquiring:
+            raise RuntimeError('Camera %s is not acquiring' % self.camera_sn)
+        period = 1.0 / self.frame_rate
+
+        #frames that fell out of the stream buffers while the reader was late
+        elapsed = time.perf_counter() - self.start_time
+        late = int(elapsed / period) - self.next_frame
+        if late > self.buffer_count:
+            self.next_frame += late - self.buffer_count
+
+        #frames the camera failed to deliver
+        while self.drop_rate > 0 and self.rng.random() < self.drop_rate:
+            self.next_frame += 1
+
+        due = self.start_time + self.next_frame * period
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        frame_id = self.next_frame
+        self.next_frame += 1
+        return frame_id, int((due - self.start_time) * 1e9)
+
+    def read(self):
+        '''
+        read and return the next frame as an image object
+        '''
+        frame_id, timestamp = self.wait_for_frame()
+        self.frame_stats.count(frame_id)
+        data = np.zeros((self.height,self.width),dtype = np.uint8)
+        self.render(data)
+        incomplete = self.incomplete_rate > 0 and self.rng.random() < self.incomplete_rate
+        return SimImage(data, frame_id, timestamp, incomplete)
+
+    def read_frame(self):
+        '''
+        render the next frame straight into a buffer of the frame pool,
+        the caller owns one lease on the frame and has to release it
+        '''
+        #wait_for_frame raises once the acquisition stopped, lease after it
+        frame_id, timestamp = self.wait_for_frame()
+        host_time = time.perf_counter()
+        frame = self.frame_pool.lease()
+        frame.frame_id, frame.timestamp = frame_id, timestamp
+        frame.host_time = host_time
+        frame.offset_x = self.offset_x
+        frame.offset_y = self.offset_y
+        self.frame_stats.count(frame.frame_id)
+        try:
+            self.render(frame.data)
+        except Exception:
+            frame.release()
+            raise
+        frame.valid = not (self.incomplete_rate > 0 and self.rng.random() < self.incomplete_rate)
+        if not frame.valid:
+            print('incomplete image, returning ones')
+            self.frame_stats.incomplete += 1
+            frame.data[:] = 1
+        return frame
+
+    def render(self, out):
+        '''
+        render the region of interest of the next sensor image into out, on
+        sensor binning is simulated by decimation
+        '''
+        if self.sensor_buffer is None:
+            self.frame_source.render(out)
+            return
+        self.frame_source.render(self.sensor_buffer)
+        b = self.sensor_binning
+        binned = self.sensor_buffer[::b, ::b]
+        np.copyto(out, binned[self.offset_y:self.offset_y + self.height,
+                              self.offset_x:self.offset_x + self.width])
+
+    def to_numpy(self,image):
+        '''
+        Convert an image object to data, returns ones for incomplete images
+        '''
+        if image.IsIncomplete():
+            print('incomplete image, returning ones')
+            self.frame_stats.incomplete += 1
+            return np.ones((self.height,self.width),dtype = np.uint8)
+        return np.copy(image.GetNDArray())
+
+    def save_image(self,image):
+        image.Save('buffer')
+
+    '''
+    Setting Functions
+    '''
+    def get_model(self):
+        return 'Simulated'
+
+    def get_width(self):
+        return self.width
+
+    def get_height(self):
+        return self.height
+
+    def get_sensor_width(self):
+        return self.sensor_width // self.sensor_binning
+
+    def get_sensor_height(self):
+        return self.sensor_height // self.sensor_binning
+
+    def get_offset_x(self):
+        return self.offset_x
+
+    def get_offset_y(self):
+        return self.offset_y
+
+    def get_sensor_binning(self):
+        return self.sensor_binning
+
+    def set_sensor_binning(self,binning):
+        if self.acquiring:
+            print('Unable to set sensor binning during acquisition')
+            return None
+        self.sensor_binning = max(int(binning), 1)
+        self.reset_roi()
+
+    def set_roi(self,width,height,offset_x = None,offset_y = None):
+        if self.acquiring:
+            print('Unable to set the region of interest during acquisition')
+            return None
+        self.width = min(max(int(width), 8), self.get_sensor_width())
+        self.height = min(max(int(height), 8), self.get_sensor_height())
+        full = (self.width == self.sensor_width and self.height == self.sensor_height)
+        if full and self.sensor_binning == 1:
+            self.sensor_buffer = None
+        elif self.sensor_buffer is None:
+            self.sensor_buffer = np.zeros((self.sensor_height,self.sensor_width),dtype = np.uint8)
+        self.frame_pool = FramePool((self.height,self.width),np.uint8)
+        if offset_x is None:
+            offset_x = (self.get_sensor_width() - self.width) // 2
+        if offset_y is None:
+            offset_y = (self.get_sensor_height() - self.height) // 2
+        self.offset_x = 0
+        self.offset_y = 0
+        self.move_roi(offset_x, offset_y)
+
+    def reset_roi(self):
+        self.set_roi(self.get_sensor_width(),self.get_sensor_height(),0,0)
+
+    def move_roi(self,offset_x,offset_y):
+        self.offset_x = min(max(int(offset_x), 0), self.get_sensor_width() - self.width)
+        self.offset_y = min(max(int(offset_y), 0), self.get_sensor_height() - self.height)
+        return True
+
+    def get_pixel_format(self):
+        return self.pixel_format
+
+    def get_demosaic(self):
+        return self.demosaic
+
+    def set_demosaic(self,name):
+        self.demosaic = name
+
+    def get_exp_min(self):
+        return 10
+
+    def get_exp_max(self):
+        return 30000
+
+    def get_exp(self):
+        return self.exposure
+
+    def set_exp(self,exp_time):
+        self.exposure = min(max(exp_time,self.get_exp_min()),self.get_exp_max())
+
+    def get_frame_rate(self):
+        return self.frame_rate
+
+    def set_frame_rate(self,fr):
+        if fr > 0:
+            self.frame_rate = fr
+
+    def get_auto_exposure(self):
+        return self.auto_exposure
+
+    def set_auto_exposure(self,mode):
+        self.auto_exposure = mode
+
+    def get_video_mode(self):
+        return self.video_mode
+
+    def set_video_mode(self,mode_number):
+        self.video_mode = mode_number
+
+    def get_buffer_count(self):
+        return self.buffer_count
+
+    def set_buffer_count(self,value):
+        self.buffer_count = int(value)
+
+    def get_frame_stats(self):
+        return self.frame_stats.as_dict()
+
+    def get_frames_acquired(self):
+        return self.frame_stats.acquired
+
+    def get_frames_dropped(self):
+        return self.frame_stats.dropped
+
+    def get_frames_incomplete(self):
+        return self.frame_stats.incomplete
+
+    def get_convert_failures(self):
+        return self.frame_stats.convert_failures
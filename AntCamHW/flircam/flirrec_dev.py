@@ -3,22 +3,233 @@ Created on Mar 29, 2018
 
 @author: Hao Wu
 '''
-import PySpin
+try:
+    import PySpin
+except ImportError:
+    #avi recording needs PySpin, e.g. not installed with a simulated camera
+    PySpin = None
+try:
+    import h5py
+except ImportError:
+    #lossless recording needs h5py
+    h5py = None
+import numpy as np
 import os
+import csv
+import glob
 import time
+import queue
+import threading
+from .frame_pool import Frame
 class AviType(object):
     """'Enum' to select AVI video type to be created and saved"""
     UNCOMPRESSED = 0
     MJPG = 1
     H264 = 2
 
+# what save_frame does when the write queue of a recorder is full
+WRITE_POLICIES = ['block', 'drop', 'spill']
+
+# per-frame metadata stored next to the frames of a lossless recording,
+# row and col are the centroid, x and y the motor position
+FRAME_META_DTYPE = np.dtype([('index', np.int64),
+                             ('timestamp', np.int64),
+                             ('frame_id', np.int64),
+                             ('host_time', np.float64),
+                             ('row', np.float64),
+                             ('col', np.float64),
+                             ('x', np.float64),
+                             ('y', np.float64)])
+
+class SegmentIndex(object):
+    '''
+    CSV table of the segments of a recording, one row per closed segment with
+    its first frame, the camera and host time of that frame and its size on
+    disk, so a time can be found without opening every segment. Rows are
+    appended as segments close, the index is complete up to the last closed
+    segment if the recording is interrupted.
+    start_frame counts the frames written to the segments before, so frame
+    k of the recording is frame k - start_frame of its segment file.
+    start_index is the index the first frame was queued with, it also
+    counts the frames the write policy dropped or spilled
+    '''
+    columns = ('segment', 'file', 'start_frame', 'start_index', 'start_timestamp', 'start_host_time',
+               'frames', 'bytes')
+    
+    def __init__(self, fname):
+        '''
+        fname: index file name
+        '''
+        self.fname = fname
+        with open(self.fname, 'w', newline = '') as f:
+            csv.writer(f).writerow(self.columns)
+            
+    def add(self, *row):
+        '''
+        append a segment, values in the order of columns
+        '''
+        with open(self.fname, 'a', newline = '') as f:
+            csv.writer(f).writerow(row)
+            
+def read_segment_index(fname):
+    '''
+    read a segment index file
+    
+    fname: index file name
+    return: list of dicts, one per segment, see SegmentIndex.columns
+    '''
+    types = {'file': str, 'start_host_time': float}
+    with open(fname, newline = '') as f:
+        return [dict((key, types.get(key, int)(value)) for key, value in row.items())
+                for row in csv.DictReader(f)]
+    
+def find_segment(segments, t, key = 'start_host_time'):
+    '''
+    find the segment holding time t
+    
+    segments: segment index, see read_segment_index
+    t: time, in the unit of key
+    key: 'start_host_time' (s) or 'start_timestamp' (camera clock, ns)
+    return: segment dict, the first segment if t is before the recording,
+    its start_frame is the offset of the segment file in the written frames
+    '''
+    found = segments[0]
+    for segment in segments:
+        if segment['frames'] > 0 and segment[key] <= t:
+            found = segment
+    return found
+
 class Recorder(object):
     '''
-    PySpin AVI recorder binding
+    PySpin AVI recorder binding. Frames are compressed and appended by a
+    writer thread fed by a bounded queue, save_frame only queues the frame.
+    
+    With a segment limit the writer starts a new file (fname_s000,
+    fname_s001, ...) when the current one reaches the duration or the size,
+    every segment is listed in fname-index.csv, see SegmentIndex
     '''
-    def __init__(self, fname, frame_rate, compress = True):
+    #frames between two checks of the segment size on disk
+    size_check = 32
+    
+    def __init__(self, fname, frame_rate, compress = True, policy = 'block', queue_size = 64,
+                 segment_seconds = 0, segment_bytes = 0):
+        '''
+        fname: file name without extension
+        frame_rate: frame rate of the video in fps
+        compress: MJPG compression, uncompressed AVI otherwise
+        policy: what save_frame does when the queue is full, 'block' waits
+                for the writer, 'drop' skips the frame and 'spill' writes the
+                raw frame to fname-spill.raw, see WRITE_POLICIES
+        queue_size: number of frames waiting for the writer
+        segment_seconds: video duration of a segment at frame_rate, 0 for no limit
+        segment_bytes: size of a segment on disk, 0 for no limit
+        '''
         self.fname = fname
         self.frame_rate = frame_rate
+        self.compress = compress
+        
+        if policy not in WRITE_POLICIES:
+            raise ValueError('Unknown write policy %s' % policy)
+        self.policy = policy
+        
+        #segments, the file is only split if there is a limit
+        self.segment_frames = int(round(segment_seconds * frame_rate))
+        self.segment_bytes = int(segment_bytes)
+        self.segmented = self.segment_frames > 0 or self.segment_bytes > 0
+        self.segment = 0
+        if self.segment_files(self.segment_name(0)):
+            print("File already exists, saving with timestamp")
+            timestamp =time.strftime('%H%M%S',time.localtime())
+            self.fname = self.fname + timestamp
+        self.index = SegmentIndex(self.fname + '-index.csv')
+        self.open_segment()
+        
+        #statistics
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.max_depth = 0
+        self.encode_time = 0.0
+        self.max_encode_time = 0.0
+        
+        #raw frames written when the queue is full with the spill policy
+        self.spill_file = None
+        self.spill_index = []
+        
+        #a single writer keeps the frames in order
+        self.closed = False
+        self.queue = queue.Queue(queue_size)
+        self.writer = threading.Thread(target = self.write_loop, name = 'writer ' + os.path.basename(self.fname))
+        self.writer.daemon = True
+        self.writer.start()
+        
+    def segment_name(self, segment):
+        '''
+        return: file name of a segment without extension
+        '''
+        if self.segmented:
+            return '%s_s%03i' % (self.fname, segment)
+        return self.fname
+    
+    def segment_files(self, name):
+        '''
+        return: files written for a segment, the AVI recorder splits a
+        segment into name-0000.avi, name-0001.avi, ... at 2 GB
+        '''
+        return sorted(glob.glob(glob.escape(name) + '-[0-9][0-9][0-9][0-9].avi'))
+    
+    def open_segment(self):
+        '''
+        open the file of the current segment
+        '''
+        self.segment_count = 0
+        self.segment_start = (-1, -1, 0, np.nan)
+        self.open_file(self.compress)
+        
+    def close_segment(self):
+        '''
+        close the file of the current segment and add it to the index
+        '''
+        self.close_file()
+        files = self.segment_files(self.segment_name(self.segment))
+        start_frame, start_index, start_timestamp, start_host_time = self.segment_start
+        self.index.add(self.segment, os.path.basename(files[0]) if files else '', start_frame, start_index,
+                       start_timestamp, start_host_time, self.segment_count,
+                       sum(os.path.getsize(f) for f in files))
+        
+    def segment_size(self):
+        '''
+        return: size of the current segment on disk in bytes
+        '''
+        return sum(os.path.getsize(f) for f in self.segment_files(self.segment_name(self.segment)))
+        
+    def rollover_due(self):
+        '''
+        return: whether the current segment reached its duration or size
+        '''
+        if self.segment_count == 0:
+            return False
+        if self.segment_frames > 0 and self.segment_count >= self.segment_frames:
+            return True
+        if self.segment_bytes > 0 and self.segment_count % self.size_check == 0:
+            return self.segment_size() >= self.segment_bytes
+        return False
+    
+    def rollover(self):
+        '''
+        close the current segment and open the next one, runs on the writer thread
+        '''
+        self.close_segment()
+        self.segment += 1
+        self.open_segment()
+        
+    def open_file(self, compress):
+        '''
+        open the AVI file of the current segment
+        '''
+        if PySpin is None:
+            raise RuntimeError('PySpin is not installed, unable to record %s' % self.fname)
         
         #setup option for AVIRecorder
         if compress:
@@ -35,32 +246,298 @@ class Recorder(object):
         #create instance for recorder    
         self.rec = PySpin.SpinVideo()
         
-        if os.path.exists(self.fname + '-0000.avi'):
-            print("File already exists, saving with timestamp")
-            timestamp =time.strftime('%H%M%S',time.localtime())
-            self.fname = self.fname + timestamp
         #create file
         try:
-            self.rec.Open(self.fname,option)
+            self.rec.Open(self.segment_name(self.segment),option)
         except PySpin.SpinnakerException as ex:
             print("Error: %s" % ex)
+            
+    def write(self, image, index, metadata = None):
+        '''
+        append a frame to the AVI file, runs on the writer thread
+        '''
+        self.rec.Append(self.to_image(image))
         
-    def save_frame(self,image):
-        try:
-            self.rec.Append(image)
-        except PySpin.SpinnakerException as ex:
-            print("Error: %s" % ex)
+    def close_file(self):
+        self.rec.Close()
+        
+    def save_frame(self,image,metadata = None):
+        '''
+        queue a frame for writing, the recorder holds a lease on a Frame and
+        copies a numpy array until the frame is written
+        
+        image: PySpin image object, Frame or 2d numpy array
+        metadata: dict of per-frame values, see FRAME_META_DTYPE, only kept
+                  by recorders with a metadata table
+        '''
+        if self.closed:
+            print('Error: recorder %s already closed' % self.fname)
+            return
+        if isinstance(image,Frame):
+            image.acquire()
+        elif isinstance(image,np.ndarray):
+            image = np.copy(image)
+        index = self.submitted
+        self.submitted += 1
+        
+        if self.policy == 'block':
+            self.queue.put((index,image,metadata))
+        else:
+            try:
+                self.queue.put_nowait((index,image,metadata))
+            except queue.Full:
+                if self.policy == 'spill':
+                    self.spill(index,image)
+                else:
+                    self.dropped += 1
+                self.release(image)
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
             
+    def write_loop(self):
+        '''
+        append the queued frames to the video until the end marker is queued
+        '''
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            index, image, metadata = item
+            t0 = time.perf_counter()
+            try:
+                if self.rollover_due():
+                    self.rollover()
+                if self.segment_count == 0:
+                    #written counts the frames in the files, index also the dropped ones
+                    if isinstance(image,Frame):
+                        self.segment_start = (self.written, index, image.timestamp, image.host_time)
+                    else:
+                        self.segment_start = (self.written, index, 0, np.nan)
+                self.write(image, index, metadata)
+                self.written += 1
+                self.segment_count += 1
+            except Exception as ex:
+                print("Error: %s" % ex)
+            finally:
+                self.release(image)
+            dt = time.perf_counter() - t0
+            self.encode_time += dt
+            if dt > self.max_encode_time:
+                self.max_encode_time = dt
+                
+    def spill(self,index,image):
+        '''
+        write the raw frame data to the spill file, the frame numbers of the
+        spilled frames are saved to fname-spill.npy when the recorder closes
+        '''
+        if isinstance(image,Frame):
+            data = image.data
+        elif isinstance(image,np.ndarray):
+            data = image
+        else:
+            data = image.GetNDArray()
+        if self.spill_file is None:
+            self.spill_file = open(self.fname + '-spill.raw','wb')
+            self.spill_shape = data.shape
+        self.spill_file.write(np.ascontiguousarray(data, dtype = np.uint8).tobytes())
+        self.spill_index.append(index)
+        self.spilled += 1
         
+    def release(self,image):
+        if isinstance(image,Frame):
+            image.release()
+            
+    def to_image(self,image):
+        '''
+        wrap frame data into a PySpin image object for the AVI recorder
+        '''
+        if isinstance(image,Frame):
+            data = image.data
+        elif isinstance(image,np.ndarray):
+            data = image
+        else:
+            return image
+        height, width = data.shape
+        return PySpin.Image.Create(width,height,0,0,PySpin.PixelFormat_Mono8,data)
+    
+    def get_stats(self):
+        '''
+        return: dict with the queue depth, the largest queue depth, the mean
+        and largest encode time per frame in seconds and the frame counters
+        '''
+        return {'queue_depth': self.queue.qsize(),
+                'max_queue_depth': self.max_depth,
+                'encode_time': self.encode_time / self.written if self.written else 0.0,
+                'max_encode_time': self.max_encode_time,
+                'submitted': self.submitted,
+                'written': self.written,
+                'dropped': self.dropped,
+                'spilled': self.spilled,
+                'segments': self.segment + 1}
+            
     def close(self):
-        self.rec.Close()
+        '''
+        write the frames left in the queue and close the file, can be called
+        more than once
+        '''
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.writer.join()
+        self.close_segment()
+        if self.spill_file is not None:
+            self.spill_file.close()
+            np.save(self.fname + '-spill.npy', np.array(self.spill_index, dtype = np.int64))
+            print('%i frames of %s spilled to %s-spill.raw, frame shape %s' %
+                  (self.spilled, self.fname, self.fname, self.spill_shape))
+    
+class H5Recorder(Recorder):
+    '''
+    Lossless recorder, every frame is one chunk of a chunked HDF5 dataset,
+    raw or lzf compressed, next to a table of per-frame metadata. Any frame
+    can be read back by index, see H5Video. lzf is not cheap on camera
+    frames: a 1024x1024 frame takes about 18-20 ms to write with lzf (0.8 ms
+    raw) and shrinks by only about 10%, so it is off by default, see
+    FLIRRecDev.h5_compress
+    '''
+    #frames the datasets grow by when they are full
+    grow = 256
+    
+    def segment_files(self, name):
+        return [name + '.h5'] if os.path.exists(name + '.h5') else []
+    
+    def segment_size(self):
+        #frames stay in the chunk cache until the file is flushed
+        self.flush_meta()
+        self.h5file.flush()
+        return Recorder.segment_size(self)
+    
+    def open_file(self, compress):
+        '''
+        open the HDF5 file of the current segment, the frame dataset is
+        created with the first frame
+        
+        compress: lzf filter, no filter otherwise, the whole frame budget at 50 fps
+        '''
+        if h5py is None:
+            raise RuntimeError('h5py is not installed, unable to record %s' % self.fname)
+        self.compression = 'lzf' if compress else None
+        self.h5file = h5py.File(self.segment_name(self.segment) + '.h5', 'w')
+        self.h5file.attrs['frame_rate'] = self.frame_rate
+        self.h5file.attrs['segment'] = self.segment
+        self.frames = None
+        self.meta = self.h5file.create_dataset('frame_meta', shape = (0,), maxshape = (None,),
+                                               dtype = FRAME_META_DTYPE, chunks = (self.grow,))
+        #metadata rows are written to the file a block at a time
+        self.meta_block = np.zeros(self.grow, dtype = FRAME_META_DTYPE)
+        self.meta_start = 0
+        self.count = 0
+        
+    def write(self, image, index, metadata = None):
+        '''
+        append a frame and its metadata, runs on the writer thread
+        '''
+        data = self.to_array(image)
+        if self.frames is None:
+            self.frames = self.h5file.create_dataset('frames', shape = (0,) + data.shape,
+                                                     maxshape = (None,) + data.shape,
+                                                     dtype = np.uint8, chunks = (1,) + data.shape,
+                                                     compression = self.compression)
+        if self.count >= self.frames.shape[0]:
+            self.frames.resize(self.count + self.grow, axis = 0)
+        self.frames[self.count] = data
+        
+        row = self.meta_block[self.count - self.meta_start]
+        row['index'] = index
+        if isinstance(image,Frame):
+            row['timestamp'] = image.timestamp
+            row['frame_id'] = image.frame_id
+            row['host_time'] = image.host_time
+        else:
+            row['timestamp'] = 0
+            row['frame_id'] = -1
+            row['host_time'] = np.nan
+        for name in ('row', 'col', 'x', 'y'):
+            row[name] = np.nan
+        if metadata is not None:
+            for name, value in metadata.items():
+                row[name] = value
+        self.count += 1
+        if self.count - self.meta_start == self.grow:
+            self.flush_meta()
+            
+    def flush_meta(self):
+        '''
+        write the metadata rows of the current block to the file
+        '''
+        n = self.count - self.meta_start
+        if n == 0:
+            return
+        self.meta.resize(self.count, axis = 0)
+        self.meta[self.meta_start:self.count] = self.meta_block[:n]
+        self.meta_start = self.count
+        
+    def to_array(self,image):
+        if isinstance(image,Frame):
+            return image.data
+        elif isinstance(image,np.ndarray):
+            return image
+        return image.GetNDArray()
+    
+    def close_file(self):
+        self.flush_meta()
+        if self.frames is not None:
+            self.frames.resize(self.count, axis = 0)
+        self.h5file.close()
+        
+class H5Video(object):
+    '''
+    Reads a lossless recording, frames are read by index without reading
+    the frames before them. A segmented recording is read one segment at a
+    time, the index column of meta is the frame number in the recording
+    '''
+    def __init__(self, fname):
+        if h5py is None:
+            raise RuntimeError('h5py is not installed, unable to read %s' % fname)
+        self.h5file = h5py.File(fname, 'r')
+        self.frames = self.h5file['frames']
+        self.meta = self.h5file['frame_meta'][:]
+        self.frame_rate = self.h5file.attrs['frame_rate']
+        
+    def __len__(self):
+        return self.frames.shape[0]
+    
+    def __getitem__(self, i):
+        return self.frames[i]
+    
+    def close(self):
+        self.h5file.close()
+        
+# recorder class of every file format
+RECORDERS = {'avi': Recorder, 'h5': H5Recorder}
     
 class FLIRRecDev(object):
     '''
-    Virtual Device that hold a list of running recorders
+    Virtual Device that hold a list of running recorders, every recorder
+    has its own writer thread
     '''
-    def __init__(self, path):
+    def __init__(self, path, policy = 'block', queue_size = 64, file_format = 'avi',
+                 segment_seconds = 0, segment_bytes = 0, compress = True, h5_compress = False):
+        '''
+        compress: MJPG compression of avi recorders
+        h5_compress: lzf compression of h5 recorders, off by default as it
+                     takes about 20 ms per 1024x1024 frame, see H5Recorder
+        '''
         self.path = path
+        self.compress = compress
+        self.h5_compress = h5_compress
+        self.policy = policy
+        self.queue_size = queue_size
+        self.file_format = file_format
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
         self.recorder = dict()
     
     def get_path(self,path):
@@ -68,28 +545,111 @@ class FLIRRecDev(object):
     
     def set_path(self,path):
         self.path = path
+        
+    def get_compress(self):
+        return self.compress
+    
+    def set_compress(self,compress):
+        '''
+        compression of avi recorders created from now on
+        '''
+        self.compress = compress
+        
+    def get_h5_compress(self):
+        return self.h5_compress
+    
+    def set_h5_compress(self,h5_compress):
+        '''
+        compression of h5 recorders created from now on
+        '''
+        self.h5_compress = h5_compress
+        
+    def get_policy(self):
+        return self.policy
+    
+    def set_policy(self,policy):
+        '''
+        write policy of recorders created from now on, see WRITE_POLICIES
+        '''
+        self.policy = policy
+        
+    def get_queue_size(self):
+        return self.queue_size
+    
+    def set_queue_size(self,queue_size):
+        self.queue_size = int(queue_size)
+        
+    def get_file_format(self):
+        return self.file_format
+    
+    def set_file_format(self,file_format):
+        '''
+        file format of recorders created from now on, 'avi' or 'h5' (lossless)
+        '''
+        self.file_format = file_format
+        
+    def get_segment_seconds(self):
+        return self.segment_seconds
     
-    def create_file(self, name, frame_rate, compress = True):
+    def set_segment_seconds(self,segment_seconds):
+        '''
+        segment duration of recorders created from now on, 0 for no limit
+        '''
+        self.segment_seconds = segment_seconds
+        
+    def get_segment_bytes(self):
+        return self.segment_bytes
+    
+    def set_segment_bytes(self,segment_bytes):
+        '''
+        segment size of recorders created from now on, 0 for no limit
+        '''
+        self.segment_bytes = int(segment_bytes)
+    
+    def create_file(self, name, frame_rate, compress = None):
+        '''
+        start a recorder, a recorder of the same name is closed first
+        
+        compress: compression of the file, the compress or h5_compress
+                  setting of the device if None
+        '''
+        if compress is None:
+            compress = self.h5_compress if self.file_format == 'h5' else self.compress
         fname = os.path.join(self.path,name)
-        self.recorder[name] = Recorder(fname, frame_rate, compress)
+        if name in self.recorder:
+            self.recorder[name].close()
+        recorder_class = RECORDERS[self.file_format]
+        self.recorder[name] = recorder_class(fname, frame_rate, compress, self.policy, self.queue_size,
+                                             self.segment_seconds, self.segment_bytes)
         
-    def save_frame(self,name, image):
+    def save_frame(self,name, image, metadata = None):
         if name in self.recorder:
-            self.recorder[name].save_frame(image)
+            self.recorder[name].save_frame(image, metadata)
         else:
             print(name + ' recorder does not exist or already closed.')
     
     def close_file(self,name):
+        '''
+        drain and close a recorder
+        
+        return: final statistics of the recorder, None if it does not exist
+        '''
         if name in self.recorder:
             self.recorder[name].close()
-            del self.recorder[name]
+            return self.recorder.pop(name).get_stats()
         else:
             print(name + ' recorder does not exist or already closed..')
             
-    def close(self):
-        for name in self.recorder:
-            self.recorder[name].close()
+    def get_stats(self):
+        '''
+        return: dict of recorder name and its statistics
+        '''
+        return dict((name, recorder.get_stats()) for name, recorder in self.recorder.items())
             
-
+    def close(self):
+        '''
+        drain and close every recorder
         
-        
\ No newline at end of file
+        return: dict of recorder name and its final statistics
+        '''
+        return dict((name, self.close_file(name)) for name in list(self.recorder))
@@ -5,7 +5,7 @@ Created on Aug 9, 2017
 '''
 
 from ScopeFoundry import HardwareComponent
-from AntCamHW.flircam.flirrec_dev import FLIRRecDev
+from AntCamHW.flircam.flirrec_dev import FLIRRecDev, WRITE_POLICIES, RECORDERS
 import os
 
 class FLIRRecHW(HardwareComponent):
@@ -19,30 +19,87 @@ class FLIRRecHW(HardwareComponent):
         initial_data_save_dir = os.path.abspath(os.path.join('.', 'data'))
         self.settings.New(name ='path', dtype = 'file', is_dir = True, initial = initial_data_save_dir)
         self.settings.New(name = 'compress', dtype = bool, initial = True)
+        #avi is MJPG (compress) or uncompressed, h5 is lossless lzf (h5_compress)
+        #or raw, lzf takes about 20 ms per 1024x1024 frame against 0.8 ms raw
+        self.settings.New(name = 'h5_compress', dtype = bool, initial = False)
+        self.settings.New(name = 'file_format', dtype = str, initial = 'avi', choices = sorted(RECORDERS))
+        
+        #frames are written by a writer thread per file, the policy decides
+        #what happens to new frames when its queue is full
+        self.settings.New(name = 'write_policy', dtype = str, initial = 'block', choices = WRITE_POLICIES)
+        self.settings.New(name = 'queue_size', dtype = int, initial = 64, vmin = 1)
+        self.settings.New(name = 'queue_depth', dtype = int, initial = 0, ro = True)
+        self.settings.New(name = 'encode_time', dtype = float, initial = 0, ro = True, unit = 'ms')
+        self.settings.New(name = 'dropped_writes', dtype = int, initial = 0, ro = True)
+        self.settings.New(name = 'spilled_writes', dtype = int, initial = 0, ro = True)
+        
+        #long recordings are split into segments listed in an index file,
+        #0 for no limit
+        self.settings.New(name = 'segment_minutes', dtype = float, initial = 0, vmin = 0, unit = 'min')
+        self.settings.New(name = 'segment_mb', dtype = float, initial = 0, vmin = 0, unit = 'MB')
         
     def connect(self):
         #connect to the camera device
-        self._dev=FLIRRecDev(self.settings.path.value())
+        self._dev=FLIRRecDev(self.settings.path.value(),
+                             self.settings.write_policy.value(),
+                             self.settings.queue_size.value(),
+                             self.settings.file_format.value(),
+                             60 * self.settings.segment_minutes.value(),
+                             1e6 * self.settings.segment_mb.value(),
+                             self.settings.compress.value(),
+                             self.settings.h5_compress.value())
         
         #define read functions
         self.settings.path.hardware_read_func = self._dev.get_path
+        self.settings.compress.hardware_read_func = self._dev.get_compress
+        self.settings.h5_compress.hardware_read_func = self._dev.get_h5_compress
+        self.settings.write_policy.hardware_read_func = self._dev.get_policy
+        self.settings.queue_size.hardware_read_func = self._dev.get_queue_size
+        self.settings.file_format.hardware_read_func = self._dev.get_file_format
         
         #define set functions
         self.settings.path.hardware_set_func = self._dev.set_path
+        self.settings.compress.hardware_set_func = self._dev.set_compress
+        self.settings.h5_compress.hardware_set_func = self._dev.set_h5_compress
+        self.settings.write_policy.hardware_set_func = self._dev.set_policy
+        self.settings.queue_size.hardware_set_func = self._dev.set_queue_size
+        self.settings.file_format.hardware_set_func = self._dev.set_file_format
+        self.settings.segment_minutes.hardware_set_func = self.set_segment_minutes
+        self.settings.segment_mb.hardware_set_func = self.set_segment_mb
         
         
     
+    def set_segment_minutes(self,minutes):
+        self._dev.set_segment_seconds(60 * minutes)
+        
+    def set_segment_mb(self,mb):
+        self._dev.set_segment_bytes(1e6 * mb)
+    
     def create_file(self,name,frame_rate):
-        self._dev.create_file(name,frame_rate,self.settings.compress.value())
+        self._dev.create_file(name,frame_rate)
     
-    def save_frame(self,name,image):
-        self._dev.save_frame(name,image)
+    def save_frame(self,name,image,metadata = None):
+        self._dev.save_frame(name,image,metadata)
         
     def close_file(self,name):
-        self._dev.close_file(name)
+        return self._dev.close_file(name)
         
     def close(self):
-        self._dev.close()
+        return self._dev.close()
+        
+    def get_stats(self):
+        return self._dev.get_stats()
+        
+    def read_stats(self):
+        '''
+        update the writer settings, summed over the open files, the encode
+        time is the slowest mean of the open files
+        '''
+        stats = self._dev.get_stats().values()
+        self.settings.queue_depth.update_value(sum(s['queue_depth'] for s in stats))
+        self.settings.encode_time.update_value(1000 * max([s['encode_time'] for s in stats] + [0]))
+        self.settings.dropped_writes.update_value(sum(s['dropped'] for s in stats))
+        self.settings.spilled_writes.update_value(sum(s['spilled'] for s in stats))
         
     def remove_event(self):
         self._dev.remove_event()
@@ -54,9 +111,21 @@ class FLIRRecHW(HardwareComponent):
         try:
             #remove read functions
             self.settings.path.hardware_read_func = None
+            self.settings.compress.hardware_read_func = None
+            self.settings.h5_compress.hardware_read_func = None
+            self.settings.write_policy.hardware_read_func = None
+            self.settings.queue_size.hardware_read_func = None
+            self.settings.file_format.hardware_read_func = None
             
             #remove set functions
-            self.settings.path.hardware_set_func = self._dev.set_path
+            self.settings.path.hardware_set_func = None
+            self.settings.compress.hardware_set_func = None
+            self.settings.h5_compress.hardware_set_func = None
+            self.settings.write_policy.hardware_set_func = None
+            self.settings.queue_size.hardware_set_func = None
+            self.settings.file_format.hardware_set_func = None
+            self.settings.segment_minutes.hardware_set_func = None
+            self.settings.segment_mb.hardware_set_func = None
         
             self._dev.close()
             del self._dev
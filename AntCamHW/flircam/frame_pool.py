@@ -0,0 +1,144 @@
+import threading
+import numpy as np
+
+class Frame(object):
+    '''
+    A frame buffer leased from a FramePool. The data array is reused after the
+    last holder releases the frame, so a holder must not keep views of data
+    after release
+    '''
+    def __init__(self, pool, data):
+        '''
+        pool: FramePool the buffer belongs to, None for a buffer allocated
+              outside of the pool
+        data: numpy array holding the image
+        '''
+        self.pool = pool
+        self.data = data
+        self.refs = 0
+        self.valid = True
+        #camera timestamp in ns, camera frame id and host receive time in s
+        self.timestamp = 0
+        self.frame_id = -1
+        self.host_time = 0.0
+        #sequence number of the frame in the capture ring
+        self.seq = -1
+        #offset of the region of interest on the sensor, in camera pixels
+        self.offset_x = 0
+        self.offset_y = 0
+
+    def acquire(self):
+        '''
+        take an additional lease on the frame, e.g. before handing it to
+        another thread
+        '''
+        if self.pool is not None:
+            self.pool.acquire(self)
+        return self
+
+    def release(self):
+        '''
+        give back one lease, the buffer returns to the pool with the last one
+        '''
+        if self.pool is not None:
+            self.pool.release(self)
+
+class FramePool(object):
+    '''
+    Pool of preallocated, reusable frame buffers with explicit lease and
+    release, so a camera can fill the same arrays frame after frame instead of
+    allocating a new one for every frame
+    '''
+    def __init__(self, shape, dtype = np.uint8, size = 8, max_size = 64):
+        '''
+        shape: shape of a frame, (height, width)
+        dtype: data type of a frame
+        size: number of buffers allocated up front
+        max_size: the pool grows up to this number of buffers when all of them
+                  are leased, beyond that frames are allocated outside the pool
+        '''
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.frames = []
+        self.free = []
+        self.overflows = 0
+        for i in range(size):
+            self.add_frame()
+
+    def add_frame(self):
+        frame = Frame(self, np.zeros(self.shape, dtype = self.dtype))
+        self.frames.append(frame)
+        self.free.append(frame)
+
+    def lease(self):
+        '''
+        take a free buffer out of the pool
+
+        return: Frame with one lease, its data still holds the old content
+        '''
+        with self.lock:
+            if not self.free:
+                if len(self.frames) < self.max_size:
+                    self.add_frame()
+                else:
+                    self.overflows += 1
+                    frame = Frame(None, np.zeros(self.shape, dtype = self.dtype))
+                    frame.refs = 1
+                    return frame
+            frame = self.free.pop()
+            frame.refs = 1
+            frame.valid = True
+            return frame
+
+    def acquire(self, frame):
+        with self.lock:
+            frame.refs += 1
+
+    def release(self, frame):
+        with self.lock:
+            if frame.refs <= 0:
+                print('Error: frame released more often than leased')
+                return
+            frame.refs -= 1
+            if frame.refs == 0:
+                self.free.append(frame)
+
+    def get_size(self):
+        return len(self.frames)
+
+    def get_free(self):
+        return len(self.free)
+
+
+class FrameStats(object):
+    '''
+    Running frame counters of a camera since the acquisition started. Gaps in
+    the camera frame ids are counted as dropped frames
+    '''
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.acquired = 0
+        self.dropped = 0
+        self.incomplete = 0
+        self.convert_failures = 0
+        self.last_frame_id = None
+
+    def count(self, frame_id):
+        '''
+        count an acquired frame
+        frame_id: camera frame id of the frame
+        '''
+        self.acquired += 1
+        if self.last_frame_id is not None and frame_id > self.last_frame_id + 1:
+            self.dropped += frame_id - self.last_frame_id - 1
+        self.last_frame_id = frame_id
+
+    def as_dict(self):
+        return {'frames_acquired': self.acquired,
+                'frames_dropped': self.dropped,
+                'frames_incomplete': self.incomplete,
+                'convert_failures': self.convert_failures}
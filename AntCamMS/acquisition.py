@@ -0,0 +1,504 @@
+import threading
+import time
+
+'''
+AcquisitionManager reads every camera on its own capture thread and pairs
+the frames of the secondary cameras (e.g. wide_cam) with the frames of the
+primary camera (track_cam) by capture time. The camera clocks are not
+synchronized, each camera clock is mapped to the host clock with the
+smallest host receive delay seen recently. Slow work on a secondary camera,
+such as recording the wide camera, runs as a decimated action on its own
+capture thread and never holds up the primary camera.
+
+Every capture thread only drains its camera into a FrameRing. Consumers
+such as the tracker, the recorder and the display read the ring at their
+own rates, so a slow recorder does not back up the camera stream
+'''
+
+class RingCursor(object):
+    '''
+    Read position of one consumer of a FrameRing
+    '''
+    def __init__(self, ring, name, policy):
+        '''
+        policy: 'drop_oldest' skips frames that were overwritten before they
+                were read, 'block' makes the producer wait for this consumer
+        '''
+        self.ring = ring
+        self.name = name
+        self.policy = policy
+        self.position = ring.head
+        self.reads = 0
+        self.overruns = 0
+        self.max_occupancy = 0
+
+    def get(self, timeout = None):
+        return self.ring.get(self, timeout)
+
+    def get_latest(self, timeout = None):
+        return self.ring.get(self, timeout, latest = True)
+
+    def occupancy(self):
+        '''
+        number of frames written but not read yet
+        '''
+        return min(self.ring.head - self.position, self.ring.size)
+
+class FrameRing(object):
+    '''
+    Fixed size ring of frames between a capture thread and its consumers.
+    The ring holds one lease on every frame in a slot and releases it when
+    the slot is overwritten. Every consumer reads at its own rate through a
+    cursor and gets its own lease on the frames it reads
+    '''
+    def __init__(self, size = 64, block_timeout = 1.0):
+        '''
+        size: number of slots
+        block_timeout: longest time in seconds the producer waits for a
+                       blocking consumer before it overwrites the slot anyway
+        '''
+        self.size = size
+        self.block_timeout = block_timeout
+        self.slots = [None] * size
+        self.head = 0
+        self.cond = threading.Condition()
+        self.cursors = {}
+        self.closed = False
+        self.producer_waits = 0
+
+    def add_consumer(self, name, policy = 'drop_oldest'):
+        '''
+        register a consumer, it reads the frames written from now on
+
+        return: RingCursor
+        '''
+        if policy not in ('drop_oldest', 'block'):
+            raise ValueError('Unknown ring policy %s' % policy)
+        with self.cond:
+            cursor = RingCursor(self, name, policy)
+            self.cursors[name] = cursor
+        return cursor
+
+    def remove_consumer(self, name):
+        with self.cond:
+            self.cursors.pop(name, None)
+            self.cond.notify_all()
+
+    def put(self, frame):
+        '''
+        write a frame to the next slot, the ring takes over the lease of the
+        caller. Waits while a blocking consumer has not read the slot
+        '''
+        with self.cond:
+            if self.blocked():
+                self.producer_waits += 1
+                deadline = time.perf_counter() + self.block_timeout
+                while self.blocked() and not self.closed:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+            if self.closed:
+                old = frame
+            else:
+                frame.seq = self.head
+                slot = self.head % self.size
+                old = self.slots[slot]
+                self.slots[slot] = frame
+                self.head += 1
+                for cursor in self.cursors.values():
+                    occupancy = self.head - cursor.position
+                    if occupancy > cursor.max_occupancy:
+                        cursor.max_occupancy = occupancy
+                self.cond.notify_all()
+        if old is not None:
+            old.release()
+
+    def blocked(self):
+        for cursor in self.cursors.values():
+            if cursor.policy == 'block' and self.head - cursor.position >= self.size:
+                return True
+        return False
+
+    def get(self, cursor, timeout = None, latest = False):
+        '''
+        read the next frame of a consumer, the caller owns one lease on it
+
+        cursor: RingCursor of the consumer
+        timeout: longest wait for a new frame in seconds, None waits forever
+        latest: skip to the newest frame, skipped frames are not overruns
+        return: frame, None on timeout or when the ring is closed
+        '''
+        with self.cond:
+            if cursor.position >= self.head and not self.closed:
+                self.cond.wait_for(lambda: cursor.position < self.head or self.closed, timeout)
+            if cursor.position >= self.head or self.closed:
+                return None
+            if latest:
+                cursor.position = self.head - 1
+            elif self.head - cursor.position > self.size:
+                #overwritten before this consumer read them
+                cursor.overruns += self.head - self.size - cursor.position
+                cursor.position = self.head - self.size
+            frame = self.slots[cursor.position % self.size]
+            frame.acquire()
+            cursor.position += 1
+            cursor.reads += 1
+            if cursor.policy == 'block':
+                self.cond.notify_all()
+            return frame
+
+    def pending(self, cursor):
+        '''
+        frames written but not read by a consumer yet, without leases, only
+        to be looked at while choosing a frame with skip_to
+        '''
+        with self.cond:
+            if self.closed:
+                return []
+            start = max(cursor.position, self.head - self.size)
+            return [self.slots[i % self.size] for i in range(start, self.head)]
+
+    def skip_to(self, cursor, frame):
+        '''
+        read a frame returned by pending, frames before it are skipped
+
+        return: frame with a lease for the caller, None if it was overwritten
+        '''
+        with self.cond:
+            if self.closed or frame.seq < max(cursor.position, self.head - self.size):
+                return None
+            frame.acquire()
+            cursor.position = frame.seq + 1
+            cursor.reads += 1
+            self.cond.notify_all()
+            return frame
+
+    def skip_before(self, cursor, seq):
+        '''
+        skip every frame with a sequence number below seq
+        '''
+        with self.cond:
+            if seq > cursor.position:
+                cursor.position = min(seq, self.head)
+                self.cond.notify_all()
+
+    def drain(self, timeout = 1.0):
+        '''
+        wait until every blocking consumer has read all frames
+
+        return: True if they caught up within the timeout
+        '''
+        with self.cond:
+            return self.cond.wait_for(lambda: all(cursor.position >= self.head
+                                                  for cursor in self.cursors.values()
+                                                  if cursor.policy == 'block'), timeout)
+
+    def close(self):
+        '''
+        wake up every waiting consumer and release the frames in the slots
+        '''
+        with self.cond:
+            self.closed = True
+            frames = [frame for frame in self.slots if frame is not None]
+            self.slots = [None] * self.size
+            self.cond.notify_all()
+        for frame in frames:
+            frame.release()
+
+    def get_stats(self):
+        '''
+        return: dict of counters, frames written, producer waits and the
+        occupancy, largest occupancy and overruns of every consumer
+        '''
+        with self.cond:
+            stats = {'written': self.head, 'producer_waits': self.producer_waits}
+            for name, cursor in self.cursors.items():
+                stats[name + '_occupancy'] = cursor.occupancy()
+                stats[name + '_max_occupancy'] = cursor.max_occupancy
+                stats[name + '_overruns'] = cursor.overruns
+            return stats
+
+class CameraWorker(threading.Thread):
+    '''
+    Capture thread of one camera, drains the camera into a FrameRing
+    '''
+    def __init__(self, name, camera, ring_size = 32, offset_window = 256):
+        '''
+        name: name of the camera, e.g. track_cam
+        camera: FLIRCamHW, FLIRCamDev or FLIRCamSimDev with read_frame
+        ring_size: number of frames in the ring
+        offset_window: number of frames the clock offset estimate looks back
+        '''
+        super(CameraWorker, self).__init__(name = name)
+        self.daemon = True
+        self.camera = camera
+        self.ring = FrameRing(ring_size)
+        self.offset_window = offset_window
+        self.stop_event = threading.Event()
+        self.actions = []
+        self.count = 0
+        self.errors = 0
+        #clock offset is the minimum of the last one to two windows
+        self.offset = None
+        self.offset_min = None
+        self.offset_prev = None
+
+    def add_action(self, func, period = 1):
+        '''
+        run func(frame) on the capture thread for every period-th frame
+        '''
+        self.actions.append((max(int(period), 1), func))
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                frame = self.camera.read_frame()
+            except Exception as ex:
+                print('Error: %s' % ex)
+                self.errors += 1
+                time.sleep(0.01)
+                continue
+            self.count += 1
+            self.update_offset(frame)
+            for period, func in self.actions:
+                if self.count % period == 0:
+                    try:
+                        func(frame)
+                    except Exception as ex:
+                        print('Error: %s' % ex)
+            self.ring.put(frame)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def update_offset(self, frame):
+        '''
+        update the offset between the camera clock and the host clock, the
+        frame with the shortest transfer delay gives the best estimate
+        '''
+        offset = frame.host_time - frame.timestamp * 1e-9
+        if self.offset_min is None or offset < self.offset_min:
+            self.offset_min = offset
+        if self.count % self.offset_window == 0:
+            self.offset_prev = self.offset_min
+            self.offset_min = None
+        if self.offset_prev is None or (self.offset_min is not None and self.offset_min < self.offset_prev):
+            self.offset = self.offset_min
+        else:
+            self.offset = self.offset_prev
+
+    def capture_time(self, frame):
+        '''
+        capture time of a frame on the host clock, in seconds
+        '''
+        if self.offset is None:
+            return frame.host_time
+        return frame.timestamp * 1e-9 + self.offset
+
+    def match(self, cursor, t, tolerance):
+        '''
+        read the frame captured closest to t, frames captured before it are
+        skipped
+
+        cursor: RingCursor of the consumer pairing the frames
+        t: capture time on the host clock in seconds
+        tolerance: largest accepted difference of capture times in seconds
+        return: frame with a lease for the caller, None if no frame is within
+        the tolerance
+        '''
+        best = None
+        best_dt = tolerance
+        last = None
+        for frame in self.ring.pending(cursor):
+            capture_time = self.capture_time(frame)
+            dt = abs(capture_time - t)
+            if dt <= best_dt:
+                best = frame
+                best_dt = dt
+            if capture_time < t - tolerance:
+                last = frame
+        if best is None:
+            #frames too old to ever be paired
+            if last is not None:
+                self.ring.skip_before(cursor, last.seq + 1)
+            return None
+        return self.ring.skip_to(cursor, best)
+
+class FrameBundle(object):
+    '''
+    Frames of all cameras captured at the same time, cameras without a
+    matching frame are None. The bundle holds one lease on every frame
+    '''
+    def __init__(self, time, frames):
+        '''
+        time: capture time of the primary frame on the host clock
+        frames: dict of camera name and frame
+        '''
+        self.time = time
+        self.frames = frames
+
+    def __getitem__(self, name):
+        return self.frames.get(name)
+
+    def release(self):
+        for frame in self.frames.values():
+            if frame is not None:
+                frame.release()
+
+class FrameMailbox(object):
+    '''
+    Single-slot mailbox between a producer thread and the display. A new
+    frame replaces the unread one, so the display always gets the newest
+    frame and never falls behind. Frames are decimated to the display rate
+    by the producer, before a lease is taken
+    '''
+    def __init__(self, period = 0.0):
+        '''
+        period: shortest time between two accepted frames in seconds
+        '''
+        self.period = period
+        self.lock = threading.Lock()
+        self.frame = None
+        self.last_put = 0.0
+        self.accepted = 0
+        self.overwritten = 0
+
+    def put(self, frame):
+        '''
+        offer a frame, the mailbox takes a lease on it if the period since
+        the last accepted frame has passed and releases the unread frame
+
+        return: True if the frame was accepted
+        '''
+        now = time.perf_counter()
+        if now - self.last_put < self.period:
+            return False
+        self.last_put = now
+        frame.acquire()
+        with self.lock:
+            old, self.frame = self.frame, frame
+            self.accepted += 1
+            if old is not None:
+                self.overwritten += 1
+        if old is not None:
+            old.release()
+        return True
+
+    def get(self):
+        '''
+        return: the newest frame, the caller owns its lease, None if no frame
+        arrived since the last call
+        '''
+        with self.lock:
+            frame, self.frame = self.frame, None
+        return frame
+
+    def clear(self):
+        frame = self.get()
+        if frame is not None:
+            frame.release()
+
+class AcquisitionManager(object):
+    '''
+    Runs one capture thread per camera and pairs the frames by capture time
+    '''
+    def __init__(self, cameras, primary, tolerance = 0.005, ring_size = 32, policy = 'drop_oldest'):
+        '''
+        cameras: dict of camera name and camera with start, stop and read_frame
+        primary: name of the camera that drives the bundles, e.g. track_cam
+        tolerance: largest difference of capture times of paired frames, in seconds
+        ring_size: number of frames in the ring of every camera, has to stay
+                   below the size limit of the frame pool of the camera
+        policy: ring policy of the bundle consumer, 'drop_oldest' or 'block'
+        '''
+        self.cameras = cameras
+        self.primary = primary
+        self.tolerance = tolerance
+        self.workers = dict((name, CameraWorker(name, camera, ring_size))
+                            for name, camera in cameras.items())
+        self.cursors = dict((name, worker.ring.add_consumer('bundle', policy if name == primary else 'drop_oldest'))
+                            for name, worker in self.workers.items())
+        self.bundles = 0
+        self.paired = dict((name, 0) for name in cameras)
+
+    def add_action(self, name, func, period = 1):
+        '''
+        run func(frame) on the capture thread of a camera for every
+        period-th frame, e.g. to display the wide camera at a lower rate.
+        The frame lease is only valid during the call, use frame.acquire()
+        to keep it
+        '''
+        self.workers[name].add_action(func, period)
+
+    def add_consumer(self, name, consumer, policy = 'drop_oldest'):
+        '''
+        read the frames of a camera at the rate of the consumer, e.g. a
+        recorder thread
+
+        name: name of the camera
+        consumer: name of the consumer
+        policy: 'drop_oldest' or 'block', see RingCursor
+        return: RingCursor, cursor.get(timeout) returns the next frame
+        '''
+        return self.workers[name].ring.add_consumer(consumer, policy)
+
+    def start(self):
+        for camera in self.cameras.values():
+            camera.start()
+        for worker in self.workers.values():
+            worker.start()
+
+    def stop(self, timeout = 1.0, drain_timeout = 5.0):
+        '''
+        stop the capture threads before the cameras, a thread blocks in
+        read_frame until the next frame arrives. Blocking consumers, e.g. a
+        recorder, get drain_timeout seconds to read the frames left in the
+        rings before the rings are closed
+        '''
+        for worker in self.workers.values():
+            worker.stop()
+        for worker in self.workers.values():
+            worker.join(timeout)
+        for camera in self.cameras.values():
+            camera.stop()
+        for worker in self.workers.values():
+            if not worker.ring.drain(drain_timeout):
+                print('Error: consumers of %s did not catch up, dropping the frames left' % worker.name)
+            worker.ring.close()
+
+    def get_bundle(self, timeout = 1.0):
+        '''
+        wait for the next frame of the primary camera and pair it with the
+        frames of the other cameras, never waits for the other cameras
+
+        return: FrameBundle, the caller has to release it, None on timeout
+        '''
+        primary = self.workers[self.primary]
+        frame = self.cursors[self.primary].get(timeout)
+        if frame is None:
+            return None
+        t = primary.capture_time(frame)
+        frames = {self.primary: frame}
+        for name, worker in self.workers.items():
+            if name != self.primary:
+                frames[name] = worker.match(self.cursors[name], t, self.tolerance)
+                if frames[name] is not None:
+                    self.paired[name] += 1
+        self.bundles += 1
+        return FrameBundle(t, frames)
+
+    def get_stats(self):
+        '''
+        return: dict of counters, frames read and read errors per camera,
+        the ring counters of every consumer, bundles and paired frames
+        '''
+        stats = {'bundles': self.bundles}
+        for name, worker in self.workers.items():
+            stats[name + '_frames'] = worker.count
+            stats[name + '_errors'] = worker.errors
+            for key, value in worker.ring.get_stats().items():
+                stats[name + '_' + key] = value
+            if name != self.primary:
+                stats[name + '_paired'] = self.paired[name]
+        return stats
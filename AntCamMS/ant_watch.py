@@ -4,50 +4,23 @@ Created on Mar 26, 2018
 @author: Hao Wu
 '''
 from ScopeFoundry import Measurement
-from ScopeFoundry.measurement import MeasurementQThread
 from ScopeFoundry.helper_funcs import sibling_path, load_qt_ui_file
 from ScopeFoundry import h5_io
 import pyqtgraph as pg
 import numpy as np
 from scipy import ndimage
 import time
-import PySpin
-from qtpy import QtCore
+from qtpy import QtGui
 from qtpy.QtCore import QObject
 import os
-import queue
-from .helper_funcs import find_centroid, PIDController
+from .ant_watch_engine import AntWatchEngine, DEFAULT_PARAMS, START_PARAMS, LATENCY_STAGES, LATENCY_BINS
+from .stages import DAQMotorStage
 
-class SubMeasurementQThread(MeasurementQThread):
-    '''
-    Sub-Thread for different loops in measurement
-    '''
-
-    def __init__(self, run_func, parent=None):
-        '''
-        run_func: user-defined function to run in the loop
-        parent = parent thread, usually None
-        '''
-        super(MeasurementQThread, self).__init__(parent)
-        self.run_func = run_func
-        self.interrupted = False
-  
-    def run(self):
-        while not self.interrupted:
-            self.run_func()
-            if self.interrupted:
-                break
-            
-    @QtCore.Slot()
-    def interrupt(self):
-        self.interrupted = True
-            
 class AntWatchMeasure(Measurement):
     
     # this is the name of the measurement that ScopeFoundry uses 
     # when displaying your measurement and saving data related to it    
     name = "ant_watch"
-    interrupt_subthread = QtCore.Signal(())
     
     def setup(self):
         """
@@ -66,17 +39,73 @@ class AntWatchMeasure(Measurement):
         self.ui = load_qt_ui_file(self.ui_filename)
 
         # Measurement Specific Settings
+        # The settings are the parameters of AntWatchEngine, see DEFAULT_PARAMS
         # This setting allows the option to save data to an h5 data file during a run
         # All settings are automatically added to the Microscope user interface
         self.settings.New('save_video', dtype = bool, initial = False)
+        # record a window of 2*crop_size pixels around the ant as crop_mov,
+        # next to the full frames or instead of them
+        self.settings.New('record_full', dtype = bool, initial = True)
+        self.settings.New('record_crop', dtype = bool, initial = False)
+        self.settings.New('crop_size', dtype = int, initial = 200, vmin = 8)
+        # the wide camera is read on its own thread, its frames are paired
+        # with the track camera frames and shown and recorded every n-th frame
+        self.settings.New('use_wide_cam', dtype = bool, initial = False)
+        self.settings.New('wide_display_period', dtype = int, initial = 5, vmin = 1)
+        self.settings.New('wide_record_period', dtype = int, initial = 1, vmin = 1)
+        # frames waiting in the capture ring of the track camera and frames
+        # lost because the tracker or the recorder fell behind
+        self.settings.New('ring_size', dtype = int, initial = 32, vmin = 2, vmax = 60)
+        self.settings.New('track_ring_occupancy', dtype = int, initial = 0, ro = True)
+        self.settings.New('track_ring_overruns', dtype = int, initial = 0, ro = True)
+        self.settings.New('record_ring_occupancy', dtype = int, initial = 0, ro = True)
+        self.settings.New('record_ring_overruns', dtype = int, initial = 0, ro = True)
+        # latency of the tracking loop, median time to reach every stage from
+        # the stage before, percentiles and histogram of the total, see LATENCY_STAGES
+        for stage in LATENCY_STAGES[1:]:
+            self.settings.New('latency_' + stage, dtype = float, initial = 0, ro = True, unit = 'ms')
+        self.settings.New('latency_p50', dtype = float, initial = 0, ro = True, unit = 'ms')
+        self.settings.New('latency_p95', dtype = float, initial = 0, ro = True, unit = 'ms')
+        self.settings.New('latency_p99', dtype = float, initial = 0, ro = True, unit = 'ms')
+        self.settings.New('latency_hist', dtype = int, array = True, initial = np.zeros(LATENCY_BINS, dtype = int), ro = True)
+        # frames sent to the live display per second, per camera
+        self.settings.New('display_rate', dtype = float, initial = 15, vmin = 0.1, unit = 'Hz')
+        # rows of the trail file are written and flushed a block at a time
+        self.settings.New('log_flush_period', dtype = float, initial = 1.0, vmin = 0, unit = 's')
         self.settings.New('track_ant',dtype = bool, initial = False)
         self.settings.New('pixel_size', dtype = float, initial = 0.05547850208, ro = True)
         self.settings.New('binning', dtype = int, initial = 16, ro = True)
         self.settings.New('threshold', dtype = int, initial = 85, ro = False)
+        self.settings.New('search_window', dtype = int, initial = 8, ro = False, vmin = 1)
+        # follow only the blob nearest to the predicted centroid
+        self.settings.New('multi_blob', dtype = bool, initial = True, ro = False)
+        self.settings.New('min_blob_area', dtype = int, initial = 1, ro = False, vmin = 1)
+        # adaptive threshold, detect bins darker than a running background by k sigma
+        self.settings.New('adaptive_threshold', dtype = bool, initial = False, ro = False)
+        self.settings.New('background_k', dtype = float, initial = 4.0, ro = False, vmin = 0)
+        self.settings.New('background_alpha', dtype = float, initial = 0.02, ro = False, vmin = 0, vmax = 1)
+        self.settings.New('background_period', dtype = int, initial = 10, ro = False, vmin = 1)
+        # re-center the sensor region of interest of the track camera on the
+        # ant, it moves when the centroid is roi_hysteresis binned pixels off
+        self.settings.New('roi_follow', dtype = bool, initial = False, ro = False)
+        self.settings.New('roi_hysteresis', dtype = int, initial = 2, ro = False, vmin = 0)
         self.settings.New('proportional', dtype = float, initial = 0.12, ro = False)
         self.settings.New('integral', dtype = float, initial = 0, ro = False)
         self.settings.New('derivative', dtype = float, initial = 0.05, ro = False)
         
+        # predictive stage lead, the stage is sent to where the ant will be
+        # lead_time seconds after the frame was taken
+        self.settings.New('predict', dtype = bool, initial = False, ro = False)
+        self.settings.New('lead_time', dtype = float, initial = 0.05, ro = False, vmin = 0, unit = 's')
+        self.settings.New('process_noise', dtype = float, initial = 500, ro = False, vmin = 0, unit = 'mm2/s3')
+        self.settings.New('measurement_noise', dtype = float, initial = 0.2, ro = False, vmin = 0, unit = 'mm')
+        self.settings.New('velocity_x', dtype = float, initial = 0, ro = True, unit = 'mm/s')
+        self.settings.New('velocity_y', dtype = float, initial = 0, ro = True, unit = 'mm/s')
+        self.settings.New('innovation_rms', dtype = float, initial = 0, ro = True, unit = 'mm')
+        self.settings.New('innovation_nis', dtype = float, initial = 0, ro = True)
+        # times the ant was lost while predicting, the filter restarts after each
+        self.settings.New('predictor_dropouts', dtype = int, initial = 0, ro = True)
+        
         # x and y is for transmitting signal
         self.settings.New('x',dtype = float, initial = 32, ro = True, vmin = 0, vmax = 63.5)
         self.settings.New('y',dtype = float, initial = 32, ro = True, vmin = 0, vmax = 63.5)
@@ -94,6 +123,15 @@ class AntWatchMeasure(Measurement):
         #setup experiment condition
         self.track_cam.settings.frame_rate.update_value(50)
         self.track_cam.read_from_hardware()
+        
+        # the engine runs on a snapshot of the settings, a changed setting
+        # replaces the snapshot instead of being read on every frame
+        self.engine = None
+        self.stage = None
+        for name in DEFAULT_PARAMS:
+            self.settings.get_lq(name).add_listener(lambda name = name: self.on_param_changed(name))
+        self.daqmotor.settings.bound_x.add_listener(self.on_bounds_changed)
+        self.daqmotor.settings.bound_y.add_listener(self.on_bounds_changed)
 
     def setup_figure(self):
         """
@@ -137,7 +175,9 @@ class AntWatchMeasure(Measurement):
         self.wide_cam_view=pg.ViewBox()
         self.track_cam_view=pg.ViewBox()
         self.wide_cam_layout.addItem(self.track_cam_view)
+        self.track_cam_layout.addItem(self.wide_cam_view)
         self.wide_cam_image=pg.ImageItem()
+        self.wide_cam_view.addItem(self.wide_cam_image)
         self.track_cam_image=pg.ImageItem()
         self.track_cam_view.addItem(self.track_cam_image)
         self.track_histogram = pg.HistogramLUTItem(self.track_cam_image)
@@ -154,12 +194,14 @@ class AntWatchMeasure(Measurement):
         self.tracker_image=pg.ImageItem()
         self.tracker_view.addItem(self.tracker_image)
         
-        # initiate tracker buffer
+        # frames are shown without copying, rotated by the image item, see orient_image
+        self.image_heights = {}
+        
+        # initiate tracker buffer, resized to the binned sensor of the run
         self.tracker_data = np.zeros((64,64),dtype = np.uint8)
         
-        #counter used for reducing refresh rate
-        self.wide_disp_counter = 0
-        self.track_disp_counter = 0
+        # frames shown by the image items, per camera
+        self.shown_frames = {}
         
     def update_display(self):
         """
@@ -168,52 +210,61 @@ class AntWatchMeasure(Measurement):
         its update frequency is defined by self.display_update_period
         """
         
-        # check availability of display queue of the wide camera
-#         if not hasattr(self,'wide_disp_queue'):
-#             pass
-#         elif self.wide_disp_queue.empty():
-#             pass
-#         else:
-#             try:
-#                 wide_disp_image = self.wide_disp_queue.get()
-#                 
-#                 self.wide_disp_counter += 1
-#                 self.wide_disp_counter %= 2
-#                 if self.wide_disp_counter == 0:
-#                     if type(wide_disp_image) == np.ndarray:
-#                         if wide_disp_image.shape == (self.wide_cam.settings.height.value(),self.wide_cam.settings.width.value()):
-#                             try:
-#                                 self.wide_cam_image.setImage(wide_disp_image)
-#                             except Exception as ex:
-#                                 print('Error: %s' % ex)
-#             except Exception as ex:
-#                 print("Error: %s" % ex)
+        # the mailboxes of the engine hold the newest frame of each camera
+        if self.engine is None or not self.engine.running:
+            return
+        
+        wide_disp_frame = self.engine.wide_mailbox.get()
+        if wide_disp_frame is not None:
+            try:
+                self.orient_image(self.wide_cam_image, wide_disp_frame.data.shape)
+                self.wide_cam_image.setImage(wide_disp_frame.data)
+            except Exception as ex:
+                print('Error: %s' % ex)
+            self.show_frame(wide_disp_frame, 'wide_cam')
         
-        # check availability of display queue of the track camera         
-        if not hasattr(self,'track_disp_queue'):
-            pass
-        elif self.track_disp_queue.empty():
-            pass
-        else:
+        track_disp_frame = self.engine.track_mailbox.get()
+        if track_disp_frame is not None:
             try:
-                track_disp_image = self.track_disp_queue.get()
-                self.track_disp_counter += 1
-                self.track_disp_counter %= 4
-                if self.track_disp_counter == 0:
-                    if type(track_disp_image) == np.ndarray:
-                        if track_disp_image.shape == (self.track_cam.settings.height.value(),self.track_cam.settings.width.value()):
-                            try:
-                                self.track_cam_image.setImage(track_disp_image)
-                            except Exception as ex:
-                                print('Error: %s' % ex)
-                                
-                    x = int(self.settings.x.value())
-                    y = int(self.settings.y.value())
-                    self.tracker_data[:] = 0
-                    self.tracker_data[x,y] = 1
-                    self.tracker_image.setImage(np.copy(self.tracker_data))
+                self.orient_image(self.track_cam_image, track_disp_frame.data.shape)
+                self.track_cam_image.setImage(track_disp_frame.data)
             except Exception as ex:
-                print("Error: %s" % ex)
+                print('Error: %s' % ex)
+            self.show_frame(track_disp_frame)
+                        
+            # x, y of the centroid are in binned pixels of the full sensor
+            shape = (self.engine.tracker_width, self.engine.tracker_size)
+            if self.tracker_data.shape != shape:
+                self.tracker_data = np.zeros(shape, dtype = np.uint8)
+            x = min(max(int(self.engine.status['x']), 0), shape[0] - 1)
+            y = min(max(int(self.engine.status['y']), 0), shape[1] - 1)
+            self.tracker_data[:] = 0
+            self.tracker_data[x,y] = 1
+            self.tracker_image.setImage(np.copy(self.tracker_data))
+
+    def orient_image(self, image_item, shape):
+        '''
+        show frames upright without copying them, the image item maps frame
+        row r, column c to x = c, y = height - r, as np.fliplr(frame.T) did
+        
+        image_item: pyqtgraph ImageItem
+        shape: shape of the frame, the transform is only set when the height changes
+        '''
+        height = shape[0]
+        if self.image_heights.get(image_item) == height:
+            return
+        self.image_heights[image_item] = height
+        image_item.setTransform(QtGui.QTransform(0, -1, 0, 1, 0, 0, 0, height, 1))
+
+    def show_frame(self, frame, name = 'track_cam'):
+        '''
+        the image item keeps a view of the displayed frame, hold its lease
+        until the next frame of the same camera is shown
+        '''
+        shown_frame = self.shown_frames.get(name)
+        if shown_frame is not None:
+            shown_frame.release()
+        self.shown_frames[name] = frame
 
     def run(self):
         """
@@ -221,193 +272,86 @@ class AntWatchMeasure(Measurement):
         It should not update the graphical interface directly, and should only
         focus on data acquisition.
         """
-        self.buffer = np.zeros((60000,2))
-        self.track_cam._dev.set_buffer_count(500)
-        
-        
-            # if enabled will create an HDF5 file with the plotted data
-            # first we create an H5 file (by default autosaved to app.settings['save_dir']
-            # This stores all the hardware and app meta-data in the H5 file
-
+        # if enabled will create an HDF5 file with the plotted data
+        # first we create an H5 file (by default autosaved to app.settings['save_dir']
+        # This stores all the hardware and app meta-data in the H5 file
+        save_dir = self.app.settings.save_dir.value()
+        data_path = os.path.join(save_dir,self.app.settings.sample.value())
         if self.settings.save_video.value():
-            save_dir = self.app.settings.save_dir.value()
-            data_path = os.path.join(save_dir,self.app.settings.sample.value())
-            try:
-                os.makedirs(data_path)
-            except OSError:
-                print('directory already exist, writing to existing directory')
-
-            frame_rate = self.track_cam.settings.frame_rate.value()
             self.recorder.settings.path.update_value(data_path)
-            
-            self.recorder.create_file('track_mov',frame_rate)
-            
-            #save h5
-            file_name_index=0
-            file_name=os.path.join(self.recorder.settings.path.value(),'trail_'+str(file_name_index)+'.h5')
-            while os.path.exists(file_name):
-                file_name_index+=1
-                file_name=os.path.join(self.recorder.settings.path.value(),'trail_'+str(file_name_index)+'.h5')
-        
-            self.h5file = h5_io.h5_base_file(app=self.app, measurement=self,fname = file_name)
-            
-            # create a measurement H5 group (folder) within self.h5file
-            # This stores all the measurement meta-data in this group
-            self.h5_group = h5_io.h5_create_measurement_group(measurement=self, h5group=self.h5file)
-        
-
-            # create an h5 dataset to store the data
-            self.buffer_h5 = self.h5_group.create_dataset(name  = 'buffer', 
-                                                          shape = self.buffer.shape,
-                                                          dtype = self.buffer.dtype)
-            
-            
-        
-
-#             self.recorder.create_file('wide_mov',frame_rate)
         
-        self.track_disp_queue = queue.Queue(1000)
-#         self.wide_disp_queue = queue.Queue(1000)
-        self.motor_queue = queue.Queue(1000)
-        self.comp_thread = SubMeasurementQThread(self.camera_action)
-        self.motor_thread = SubMeasurementQThread(self.motor_action)
-        
-        self.interrupt_subthread.connect(self.comp_thread.interrupt)
-        self.interrupt_subthread.connect(self.motor_thread.interrupt)
-        
-        self.pid = PIDController(p = self.settings.proportional.value(),
-                             i = self.settings.integral.value(),
-                             d = self.settings.derivative.value())
-        self.midpoint = (self.track_cam.settings.height.value()//self.settings.binning.value())//2
-        self.pix_size = self.settings.pixel_size.value() * self.settings.binning.value()
-
+        # the engine gets a snapshot of the settings, on_param_changed
+        # sends it the settings changed during the run, except the ones it
+        # only reads at start, they are read-only until the run ends
+        start_names = START_PARAMS + ('use_wide_cam',)
+        start_ro = dict((name, self.settings.get_lq(name).ro) for name in start_names)
+        for name in start_names:
+            self.settings.get_lq(name).change_readonly(True)
+        # the stage locks the manual controls of daqmotor until it is closed
+        self.stage = DAQMotorStage(self.daqmotor)
         try:
-            self.track_i = 0
-            self.i = 0
-#             self.wide_i = 0
-            
-            self.track_flag = False
-            
-            self.track_cam.start()
-#             self.wide_cam.start()
-            self.comp_thread.start()
-            self.motor_thread.start()
-            
+            self.engine = AntWatchEngine(self.track_cam._dev,
+                                         self.stage,
+                                         recorder = self.recorder._dev,
+                                         wide_cam = self.wide_cam._dev if self.settings.use_wide_cam.value() else None,
+                                         params = dict((name, self.settings[name]) for name in DEFAULT_PARAMS),
+                                         data_path = data_path,
+                                         open_h5 = self.open_h5)
+        except Exception:
+            self.stage.close()
+            for name, ro in start_ro.items():
+                self.settings.get_lq(name).change_readonly(ro)
+            raise
+        try:
+            self.engine.start()
             # Will run forever until interrupt is called.
+            # the tracking state is published at the display rate, the
+            # hardware statistics every 0.5 s
+            last_stats = time.perf_counter()
             while not self.interrupt_measurement_called:
-                #wait for 0.1ms
-                time.sleep(0.5)
-        
-                if self.interrupt_measurement_called:
-                    # Listen for interrupt_measurement_called flag.
-                    # This is critical to do, if you don't the measurement will
-                    # never stop.
-                    # The interrupt button is a polite request to the 
-                    # Measurement thread. We must periodically check for
-                    # an interrupt request
-                    self.interrupt_subthread.emit()
-                    break
-
+                time.sleep(1.0 / self.settings['display_rate'])
+                self.read_status()
+                self.stage.publish()
+                if time.perf_counter() - last_stats > 0.5:
+                    last_stats = time.perf_counter()
+                    self.track_cam.read_frame_stats()
+                    self.track_cam.read_roi()
+                    if self.settings.save_video.value():
+                        self.recorder.read_stats()
         finally:
-            self.track_cam.stop()
-#             self.wide_cam.stop()
-            if self.settings.save_video.value():
-                self.recorder.close()
+            self.engine.stop()
+            self.stage.close()
+            self.track_cam.read_frame_stats()
+            for name, ro in start_ro.items():
+                self.settings.get_lq(name).change_readonly(ro)
             
-            del self.motor_thread           
-            del self.comp_thread
-            del self.motor_queue
-            del self.track_disp_queue
-            if self.settings.save_video.value():
-                self.recorder.close()
-                self.h5file.close()
-#             del self.wide_disp_queue
-
-    def camera_action(self):
+    def open_h5(self, fname):
+        '''
+        create a trail file with the app, hardware and measurement settings
+        
+        return: h5 file and the measurement group
         '''
-        format the image properly, and find centroid on the track cam
+        h5file = h5_io.h5_base_file(app=self.app, measurement=self,fname = fname)
+        
+        # create a measurement H5 group (folder) within self.h5file
+        # This stores all the measurement meta-data in this group
+        h5_group = h5_io.h5_create_measurement_group(measurement=self, h5group=h5file)
+        return h5file, h5_group
+    
+    def on_param_changed(self, name):
         '''
-        try:
-            self.i += 1
-            self.track_i += 1
-            self.track_i %= 6
-            track_image = self.track_cam.read()
-            
-            if self.track_flag:
-                if self.settings.save_video.value():
-                    self.recorder.save_frame('track_mov',track_image)
-                    self.buffer[self.i,0] = self.daqmotor.settings.x.value()
-                    self.buffer[self.i,1] = self.daqmotor.settings.y.value()
-                    self.buffer_h5[self.i,:] = self.buffer[self.i,:]
-                    self.h5file.flush()
-                if self.track_i % 2 == 0:
-                    time.sleep(0.001)
-                    track_data = self.track_cam._dev.to_numpy(track_image)
-                    track_disp_data = np.copy(track_data)
-                    self.track_disp_queue.put(np.fliplr(track_disp_data.transpose()))
-                    try:
-                        cms = find_centroid(image = track_data, 
-                                            threshold = self.settings.threshold.value(), 
-                                            binning = self.settings.binning.value())
-                        tracker_size = self.track_cam.settings.height.value()//self.settings.binning.value()
-                        self.settings.x.update_value(cms[1])
-                        self.settings.y.update_value(tracker_size - cms[0])
-                        if self.settings.track_ant.value():
-                            self.motor_queue.put((cms[1],tracker_size - cms[0]))
-                    except Exception as ex:
-                        print('CMS Error : %s' % ex)
-            else:
-                if self.track_i == 0:
-                    track_data = self.track_cam._dev.to_numpy(track_image)
-                    if not self.settings.track_ant.value():
-                        track_disp_data = np.copy(track_data)
-                        self.track_disp_queue.put(np.fliplr(track_disp_data.transpose()))
-                    if track_data.min()< self.settings.threshold.value():
-                        self.track_flag = True
-            
-                
-        except Exception as ex:
-            print('Error : %s' % ex)
-            
-#         try:
-#             self.wide_i += 1
-#             self.wide_i %= 5
-#             wide_image= self.wide_cam.read()
-#             
-#             if self.track_flag:
-#                 if self.settings.save_video.value():
-#                     self.recorder.save_frame('wide_mov',wide_image)
-#                 if self.wide_i == 0:
-#                     time.sleep(0.001)
-#                     wide_data = self.wide_cam._dev.to_numpy(wide_image)
-#                     self.wide_disp_queue.put(wide_data)
-#         except Exception as ex:
-#             print('Error : %s' % ex)
-            
-            
-    def motor_action(self):
-        if self.settings.track_ant.value():
-            cords = self.motor_queue.get()
-            error_x = (cords[0] - self.midpoint) * self.pix_size
-            error_y = (cords[1] - self.midpoint) * self.pix_size
-            x_fb = self.pid.feedback(error_x)
-            y_fb = self.pid.feedback(error_y)
-            new_x = self.daqmotor.settings.x.value() + x_fb
-            new_y = self.daqmotor.settings.y.value() + y_fb
-            if new_x < self.daqmotor.settings.bound_x.value():
-                self.daqmotor.settings.move_to_x.update_value(self.daqmotor.settings.bound_x.value()+2)
-            elif new_x > self.daqmotor.settings.move_to_x.vmax:
-                self.daqmotor.settings.move_to_x.update_value(self.daqmotor.settings.move_to_x.vmax-2)
-            else:
-                self.daqmotor.settings.move_to_x.update_value(new_x)
-            if new_y < self.daqmotor.settings.bound_y.value():
-                self.daqmotor.settings.move_to_y.update_value(self.daqmotor.settings.bound_y.value()+2)
-            elif new_y > self.daqmotor.settings.move_to_y.vmax:
-                self.daqmotor.settings.move_to_y.update_value(self.daqmotor.settings.move_to_y.vmax-2)
-            else:
-                self.daqmotor.settings.move_to_y.update_value(new_y)
-            self.daqmotor.move_to_auto()
-        else:
-            time.sleep(0.2)
-                
-
+        send a changed setting to the running engine
+        '''
+        if self.engine is not None:
+            self.engine.set_params(**{name: self.settings[name]})
+    
+    def on_bounds_changed(self):
+        if self.stage is not None:
+            self.stage.read_limits()
+    
+    def read_status(self):
+        '''
+        update the read-only settings from the engine
+        '''
+        for name, value in self.engine.get_status().items():
+            self.settings[name] = value
@@ -0,0 +1,126 @@
+import argparse
+import json
+import time
+import numpy as np
+from AntCamHW.flircam.flircam_sim_dev import FLIRCamSimDev
+from AntCamHW.flircam.flirrec_dev import FLIRRecDev, RECORDERS
+from .ant_watch_engine import AntWatchEngine, DEFAULT_PARAMS
+from .stages import SimStage, DAQMotorDevStage
+
+'''
+Runs the ant_watch pipeline without a display, e.g. on an analysis server
+or for long throughput tests:
+
+    python -m AntCamMS.ant_watch_cli --duration 60 --set track_ant=1
+    python -m AntCamMS.ant_watch_cli --camera flir --camera-sn 17549488 --stage daq --save data/test
+
+PySpin is only imported for a FLIR camera and PyDAQmx only for the DAQ stage
+'''
+
+def parse_param(text):
+    '''
+    parse name=value, the value gets the type of the default of the parameter
+    '''
+    name, _, value = text.partition('=')
+    if name not in DEFAULT_PARAMS:
+        raise argparse.ArgumentTypeError('unknown parameter %s' % name)
+    default = DEFAULT_PARAMS[name]
+    if isinstance(default, bool):
+        return name, value.lower() in ('1', 'true', 'yes', 'on')
+    return name, type(default)(value)
+
+def open_camera(kind, camera_sn, frame_rate, source = ''):
+    '''
+    return: camera device, FLIRCamDev or FLIRCamSimDev
+    '''
+    if kind == 'flir':
+        from AntCamHW.flircam.flircam_dev import FLIRCamDev
+        camera = FLIRCamDev(camera_sn)
+        camera.set_frame_rate(frame_rate)
+        return camera
+    return FLIRCamSimDev(camera_sn, source = source, frame_rate = frame_rate)
+
+def open_stage(kind, location_file = None):
+    '''
+    return: stage adapter, see stages.py
+    '''
+    if kind == 'daq':
+        from AntCamHW.daqmotor.daqmotor_dev import DAQMotorDev
+        dev = DAQMotorDev(chans = 'Dev2/port0/line5,Dev2/port1/line0,Dev2/port0/line1,Dev2/port1/line1',
+                          counter = ['Dev2/ctr0','Dev2/ctr1'],
+                          term = ['/Dev2/PFI12','/Dev2/PFI13'],
+                          freq = 8000,
+                          dc = 0.5)
+        return DAQMotorDevStage(dev, location_file)
+    return SimStage()
+
+def print_status(status, t):
+    print('%7.1f s  x %6.2f  y %6.2f  ring %3i overruns %5i  latency p50 %6.1f ms  p99 %6.1f ms' %
+          (t, status['x'], status['y'], status['track_ring_occupancy'], status['track_ring_overruns'],
+           status['latency_p50'], status['latency_p99']))
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Run ant_watch tracking without a display')
+    parser.add_argument('--camera', choices = ['sim', 'flir'], default = 'sim', help = 'track camera')
+    parser.add_argument('--camera-sn', default = 'track_cam', help = 'serial number of the track camera')
+    parser.add_argument('--sim-source', default = '', help = 'avi file replayed by the simulated camera')
+    parser.add_argument('--wide', choices = ['none', 'sim', 'flir'], default = 'none', help = 'wide camera')
+    parser.add_argument('--wide-sn', default = 'wide_cam', help = 'serial number of the wide camera')
+    parser.add_argument('--frame-rate', type = float, default = 50, help = 'frame rate of the cameras in fps')
+    parser.add_argument('--stage', choices = ['sim', 'daq'], default = 'sim', help = 'stage')
+    parser.add_argument('--location-file', help = 'location file of the DAQ stage, e.g. motor_location.h5')
+    parser.add_argument('--save', metavar = 'DIR', help = 'record the videos and the trail file to DIR')
+    parser.add_argument('--format', choices = sorted(RECORDERS), default = 'h5', help = 'video file format')
+    parser.add_argument('--h5-compress', action = 'store_true',
+                        help = 'lzf compress h5 videos, about 20 ms per 1024x1024 frame')
+    parser.add_argument('--segment-minutes', type = float, default = 0, help = 'segment duration, 0 for one file')
+    parser.add_argument('--duration', type = float, help = 'seconds to run, until Ctrl-C if not set')
+    parser.add_argument('--status-period', type = float, default = 1.0, help = 'seconds between status lines')
+    parser.add_argument('--set', type = parse_param, action = 'append', default = [], metavar = 'NAME=VALUE',
+                        help = 'set an engine parameter, see DEFAULT_PARAMS')
+    parser.add_argument('--stats', help = 'JSON file to save the final statistics to')
+    args = parser.parse_args(argv)
+
+    params = dict(DEFAULT_PARAMS)
+    params.update(args.set)
+    params['save_video'] = args.save is not None
+
+    track_cam = open_camera(args.camera, args.camera_sn, args.frame_rate, args.sim_source)
+    wide_cam = None
+    if args.wide != 'none':
+        wide_cam = open_camera(args.wide, args.wide_sn, args.frame_rate)
+    stage = open_stage(args.stage, args.location_file)
+    recorder = None
+    if args.save is not None:
+        recorder = FLIRRecDev(args.save, file_format = args.format, segment_seconds = 60 * args.segment_minutes,
+                              h5_compress = args.h5_compress)
+
+    engine = AntWatchEngine(track_cam, stage, recorder, wide_cam, params, data_path = args.save)
+    engine.start()
+    t0 = time.perf_counter()
+    try:
+        while args.duration is None or time.perf_counter() - t0 < args.duration:
+            time.sleep(args.status_period)
+            print_status(engine.get_status(), time.perf_counter() - t0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stats = engine.stop()
+        status = engine.get_status()
+        track_cam.close()
+        if wide_cam is not None:
+            wide_cam.close()
+        stage.close()
+
+    for name in sorted(stats):
+        print('%-40s %s' % (name, stats[name]))
+    if args.stats:
+        result = dict((name, value.item() if isinstance(value, np.generic) else value)
+                      for name, value in stats.items())
+        result['latency_hist'] = status['latency_hist'].tolist()
+        with open(args.stats, 'w') as f:
+            json.dump(result, f, indent = 1)
+    return stats
+
+if __name__ == '__main__':
+    main()
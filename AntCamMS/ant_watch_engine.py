@@ -0,0 +1,668 @@
+try:
+    import h5py
+except ImportError:
+    #the trail file needs h5py
+    h5py = None
+import numpy as np
+import os
+import queue
+import threading
+import time
+from types import MappingProxyType
+from .helper_funcs import CentroidTracker, BackgroundModel, PIDController, ConstantVelocityKalman, crop_centroid
+from .acquisition import AcquisitionManager, FrameMailbox
+from .trajectory_log import TrajectoryLog
+from .latency import LatencyLog
+from AntCamHW.flircam.frame_pool import FramePool
+from AntCamHW.flircam.flirrec_dev import SegmentIndex
+
+'''
+AntWatchEngine is the ant_watch pipeline without a user interface: the
+track camera (and the wide camera) are read by AcquisitionManager, the
+tracker finds the ant in every frame, the motor thread moves the stage to
+it and the recorder thread writes the videos and the trail file. It only
+uses camera devices (FLIRCamDev, FLIRCamSimDev), a FLIRRecDev and a stage
+adapter (see stages.py), so it runs without Qt or ScopeFoundry.
+AntWatchMeasure is the GUI on top of it, ant_watch_cli runs it headless
+'''
+
+FRAME_INFO_DTYPE = np.dtype([('timestamp', np.int64),
+                             ('frame_id', np.int64),
+                             ('host_time', np.float64),
+                             ('offset_x', np.int32),
+                             ('offset_y', np.int32)])
+
+# columns of the trail file, one row per recorded frame of the track camera:
+# capture sequence number, frame info, stage position (buffer), moments of
+# the tracked blob and the stage target commanded last
+TRAIL_COLUMNS = [('seq', np.int64, ()),
+                 ('frame_info', FRAME_INFO_DTYPE, ()),
+                 ('buffer', np.float64, (2,)),
+                 ('moments', np.float64, (5,)),
+                 ('target', np.float64, (2,))]
+
+# boundaries of the tracking loop every frame is timestamped at: capture on
+# the host clock (mapped from the camera clock with the shortest transfer
+# delay), receive, centroid found, taken by the motor thread, PID feedback,
+# move command and the last pulse sent to the stage
+LATENCY_STAGES = ['exposure', 'received', 'tracked', 'dequeued', 'feedback', 'command', 'done']
+# 1 ms bins of the latency histograms
+LATENCY_BINS = 250
+
+# parameters of the engine, the settings of AntWatchMeasure have the same names
+DEFAULT_PARAMS = {'save_video': False,
+                  'record_full': True,
+                  'record_crop': False,
+                  'crop_size': 200,
+                  'wide_display_period': 5,
+                  'wide_record_period': 1,
+                  'ring_size': 32,
+                  'display_rate': 15.0,
+                  'log_flush_period': 1.0,
+                  'track_ant': False,
+                  'pixel_size': 0.05547850208,
+                  'binning': 16,
+                  'threshold': 85,
+                  'search_window': 8,
+                  'multi_blob': True,
+                  'min_blob_area': 1,
+                  'adaptive_threshold': False,
+                  'background_k': 4.0,
+                  'background_alpha': 0.02,
+                  'background_period': 10,
+                  'roi_follow': False,
+                  'roi_hysteresis': 2,
+                  'proportional': 0.12,
+                  'integral': 0.0,
+                  'derivative': 0.05,
+                  'predict': False,
+                  'lead_time': 0.05,
+                  'process_noise': 500.0,
+                  'measurement_noise': 0.2}
+
+# parameters that size the buffers, files and threads, they are read by
+# start and cannot change while the engine runs (set_params drops them,
+# AntWatchMeasure makes their settings read-only during a run). All other
+# parameters take effect with the next frame
+START_PARAMS = ('save_video', 'record_full', 'record_crop', 'crop_size',
+                'wide_display_period', 'wide_record_period', 'ring_size',
+                'pixel_size', 'binning', 'adaptive_threshold')
+
+class LoopThread(threading.Thread):
+    '''
+    Runs a function in a loop on its own thread until stop is called
+    '''
+    def __init__(self, func, name):
+        super(LoopThread, self).__init__(name = name)
+        self.daemon = True
+        self.func = func
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.func()
+
+    def stop(self):
+        self.stop_event.set()
+
+def open_trail_h5(fname, params):
+    '''
+    create a trail file without ScopeFoundry, the datasets are in
+    /measurement/ant_watch like in the files of AntWatchMeasure
+
+    fname: file name
+    params: parameters of the engine, saved as attributes of the settings group
+    return: h5 file and the measurement group
+    '''
+    if h5py is None:
+        raise RuntimeError('h5py is not installed, unable to write %s' % fname)
+    h5file = h5py.File(fname, 'w')
+    group = h5file.create_group('measurement/ant_watch')
+    settings = group.create_group('settings')
+    for name in DEFAULT_PARAMS:
+        settings.attrs[name] = params[name]
+    return h5file, group
+
+class AntWatchEngine(object):
+    '''
+    Acquisition, tracking, stage control and recording of ant_watch
+    '''
+    def __init__(self, track_cam, stage, recorder = None, wide_cam = None, params = None,
+                 data_path = '.', open_h5 = None):
+        '''
+        track_cam: camera device of the track camera, FLIRCamDev or FLIRCamSimDev
+        stage: stage adapter, see stages.py
+        recorder: FLIRRecDev, nothing is saved without a recorder
+        wide_cam: camera device of the wide camera, None to only use the track camera
+        params: mapping of parameter name and value, DEFAULT_PARAMS if None,
+                copied into the snapshot the threads read, see set_params
+        data_path: directory of the videos and the trail file
+        open_h5: function(fname) that creates a trail file and returns it
+                 with its measurement group, open_trail_h5 if None
+        '''
+        self.track_cam = track_cam
+        self.stage = stage
+        self.recorder = recorder
+        self.wide_cam = wide_cam
+        #read-only snapshot, replaced as a whole by set_params
+        self.params = MappingProxyType(dict(DEFAULT_PARAMS if params is None else params))
+        self.data_path = data_path
+        self.open_h5 = open_h5
+        #values updated by the threads, see get_status
+        self.status = {'x': 32.0, 'y': 32.0,
+                       'velocity_x': 0.0, 'velocity_y': 0.0,
+                       'innovation_rms': 0.0, 'innovation_nis': 0.0,
+                       'predictor_dropouts': 0}
+        self.running = False
+
+    def set_params(self, **changes):
+        '''
+        replace the parameter snapshot. The threads read self.params once per
+        frame without a lock, so they see the old or the new snapshot but
+        never a mix of both. The tuning of the tracker, the PID controller,
+        the predictor, the display and the trail file is applied here
+        instead of on every frame. Changes of START_PARAMS are dropped while
+        the engine runs
+
+        changes: parameter name and new value
+        '''
+        if self.running:
+            for name in START_PARAMS:
+                if name in changes and changes[name] != self.params[name]:
+                    print('%s can not change while ant_watch runs, keeping %s' % (name, self.params[name]))
+                    del changes[name]
+        params = dict(self.params)
+        params.update(changes)
+        self.params = MappingProxyType(params)
+        if self.running:
+            self.apply_params(self.params)
+
+    def apply_params(self, params):
+        '''
+        copy the parameters that are not read per frame to the tracker, the
+        PID controller, the predictor, the mailboxes and the trail file
+        '''
+        self.tracker.threshold = params['threshold']
+        self.tracker.window = params['search_window']
+        self.tracker.multi_blob = params['multi_blob']
+        self.tracker.min_area = params['min_blob_area']
+        self.tracker.background_period = params['background_period']
+        if self.tracker.background is not None:
+            self.tracker.background.k = params['background_k']
+            self.tracker.background.alpha = params['background_alpha']
+        self.pid.p = params['proportional']
+        self.pid.i = params['integral']
+        self.pid.d = params['derivative']
+        self.predictor.process_noise = params['process_noise']
+        self.predictor.measurement_noise = params['measurement_noise']
+        self.track_mailbox.period = 1.0 / params['display_rate']
+        self.wide_mailbox.period = 1.0 / params['display_rate']
+        if self.saving:
+            self.trail_log.flush_period = params['log_flush_period']
+
+    def start(self):
+        '''
+        open the files, start the cameras and the threads
+        '''
+        params = self.params
+        self.saving = self.recorder is not None and params['save_video']
+        # rows of the buffers are reused, frame i is kept in row i % 60000
+        # until it is written to the trail file, buffer_seq is the frame a
+        # row holds and its values are NaN until the tracker fills them
+        self.buffer = np.full((60000,2), np.nan)
+        # row, col, area, orientation, eccentricity of the tracked blob
+        self.moments_buffer = np.full((60000,5), np.nan)
+        self.buffer_seq = np.full(60000, -1, dtype = np.int64)
+        # recorded frames the tracker skipped or did not finish in time
+        self.untracked = 0
+        self.track_cam.set_buffer_count(500)
+        frame_rate = self.track_cam.get_frame_rate()
+
+        if self.saving:
+            try:
+                os.makedirs(self.data_path)
+            except OSError:
+                print('directory already exist, writing to existing directory')
+            self.recorder.set_path(self.data_path)
+
+            if params['record_full']:
+                self.recorder.create_file('track_mov',frame_rate)
+            if params['record_crop']:
+                self.recorder.create_file('crop_mov',frame_rate)
+                crop_size = params['crop_size']
+                # the writer holds the crops until they are written
+                self.crop_pool = FramePool((2*crop_size,2*crop_size),np.uint8)
+
+            #save h5, split into segments of as many frames as the videos
+            file_name_index=0
+            file_name=os.path.join(self.data_path,'trail_'+str(file_name_index))
+            while os.path.exists(file_name + '.h5') or os.path.exists(file_name + '_s000.h5'):
+                file_name_index+=1
+                file_name=os.path.join(self.data_path,'trail_'+str(file_name_index))
+            self.trail_name = file_name
+            segment_seconds = self.recorder.get_segment_seconds()
+            self.trail_segmented = segment_seconds > 0
+            self.trail_rows = int(round(segment_seconds * frame_rate))
+            self.trail_index = SegmentIndex(self.trail_name + '-index.csv')
+            self.trail_segment = 0
+            # rows written to all segments, row k belongs to frame k of track_mov
+            self.trail_written = 0
+            self.open_trail()
+
+            if self.wide_cam is not None:
+                self.recorder.create_file('wide_mov',
+                                          self.wide_cam.get_frame_rate() / params['wide_record_period'])
+
+        self.track_mailbox = FrameMailbox(1.0 / params['display_rate'])
+        self.wide_mailbox = FrameMailbox(1.0 / params['display_rate'])
+        self.motor_queue = queue.Queue(1000)
+        cameras = {'track_cam': self.track_cam}
+        if self.wide_cam is not None:
+            cameras['wide_cam'] = self.wide_cam
+        self.acquisition = AcquisitionManager(cameras, 'track_cam',
+                                              tolerance = 0.5 / frame_rate,
+                                              ring_size = params['ring_size'])
+        if self.saving:
+            # the capture never waits for the recorder, backpressure is left to
+            # the write policy of the recorder queue. Frames the recorder thread
+            # is too late for are counted as record_ring_overruns
+            self.record_cursor = self.acquisition.add_consumer('track_cam', 'recorder', 'drop_oldest')
+            self.record_thread = LoopThread(self.record_action, 'recorder')
+        if self.wide_cam is not None:
+            self.acquisition.add_action('wide_cam', self.wide_display_action,
+                                        params['wide_display_period'])
+            if self.saving:
+                self.acquisition.add_action('wide_cam', self.wide_record_action,
+                                            params['wide_record_period'])
+        self.comp_thread = LoopThread(self.camera_action, 'tracker')
+        self.motor_thread = LoopThread(self.motor_action, 'motor')
+
+        self.latency = LatencyLog(LATENCY_STAGES, nbins = LATENCY_BINS)
+        self.pid = PIDController(p = params['proportional'],
+                                 i = params['integral'],
+                                 d = params['derivative'],
+                                 naxis = 2,
+                                 period = 1.0 / frame_rate)
+        self.predictor = ConstantVelocityKalman(naxis = 2,
+                                                process_noise = params['process_noise'],
+                                                measurement_noise = params['measurement_noise'])
+        if params['adaptive_threshold']:
+            binning = params['binning']
+            background = BackgroundModel((self.track_cam.get_height()//binning,
+                                          self.track_cam.get_width()//binning),
+                                         binning = binning,
+                                         alpha = params['background_alpha'],
+                                         k = params['background_k'])
+        else:
+            background = None
+        self.tracker = CentroidTracker(threshold = params['threshold'],
+                                       binning = params['binning'],
+                                       window = params['search_window'],
+                                       background = background,
+                                       background_period = params['background_period'],
+                                       multi_blob = params['multi_blob'],
+                                       min_area = params['min_blob_area'])
+        # centroids are in binned pixels of the full sensor, also with a region of interest
+        self.tracker_size = self.track_cam.get_sensor_height()//params['binning']
+        self.tracker_width = self.track_cam.get_sensor_width()//params['binning']
+        self.midpoint = self.tracker_size//2
+        self.pix_size = (params['pixel_size'] * params['binning'] *
+                         self.track_cam.get_sensor_binning())
+
+        self.track_i = 0
+        self.i = 0
+        self.tracked_seq = -1
+        self.track_flag = False
+
+        self.acquisition.start()
+        self.comp_thread.start()
+        if self.saving:
+            self.record_thread.start()
+        self.motor_thread.start()
+        self.running = True
+
+    def stop(self):
+        '''
+        stop the threads and the cameras, write the frames left in the
+        rings and close the files
+
+        return: dict of the final frame, acquisition and recorder statistics
+        '''
+        if not self.running:
+            return {}
+        self.running = False
+        self.comp_thread.stop()
+        self.motor_thread.stop()
+        self.acquisition.stop()
+        record_stats = {}
+        if self.saving:
+            # the rings are drained and closed, the recorder thread ends
+            self.record_thread.stop()
+            self.record_thread.join()
+            # waits for the writers to finish the queued frames
+            record_stats = self.recorder.close()
+        self.comp_thread.join()
+        self.motor_thread.join()
+        self.track_mailbox.clear()
+        self.wide_mailbox.clear()
+
+        stats = dict(self.track_cam.get_frame_stats())
+        stats.update(self.acquisition.get_stats())
+        for name, rec_stats in record_stats.items():
+            for key, value in rec_stats.items():
+                stats[name + '_' + key] = value
+        if self.saving:
+            stats['untracked_frames'] = self.untracked
+            for key, value in stats.items():
+                self.h5_group.attrs[key] = value
+            self.latency.save(self.h5_group)
+            self.close_trail()
+        return stats
+
+    def get_status(self):
+        '''
+        return: dict of the tracker, predictor, ring and latency values, the
+        names are the names of the settings of AntWatchMeasure
+        '''
+        status = dict(self.status)
+        stats = self.acquisition.workers['track_cam'].ring.get_stats()
+        status['track_ring_occupancy'] = stats['bundle_occupancy']
+        status['track_ring_overruns'] = stats['bundle_overruns']
+        if 'recorder_occupancy' in stats:
+            status['record_ring_occupancy'] = stats['recorder_occupancy']
+            status['record_ring_overruns'] = stats['recorder_overruns']
+        for k, stage in enumerate(LATENCY_STAGES[1:]):
+            status['latency_' + stage] = 1000 * self.latency.percentile(k + 1, 50)
+        status['latency_p50'] = 1000 * self.latency.percentile(0, 50)
+        status['latency_p95'] = 1000 * self.latency.percentile(0, 95)
+        status['latency_p99'] = 1000 * self.latency.percentile(0, 99)
+        status['latency_hist'] = self.latency.hist[0].copy()
+        return status
+
+    def open_trail(self):
+        '''
+        open a segment of the trail file, its rows are appended with
+        write_trail
+        '''
+        self.trail_file = self.trail_name
+        if self.trail_segmented:
+            self.trail_file += '_s%03i' % self.trail_segment
+        self.trail_file += '.h5'
+        if self.open_h5 is None:
+            self.h5file, self.h5_group = open_trail_h5(self.trail_file, self.params)
+        else:
+            self.h5file, self.h5_group = self.open_h5(self.trail_file)
+        self.h5_group.attrs['segment'] = self.trail_segment
+
+        # create the h5 datasets to store the data
+        self.trail_log = TrajectoryLog(self.h5_group, TRAIL_COLUMNS,
+                                       flush_period = self.params['log_flush_period'])
+        moments_h5 = self.trail_log.datasets['moments']
+        moments_h5.attrs['columns'] = ['row', 'col', 'area', 'orientation', 'eccentricity']
+        moments_h5.attrs['units'] = 'binned pixels of the full track camera sensor, orientation in radians from the row axis'
+        self.trail_log.datasets['buffer'].attrs['columns'] = ['x', 'y']
+        self.trail_log.datasets['target'].attrs['columns'] = ['move_to_x', 'move_to_y']
+        self.trail_first = (-1, -1, 0, np.nan)
+
+    def close_trail(self):
+        '''
+        close the current segment of the trail file and add it to the index
+        '''
+        self.trail_log.close()
+        count = len(self.trail_log)
+        self.h5file.close()
+        start_frame, start_index, start_timestamp, start_host_time = self.trail_first
+        self.trail_index.add(self.trail_segment, os.path.basename(self.trail_file), start_frame, start_index,
+                             start_timestamp, start_host_time, count,
+                             os.path.getsize(self.trail_file))
+
+    def write_trail(self, track_frame, position, moments):
+        '''
+        append the stage position, moments and frame info of a tracked frame
+        to the trail file, starts the next segment when the current one is full
+
+        position: stage position of the frame, NaN if it was not tracked
+        moments: moments of the blob, NaN if it was not found or tracked
+        '''
+        if self.trail_segmented and len(self.trail_log) >= self.trail_rows:
+            self.close_trail()
+            self.trail_segment += 1
+            self.open_trail()
+        i = track_frame.seq
+        if len(self.trail_log) == 0:
+            # every recorded frame gets a row, nothing is dropped
+            self.trail_first = (self.trail_written, self.trail_written,
+                                track_frame.timestamp, track_frame.host_time)
+        self.trail_written += 1
+        self.trail_log.append(seq = i,
+                              frame_info = (track_frame.timestamp, track_frame.frame_id, track_frame.host_time,
+                                            track_frame.offset_x, track_frame.offset_y),
+                              buffer = position,
+                              moments = moments,
+                              target = self.stage.get_target())
+
+    def camera_action(self):
+        '''
+        find the centroid on the track cam
+        '''
+        try:
+            bundle = self.acquisition.get_bundle()
+            if bundle is None:
+                return
+            params = self.params
+            track_frame = bundle['track_cam']
+            self.latency.start(track_frame.seq, bundle.time)
+            self.latency.stamp(track_frame.seq, 1, track_frame.host_time)
+            track_data = track_frame.data
+            # rows of the buffers are indexed by the capture sequence number
+            self.i = track_frame.seq
+            j = self.i % self.buffer.shape[0]
+            self.track_i += 1
+            self.track_i %= 6
+            if self.saving:
+                self.buffer[j,:] = np.nan
+                self.moments_buffer[j,:] = np.nan
+                self.buffer_seq[j] = self.i
+
+            if self.track_flag:
+                # the centroid is measured relative to where the stage was
+                # when the frame was taken, not where it is at motor time
+                capture_stage = self.stage.get_position()
+                if self.saving:
+                    self.buffer[j,:] = capture_stage
+                self.track_mailbox.put(track_frame)
+                try:
+                    cms = self.tracker.track(track_data,
+                                             offset = (track_frame.offset_y, track_frame.offset_x))
+                    self.latency.stamp(track_frame.seq, 2, time.perf_counter())
+                    tracker_size = self.tracker_size
+                    self.status['x'] = cms[1]
+                    self.status['y'] = tracker_size - cms[0]
+                    if params['track_ant']:
+                        self.motor_queue.put((cms[1],tracker_size - cms[0],track_frame.host_time,self.tracker.found,
+                                              track_frame.seq,capture_stage))
+                    if params['roi_follow'] and self.tracker.found:
+                        self.follow_roi(cms, track_data.shape, params)
+                    if self.saving and self.tracker.moments is not None:
+                        self.moments_buffer[j,:] = self.tracker.moments
+                except Exception as ex:
+                    print('CMS Error : %s' % ex)
+            else:
+                if not params['track_ant']:
+                    self.track_mailbox.put(track_frame)
+                # seed the background before the ant is in view
+                if self.tracker.background is not None:
+                    self.tracker.update_background(track_data,
+                                                   offset = (track_frame.offset_y, track_frame.offset_x))
+                if self.track_i == 0:
+                    if track_data.min()< params['threshold']:
+                        self.track_flag = True
+
+            self.tracked_seq = self.i
+            # the display holds its own lease on the frame
+            bundle.release()
+
+        except Exception as ex:
+            print('Error : %s' % ex)
+
+    def record_action(self):
+        '''
+        write the track camera frames to the video and their trail to the h5
+        file, reads the capture ring at its own rate so a slow disk
+        does not hold up the tracking
+        '''
+        track_frame = self.record_cursor.get(timeout = 0.5)
+        if track_frame is None:
+            return
+        try:
+            if self.track_flag:
+                i = track_frame.seq
+                j = i % self.buffer.shape[0]
+                if self.wait_for_tracker(i) and self.buffer_seq[j] == i:
+                    position = self.buffer[j]
+                    moments = self.moments_buffer[j]
+                else:
+                    # the tracker skipped the frame or is late, the row
+                    # belongs to another frame
+                    position = np.full(2, np.nan)
+                    moments = np.full(5, np.nan)
+                    self.untracked += 1
+                # centroid and stage position are kept by lossless recordings
+                metadata = {'row': moments[0],
+                            'col': moments[1],
+                            'x': position[0],
+                            'y': position[1]}
+                params = self.params
+                if params['record_full']:
+                    self.recorder.save_frame('track_mov',track_frame,metadata)
+                if params['record_crop']:
+                    self.save_crop(track_frame,metadata,params['binning'])
+                self.write_trail(track_frame, position, moments)
+        except Exception as ex:
+            print('Error : %s' % ex)
+        finally:
+            track_frame.release()
+
+    def save_crop(self, track_frame, metadata, binning):
+        '''
+        record the window around the centroid of a frame, the window is dark
+        when the ant was not found
+        '''
+        # binned full sensor coordinates to the center of the frame pixels
+        center = (metadata['row'] * binning + (binning - 1) / 2 - track_frame.offset_y,
+                  metadata['col'] * binning + (binning - 1) / 2 - track_frame.offset_x)
+        crop = self.crop_pool.lease()
+        crop_centroid(track_frame.data, center, self.crop_pool.shape[0] // 2, out = crop.data)
+        crop.timestamp = track_frame.timestamp
+        crop.frame_id = track_frame.frame_id
+        crop.host_time = track_frame.host_time
+        self.recorder.save_frame('crop_mov',crop,metadata)
+        crop.release()
+
+    def wait_for_tracker(self, seq, timeout = 0.1):
+        '''
+        wait until the tracker is done with a frame, or skipped it, so its
+        centroid can be recorded with the frame
+
+        return: False if the tracker did not get to the frame within timeout
+        '''
+        deadline = time.perf_counter() + timeout
+        while self.tracked_seq < seq and time.perf_counter() < deadline:
+            time.sleep(0.001)
+        return self.tracked_seq >= seq
+
+    def wide_display_action(self, wide_frame):
+        '''
+        runs on the capture thread of the wide camera for every
+        wide_display_period-th frame
+        '''
+        self.wide_mailbox.put(wide_frame)
+
+    def wide_record_action(self, wide_frame):
+        '''
+        runs on the capture thread of the wide camera for every
+        wide_record_period-th frame, once the ant is in view
+        '''
+        if self.track_flag:
+            self.recorder.save_frame('wide_mov',wide_frame)
+
+    def follow_roi(self, cms, shape, params):
+        '''
+        center the region of interest of the track camera on the centroid,
+        the offsets are only written when the centroid moved more than
+        roi_hysteresis binned pixels away from the center of the region
+
+        cms: centroid in binned pixels of the full sensor
+        shape: shape of the current frame in camera pixels
+        params: parameter snapshot of the frame
+        '''
+        binning = params['binning']
+        offset_y = int(cms[0] * binning) - shape[0] // 2
+        offset_x = int(cms[1] * binning) - shape[1] // 2
+        hysteresis = params['roi_hysteresis'] * binning
+        if (abs(offset_y - self.track_cam.offset_y) > hysteresis or
+                abs(offset_x - self.track_cam.offset_x) > hysteresis):
+            self.track_cam.move_roi(offset_x, offset_y)
+
+    def motor_action(self):
+        params = self.params
+        if params['track_ant']:
+            try:
+                cords = self.motor_queue.get(timeout = 0.5)
+            except queue.Empty:
+                return
+            #tracking runs on every frame, only act on the newest centroid
+            while not self.motor_queue.empty():
+                cords = self.motor_queue.get_nowait()
+            seq = cords[4]
+            self.latency.stamp(seq, 3, time.perf_counter())
+            stage_x, stage_y = self.stage.get_position()
+            error_x = (cords[0] - self.midpoint) * self.pix_size
+            error_y = (cords[1] - self.midpoint) * self.pix_size
+            if params['predict']:
+                error_x, error_y = self.predict_error(cords[5], (stage_x, stage_y), (error_x, error_y),
+                                                      cords[2] + params['lead_time'], cords[2], cords[3])
+            x_fb, y_fb = self.pid.feedback(np.array([error_x, error_y]), t = cords[2])
+            self.latency.stamp(seq, 4, time.perf_counter())
+            new_x = stage_x + x_fb
+            new_y = stage_y + y_fb
+            (min_x, max_x), (min_y, max_y) = self.stage.get_limits()
+            if new_x < min_x:
+                new_x = min_x + 2
+            elif new_x > max_x:
+                new_x = max_x - 2
+            if new_y < min_y:
+                new_y = min_y + 2
+            elif new_y > max_y:
+                new_y = max_y - 2
+            self.latency.stamp(seq, 5, time.perf_counter())
+            done_time = self.stage.move_to(new_x, new_y)
+            self.latency.stamp(seq, 6, done_time)
+        else:
+            time.sleep(0.2)
+
+    def predict_error(self, capture_stage, stage, error, t_lead, t, found):
+        '''
+        feed the ant position in stage coordinates to the predictor and return
+        the error between the stage and the predicted position at t_lead,
+        lead_time seconds after the frame was taken at t
+
+        capture_stage: (x, y) of the stage when the frame was taken
+        stage: (x, y) of the stage now
+        error: (x, y) of the ant relative to the stage in the frame
+        '''
+        if not found:
+            #the statistics are kept over the dropout
+            self.predictor.reset()
+            self.status['predictor_dropouts'] = self.predictor.dropouts
+            return error
+
+        self.predictor.update((capture_stage[0] + error[0], capture_stage[1] + error[1]), t)
+        lead = self.predictor.predict(t_lead)
+
+        stats = self.predictor.get_innovation_stats()
+        self.status['velocity_x'] = self.predictor.velocity[0]
+        self.status['velocity_y'] = self.predictor.velocity[1]
+        self.status['innovation_rms'] = np.sqrt(np.mean(stats['rms']**2))
+        self.status['innovation_nis'] = stats['nis']
+        return lead[0] - stage[0], lead[1] - stage[1]
@@ -13,6 +13,7 @@ import time
 import os
 from random import randint,random
 from PyQt5.QtWidgets import QDoubleSpinBox, QCheckBox
+from AntCamMS.helper_funcs import OdorGen
             
 class VOTABlockTrainingMeasure(Measurement):
     
@@ -635,76 +636,6 @@ class SideRec(object):
         '''
         return self.up_to_date
 
-class OdorGen(object):
-    '''
-    Object generate a time series of odor
-    '''
-    
-    def __init__(self,nchan = 8, T = 3000):
-        self.tick = 0 # millisecond time counter
-        self.nchan = nchan #number of channels
-        self.T = T # size of the output time series
-        self.odor_buffer = np.zeros((self.nchan,self.T))
-        self.odor_buffer_disp = np.zeros((self.nchan,self.T))
-        self.on = False
-    
-    def step(self):
-        '''
-        output the next odor level in the time series
-        '''
-        default_output = np.zeros((self.nchan,))
-        default_output[0] = 100
-        if self.on:
-            if self.tick < self.T -1:
-                self.tick += 1 
-                return self.odor_buffer[:,self.tick].squeeze(),self.odor_buffer_disp[:,self.tick].squeeze()
-            else:
-                self.on = False
-                self.odor_buffer[:] = 0
-                return default_output,default_output
-        else:
-            return default_output,default_output
-            
-    
-    def new_trial(self, channel = 4, level = 30, Tpulse = 50, interval = 2000):
-        '''
-        generate new time series
-        called from a task
-        '''
-        self.tick = 0 #reset tick
-        '''
-        Exponential Process Generation
-        '''
-        base_intervals = np.random.exponential(scale = interval, size = (50,)) #pulses are exponentially distributed
-        base_onsets = base_intervals.cumsum().astype(int)
-        
-        '''
-        Spike generation
-        '''
-        full_length = int(base_intervals.sum()+2000)
-        spike_trace = np.zeros((full_length,))
-        spike_trace[base_onsets] = 1
-        spike_trace = spike_trace[0:self.T]
-        '''
-        Covolution with a kernel for valve control
-        '''
-        y = np.ones((Tpulse,)) * level
-        output_trace_disp = np.convolve(spike_trace,y)[0:self.T] 
-        y[0:3] = 100
-        y[3:5] = 90
-        y[5:10] = 80
-        output_trace = np.convolve(spike_trace,y)[0:self.T]
-        output_trace =output_trace.clip(0,100) #amke sure output is with in range
-        '''
-        output to both solenoid valve buffer and display
-        '''
-        clean_trace = 100 - output_trace_disp
-        clean_trace = clean_trace.clip(0,100)
-        self.odor_buffer[0,:] = clean_trace
-        self.odor_buffer[channel,:] = output_trace
-        self.odor_buffer_disp[channel,:] = output_trace_disp
-        self.on = True
-        
 class TrainingTask(object):
     '''
     task object control the state of the task, and also generate each task
@@ -4,13 +4,241 @@ Created on Mar 31, 2018
 @author: AntMan
 '''
 import numpy as np
+import threading
+import time
 from scipy import ndimage
 
+# record of one connected blob on the binned grid, bounding box is r0:r1, c0:c1
+BLOB_DTYPE = np.dtype([('label', np.int32),
+                       ('area', np.uint32),
+                       ('row', np.float64),
+                       ('col', np.float64),
+                       ('r0', np.int32),
+                       ('r1', np.int32),
+                       ('c0', np.int32),
+                       ('c1', np.int32)])
+
+# kernels of find_centroid, one per (shape, binning, dtype) and thread, so
+# the buffers are allocated once and never shared between threads
+_kernels = threading.local()
+
+def get_kernel(shape, binning, dtype):
+    '''
+    cached BinningKernel of the calling thread
+    '''
+    if not hasattr(_kernels, 'cache'):
+        _kernels.cache = {}
+    key = (tuple(shape), binning, np.dtype(dtype))
+    kernel = _kernels.cache.get(key)
+    if kernel is None:
+        kernel = BinningKernel(shape, binning, dtype)
+        _kernels.cache[key] = kernel
+    return kernel
+
 def rebin(a, shape):
     sh = shape[0],a.shape[0]//shape[0],shape[1],a.shape[1]//shape[1]
     return a.reshape(sh).mean(-1).mean(1)
 
-def find_centroid(image, threshold = 120, low_pass = True, binning = 8):
+class BinningKernel(object):
+    '''
+    Integer binning and thresholding kernel. All intermediate results are
+    summed into buffers allocated once for the frame shape, a frame is binned
+    without any temporary float arrays
+    '''
+
+    def __init__(self, shape, binning = 8, dtype = np.uint8):
+        '''
+        shape: (height, width) of the input frames
+        binning: pixel binning number
+        dtype: data type of the input frames
+        '''
+        self.shape = tuple(shape)
+        self.binning = binning
+        self.hb = self.shape[0] // binning
+        self.wb = self.shape[1] // binning
+
+        #the first pass sums binning rows, fits in 16 bits for 8 bit frames
+        if np.dtype(dtype).itemsize == 1 and binning <= 257:
+            partial_dtype = np.uint16
+        else:
+            partial_dtype = np.uint32
+        self.partial = np.zeros((self.hb, self.shape[1]), dtype = partial_dtype)
+        self.sums = np.zeros((self.hb, self.wb), dtype = np.uint32)
+        self.mask = np.zeros((self.hb, self.wb), dtype = bool)
+        self.row_count = np.zeros((self.hb,), dtype = np.uint32)
+        self.col_count = np.zeros((self.wb,), dtype = np.uint32)
+        self.row_index = np.arange(self.hb, dtype = np.float64)
+        self.col_index = np.arange(self.wb, dtype = np.float64)
+
+        #buffers for the moments, columns of col_basis are 1, c, c**2 and
+        #rows of row_basis are 1, r, r**2
+        self.maskf = np.zeros((self.hb, self.wb), dtype = np.float64)
+        self.col_basis = np.stack((np.ones(self.wb), self.col_index, self.col_index**2), axis = 1)
+        self.row_basis = np.stack((np.ones(self.hb), self.row_index, self.row_index**2), axis = 0)
+        self.row_table = np.zeros((self.hb, 3), dtype = np.float64)
+        self.moment_table = np.zeros((3, 3), dtype = np.float64)
+
+        #buffers for connected component labeling, 8-connected
+        self.structure = np.ones((3, 3), dtype = int)
+        self.labels = np.zeros((self.hb, self.wb), dtype = np.int32)
+        self.row_grid = np.repeat(self.row_index[:, None], self.wb, axis = 1)
+        self.col_grid = np.repeat(self.col_index[None, :], self.hb, axis = 0)
+        self.blobs = np.zeros((16,), dtype = BLOB_DTYPE)
+
+    def bin(self, image, r0 = 0, r1 = None, c0 = 0, c1 = None):
+        '''
+        sum binning x binning blocks of the image within binned rows r0:r1 and
+        binned columns c0:c1
+
+        image: full frame image array
+        return: view of the internal uint32 buffer holding the block sums
+        '''
+        b = self.binning
+        r1 = self.hb if r1 is None else r1
+        c1 = self.wb if c1 is None else c1
+        nr = r1 - r0
+        nc = c1 - c0
+
+        #sum over rows first, numpy reduces a non-contiguous axis much faster
+        window = image[r0*b:r1*b, c0*b:c1*b].reshape((nr, b, nc*b))
+        partial = self.partial[0:nr, 0:nc*b]
+        np.add.reduce(window, axis = 1, dtype = partial.dtype, out = partial)
+
+        sums = self.sums[0:nr, 0:nc]
+        np.add.reduce(partial.reshape((nr, nc, b)), axis = 2, dtype = np.uint32, out = sums)
+        return sums
+
+    def threshold(self, sums, threshold, low_pass = True):
+        '''
+        threshold block sums against the threshold of the binned mean value
+
+        sums: block sums returned by bin
+        threshold: threshold on the mean pixel value of a block
+        low_pass: lock on to feature lower (True) or higher (False) than threshold
+        return: view of the internal boolean mask buffer
+        '''
+        mask = self.mask[0:sums.shape[0], 0:sums.shape[1]]
+        if low_pass:
+            np.less(sums, threshold * self.binning**2, out = mask)
+        else:
+            np.greater(sums, threshold * self.binning**2, out = mask)
+        return mask
+
+    def center_of_mass(self, mask):
+        '''
+        center of mass of a mask from its integer row and column counts
+
+        mask: boolean mask returned by threshold
+        return: (row, col) relative to the mask, None if the mask is empty
+        '''
+        nr, nc = mask.shape
+        row_count = self.row_count[0:nr]
+        col_count = self.col_count[0:nc]
+        np.add.reduce(mask, axis = 1, dtype = np.uint32, out = row_count)
+        total = int(row_count.sum())
+        if total == 0:
+            return None
+        np.add.reduce(mask, axis = 0, dtype = np.uint32, out = col_count)
+        return (row_count.dot(self.row_index[0:nr]) / total,
+                col_count.dot(self.col_index[0:nc]) / total)
+
+    def moments(self, mask):
+        '''
+        centroid, area, orientation and eccentricity of a mask, all raw
+        moments up to the second order come out of one pair of matrix products
+
+        mask: boolean mask returned by threshold
+        return: numpy array of (row, col, area, orientation, eccentricity),
+        relative to the mask, None if the mask is empty. area is in binned
+        pixels, orientation is the angle of the major axis from the row axis in
+        radians, eccentricity is 0 for a round blob and approaches 1 for a line
+        '''
+        nr, nc = mask.shape
+        maskf = self.maskf[0:nr, 0:nc]
+        np.copyto(maskf, mask)
+
+        #row_table[r, j] = sum of c**j over row r, moment_table[i, j] = sum of r**i * c**j
+        row_table = self.row_table[0:nr]
+        np.dot(maskf, self.col_basis[0:nc], out = row_table)
+        np.dot(self.row_basis[:, 0:nr], row_table, out = self.moment_table)
+        m = self.moment_table
+
+        area = m[0, 0]
+        if area == 0:
+            return None
+        row = m[1, 0] / area
+        col = m[0, 1] / area
+        mu20 = m[2, 0] / area - row**2
+        mu02 = m[0, 2] / area - col**2
+        mu11 = m[1, 1] / area - row * col
+
+        orientation = 0.5 * np.arctan2(2 * mu11, mu20 - mu02)
+        common = np.sqrt(((mu20 - mu02) / 2)**2 + mu11**2)
+        major = (mu20 + mu02) / 2 + common
+        minor = (mu20 + mu02) / 2 - common
+        if major > 0:
+            eccentricity = np.sqrt(max(1 - minor / major, 0))
+        else:
+            eccentricity = 0.0
+        return np.array((row, col, area, orientation, eccentricity))
+
+    def label(self, mask, min_area = 1):
+        '''
+        label the 8-connected blobs of a mask
+
+        mask: boolean mask returned by threshold
+        min_area: blobs smaller than this number of bins are dropped
+        return: view of the internal array of blob records (see BLOB_DTYPE)
+        relative to the mask, the labels of the blobs are in self.labels
+        '''
+        nr, nc = mask.shape
+        labels = self.labels[0:nr, 0:nc]
+        n = ndimage.label(mask, structure = self.structure, output = labels)
+        if n == 0:
+            return self.blobs[0:0]
+        if n > self.blobs.size:
+            self.blobs = np.zeros((max(n, 2 * self.blobs.size),), dtype = BLOB_DTYPE)
+
+        flat = labels.ravel()
+        area = np.bincount(flat, minlength = n + 1)[1:]
+        rows = np.bincount(flat, weights = self.row_grid[0:nr, 0:nc].ravel(), minlength = n + 1)[1:]
+        cols = np.bincount(flat, weights = self.col_grid[0:nr, 0:nc].ravel(), minlength = n + 1)[1:]
+
+        blobs = self.blobs[0:n]
+        blobs['label'] = np.arange(1, n + 1)
+        blobs['area'] = area
+        blobs['row'] = rows / area
+        blobs['col'] = cols / area
+        for i, box in enumerate(ndimage.find_objects(labels, n)):
+            blobs[i]['r0'] = box[0].start
+            blobs[i]['r1'] = box[0].stop
+            blobs[i]['c0'] = box[1].start
+            blobs[i]['c1'] = box[1].stop
+
+        if min_area > 1:
+            keep = np.flatnonzero(area >= min_area)
+            return blobs[keep]
+        return blobs
+
+    def select(self, mask, label):
+        '''
+        overwrite a mask with the bins of one labeled blob
+
+        mask: boolean mask passed to label
+        label: label of the blob from its record
+        '''
+        nr, nc = mask.shape
+        np.equal(self.labels[0:nr, 0:nc], label, out = mask)
+        return mask
+
+    def touches_border(self, mask):
+        '''
+        whether a mask reaches its border
+        '''
+        return bool(mask[0,:].any() or mask[-1,:].any() or
+                    mask[:,0].any() or mask[:,-1].any())
+
+def find_centroid(image, threshold = 120, low_pass = True, binning = 8, offset = (0, 0)):
     '''
     take a 2d array and find centroid of said array
     
@@ -18,46 +246,473 @@ def find_centroid(image, threshold = 120, low_pass = True, binning = 8):
     threshold: under
     mode: 'low' or 'high', lock on to feature lower or higher than threshold
     binning: pixel binning number to improve speed
+    offset: (row, col) of the image on the full sensor in pixels, e.g. the
+            offset of the region of interest, the centroid is returned in
+            binned pixels of the full sensor
     '''
     h = image.shape[0]
     w = image.shape[1]
+    r_off = offset[0] / binning
+    c_off = offset[1] / binning
+    center = (h/(binning*2) + r_off, w/(binning*2) + c_off)
     
     if h % binning == 0 and w % binning == 0:
-        hb = h // binning
-        wb = w // binning
         try:
-            imageb = rebin(image,(hb,wb))
+            kernel = get_kernel(image.shape, binning, image.dtype)
+            sums = kernel.bin(image)
+            cms = kernel.center_of_mass(kernel.threshold(sums, threshold, low_pass))
         except Exception as ex:
             print('Error: %s' % ex)
-            return (h/(binning*2),w/(binning*2))
-                
-        
-        if low_pass:
-            imagef = imageb < threshold
-        else:
-            imagef = imageb > threshold
-        
-        if imagef.max()>0:
-            try:
-                cms = ndimage.center_of_mass(imagef.astype(np.float))
-                return cms
-            except Exception as ex:
-                print('Error: %s' % ex)
-                return (h/(binning*2),w/(binning*2))
+            return center
+
+        if cms is not None:
+            return (cms[0] + r_off, cms[1] + c_off)
         else:
             #print('Could not identify any feature with the threshold settings, returning (h/2,w/2)')
-            return (h/(binning*2),w/(binning*2))
+            return center
         
     else:
         print('Height or width is not divisible by binning, returning (h/2,w/2)')
-        return (h/(binning*2),w/(binning*2))
-    
+        return center
+
+def crop_centroid(image, center, crop_size = 300, out = None):
+    '''
+    cut a window of 2*crop_size pixels around a point out of an image, the
+    part of the window outside of the image is dark, same as crop_cms of the
+    analysis notebook
+
+    image: input image array
+    center: (row, col) of the window center in pixels, a dark window is
+            returned if it is nan
+    crop_size: half size of the window in pixels
+    out: array of shape (2*crop_size, 2*crop_size) to write the window to,
+         allocated if None
+    return: out
+    '''
+    size = 2 * crop_size
+    if out is None:
+        out = np.zeros((size, size), dtype = image.dtype)
+    if np.isnan(center[0]) or np.isnan(center[1]):
+        out[:] = 0
+        return out
+    r = int(center[0])
+    c = int(center[1])
+    r0 = r - crop_size
+    c0 = c - crop_size
+    #part of the window inside the image
+    ir0 = max(r0, 0)
+    ir1 = min(r0 + size, image.shape[0])
+    ic0 = max(c0, 0)
+    ic1 = min(c0 + size, image.shape[1])
+    if ir1 <= ir0 or ic1 <= ic0:
+        out[:] = 0
+        return out
+    if ir0 > r0 or ir1 < r0 + size or ic0 > c0 or ic1 < c0 + size:
+        out[:] = 0
+    out[ir0 - r0:ir1 - r0, ic0 - c0:ic1 - c0] = image[ir0:ir1, ic0:ic1]
+    return out
+
+class BackgroundModel(object):
+    '''
+    Running background model on the binned grid. Every bin keeps an
+    exponential running mean and variance, a bin is foreground when it is
+    darker (or brighter) than its background by k standard deviations. All
+    updates are done in place on buffers allocated once
+    '''
+
+    def __init__(self, shape, binning = 1, alpha = 0.02, k = 4.0, min_sigma = 2.0, low_pass = True,
+                 max_foreground = 0.25, seed_frames = 10):
+        '''
+        shape: (rows, cols) of the binned grid
+        binning: binning used to produce the block sums, the model works on
+                 the mean pixel value of a block
+        alpha: weight of a new frame in the running mean and variance
+        k: number of standard deviations a foreground bin is away from the background
+        min_sigma: lower limit of the standard deviation, in pixel values
+        low_pass: foreground is darker (True) or brighter (False) than background
+        max_foreground: fraction of foreground bins above which the frame is
+                        taken as a lighting change and every bin is updated
+        seed_frames: number of frames averaged into the first mean and
+                     variance, bins under the mask are left out of the average
+        '''
+        self.shape = tuple(shape)
+        self.binning = binning
+        self.alpha = alpha
+        self.k = k
+        self.min_sigma = min_sigma
+        self.low_pass = low_pass
+        self.max_foreground = max_foreground
+        self.seed_frames = seed_frames
+        self.mean = np.zeros(self.shape, dtype = np.float32)
+        self.var = np.zeros(self.shape, dtype = np.float32)
+        self.level = np.zeros(self.shape, dtype = np.float32)
+        self.values = np.zeros(self.shape, dtype = np.float32)
+        self.delta = np.zeros(self.shape, dtype = np.float32)
+        self.scratch = np.zeros(self.shape, dtype = np.float32)
+        self.mask = np.zeros(self.shape, dtype = bool)
+        self.background = np.zeros(self.shape, dtype = bool)
+        self.seed_count = np.zeros(self.shape, dtype = np.float32)
+        self.kernel = None
+        self.reset()
+
+    def reset(self):
+        '''
+        forget the background, the next seed_frames updates seed it again
+        '''
+        self.initialized = False
+        self.updates = 0
+        self.mean[:] = 0
+        self.var[:] = 0
+        self.seed_count[:] = 0
+
+    def scale(self, sums, r0 = 0, c0 = 0):
+        '''
+        convert block sums to mean pixel values in the internal buffer
+        '''
+        values = self.values[r0:r0+sums.shape[0], c0:c0+sums.shape[1]]
+        np.multiply(sums, 1.0 / self.binning**2, out = values)
+        return values
+
+    def foreground(self, sums, r0 = 0, c0 = 0, out = None):
+        '''
+        foreground mask of block sums covering binned rows and columns
+        starting at r0, c0
+
+        sums: block sums, e.g. from BinningKernel.bin
+        out: boolean array to write the mask to, defaults to an internal buffer
+        return: boolean mask, all False while the model is seeded
+        '''
+        nr, nc = sums.shape
+        if out is None:
+            out = self.mask[r0:r0+nr, c0:c0+nc]
+        if not self.initialized:
+            out[:] = False
+            return out
+        values = self.scale(sums, r0, c0)
+        level = self.level[r0:r0+nr, c0:c0+nc]
+        if self.low_pass:
+            np.less(values, level, out = out)
+        else:
+            np.greater(values, level, out = out)
+        return out
+
+    def update(self, sums, mask = None):
+        '''
+        update the running mean and variance with the block sums of a full
+        frame, bins under the foreground mask are left untouched
+
+        sums: block sums of the full grid
+        mask: foreground mask of the same shape, or None to update every bin.
+              While the model is seeded it has no foreground of its own, pass
+              e.g. the mask of a fixed threshold so the ant is left out
+        '''
+        values = self.scale(sums)
+        if mask is None or np.count_nonzero(mask) > self.max_foreground * mask.size:
+            self.background[:] = True
+        else:
+            np.logical_not(mask, out = self.background)
+        if not self.initialized:
+            self.seed(values)
+        else:
+            delta = self.delta
+            scratch = self.scratch
+            np.subtract(values, self.mean, out = delta)
+            #var = (1 - alpha) * (var + alpha * delta**2)
+            np.multiply(delta, delta, out = scratch)
+            scratch *= self.alpha
+            scratch += self.var
+            scratch *= 1 - self.alpha
+            np.copyto(self.var, scratch, where = self.background)
+            #mean = mean + alpha * delta
+            delta *= self.alpha
+            np.add(self.mean, delta, out = self.mean, where = self.background)
+        self.updates += 1
+        if not self.initialized:
+            return
+
+        #detection level, k sigma away from the mean
+        np.sqrt(self.var, out = self.scratch)
+        np.maximum(self.scratch, self.min_sigma, out = self.scratch)
+        self.scratch *= self.k
+        if self.low_pass:
+            np.subtract(self.mean, self.scratch, out = self.level)
+        else:
+            np.add(self.mean, self.scratch, out = self.level)
+
+    def seed(self, values):
+        '''
+        add the background bins of a frame to the first mean and variance,
+        mean and var hold the sums of the values and their squares until
+        seed_frames frames were added
+        '''
+        np.multiply(values, values, out = self.scratch)
+        np.add(self.mean, values, out = self.mean, where = self.background)
+        np.add(self.var, self.scratch, out = self.var, where = self.background)
+        np.add(self.seed_count, 1, out = self.seed_count, where = self.background)
+        if self.updates + 1 < self.seed_frames:
+            return
+
+        unseen = self.seed_count == 0
+        np.maximum(self.seed_count, 1, out = self.seed_count)
+        self.mean /= self.seed_count
+        self.var /= self.seed_count
+        #var = mean of the squares - mean**2
+        np.multiply(self.mean, self.mean, out = self.scratch)
+        self.var -= self.scratch
+        np.maximum(self.var, self.min_sigma**2, out = self.var)
+        #bins that were foreground in every seed frame, e.g. under an ant
+        #that did not move, take the average background, or the last frame
+        #if no bin was background
+        if unseen.all():
+            np.copyto(self.mean, values)
+            self.var[:] = self.min_sigma**2
+        elif unseen.any():
+            seen = np.logical_not(unseen)
+            self.mean[unseen] = self.mean[seen].mean()
+            self.var[unseen] = self.var[seen].mean()
+        self.initialized = True
+
+    def detect(self, image, update = True, threshold = None):
+        '''
+        bin a full resolution frame, find its foreground and update the model,
+        for offline use (e.g. crop_cms in the analysis notebook)
+
+        image: full resolution image array
+        update: update the model with this frame
+        threshold: fixed threshold on the pixel values, used as the
+                   foreground while the model is seeded so the ant is left
+                   out of the seed, like CentroidTracker.update_background.
+                   If None the seed takes every bin and the mask is empty
+        return: foreground mask on the binned grid
+        '''
+        if self.kernel is None or self.kernel.shape != image.shape:
+            self.kernel = BinningKernel(image.shape, self.binning, image.dtype)
+        sums = self.kernel.bin(image)
+        if not self.initialized and threshold is not None:
+            mask = self.kernel.threshold(sums, threshold, self.low_pass)
+        else:
+            mask = self.foreground(sums)
+        if update:
+            self.update(sums, mask)
+        return mask
+
+class CentroidTracker(object):
+    '''
+    Stateful centroid finder. Only a window around the predicted centroid is
+    binned and thresholded, the full frame is searched again only when the
+    ant is lost or touches the edge of the window. With multi_blob the mask
+    is split into connected blobs and only the blob nearest to the
+    prediction is used, so debris or shadows do not pull the centroid away
+    '''
+
+    def __init__(self, threshold = 120, low_pass = True, binning = 8, window = 8,
+                 background = None, background_period = 10, multi_blob = True, min_area = 1):
+        '''
+        threshold: pixel value used to separate the ant from the background
+        low_pass: lock on to feature lower (True) or higher (False) than threshold
+        binning: pixel binning number to improve speed
+        window: half size of the search window, in binned pixels
+        background: BackgroundModel on the binned grid of the frames, replaces
+                    the fixed threshold once it is seeded
+        background_period: number of frames between two background updates
+        multi_blob: label connected blobs and follow the one nearest to the prediction
+        min_area: blobs smaller than this number of bins are ignored with multi_blob
+        '''
+        self.threshold = threshold
+        self.low_pass = low_pass
+        self.binning = binning
+        self.window = window
+        self.background = background
+        self.background_period = background_period
+        self.multi_blob = multi_blob
+        self.min_area = min_area
+        self.kernel = None
+        self.reset()
+
+    def reset(self):
+        '''
+        forget the last centroid, the next frame will get a full frame search
+        '''
+        self.last_cms = None
+        self.prev_cms = None
+        self.moments = None
+        self.found = False
+        self.blob_count = 0
+        self.full_searches = 0
+        self.frame_count = 0
+        self.background_offset = None
+        if self.background is not None:
+            self.background.reset()
+
+    def predict(self):
+        '''
+        expected centroid of the next frame from the last two centroids
+        '''
+        if self.last_cms is None:
+            return None
+        if self.prev_cms is None:
+            return self.last_cms
+        return (2 * self.last_cms[0] - self.prev_cms[0],
+                2 * self.last_cms[1] - self.prev_cms[1])
+
+    def search(self, image, r0, r1, c0, c1, target = None):
+        '''
+        find the blob within the binned rows r0:r1 and columns c0:c1
+
+        target: (row, col) in binned pixels of the full frame, with multi_blob
+                the blob nearest to it is used, the largest blob if None
+        return: moments of the blob (see BinningKernel.moments) in binned
+        pixels of the full frame and a flag which is True when the feature
+        touches the border of the searched area, None if nothing is under the
+        threshold
+        '''
+        sums = self.kernel.bin(image, r0, r1, c0, c1)
+        if self.background is None or not self.background.initialized:
+            mask = self.kernel.threshold(sums, self.threshold, self.low_pass)
+        else:
+            mask = self.background.foreground(sums, r0, c0,
+                                              out = self.kernel.mask[0:r1-r0, 0:c1-c0])
+
+        if self.multi_blob:
+            blobs = self.kernel.label(mask, self.min_area)
+            self.blob_count = blobs.size
+            if blobs.size == 0:
+                return None
+            if blobs.size > 1:
+                if target is None:
+                    best = np.argmax(blobs['area'])
+                else:
+                    dist = (blobs['row'] + r0 - target[0])**2 + (blobs['col'] + c0 - target[1])**2
+                    best = np.argmin(dist)
+                self.kernel.select(mask, blobs[best]['label'])
+            elif self.min_area > 1:
+                self.kernel.select(mask, blobs[0]['label'])
+
+        moments = self.kernel.moments(mask)
+        if moments is None:
+            return None
+        moments[0] += r0
+        moments[1] += c0
+        return moments, self.kernel.touches_border(mask)
+
+    def set_kernel(self, image):
+        '''
+        allocate the binning kernel for the shape of the image, the last
+        centroids are forgotten when the shape changes
+        '''
+        if (self.kernel is None or self.kernel.shape != image.shape or
+                self.kernel.binning != self.binning):
+            self.kernel = BinningKernel(image.shape, self.binning, image.dtype)
+            self.last_cms = None
+            self.prev_cms = None
+
+    def update_background(self, image, offset = (0, 0)):
+        '''
+        add a frame to the background model, every frame while the model is
+        seeded and every background_period frames afterwards. The bins under
+        the fixed threshold are left out of the seed, so feed it frames from
+        before the ant shows up when possible. The model is kept on the grid
+        of the frames and seeded again when the offset changes, e.g. when the
+        region of interest moved
+
+        image: input image array
+        offset: (row, col) of the image on the full sensor in pixels, same as in track
+        '''
+        self.set_kernel(image)
+        offset = tuple(offset)
+        if offset != self.background_offset:
+            self.background.reset()
+            self.background_offset = offset
+            self.frame_count = 0
+        if not self.background.initialized or self.frame_count % self.background_period == 0:
+            sums = self.kernel.bin(image)
+            if self.background.initialized:
+                mask = self.background.foreground(sums)
+            else:
+                mask = self.kernel.threshold(sums, self.threshold, self.low_pass)
+            self.background.update(sums, mask)
+        self.frame_count += 1
+
+    def track(self, image, prediction = None, offset = (0, 0)):
+        '''
+        find the centroid of the next frame, the full moments of the blob are
+        kept in self.moments
+
+        image: input image array
+        prediction: expected (row, col) of the centroid in binned pixels, e.g.
+                    from a Kalman filter, defaults to a constant velocity
+                    extrapolation of the last two centroids
+        offset: (row, col) of the image on the full sensor in pixels, e.g.
+                the offset of a moving region of interest, same as
+                find_centroid. Centroids, moments and predictions are in
+                binned pixels of the full sensor
+        return: (row, col) of the centroid in binned pixels, same as find_centroid
+        '''
+        h = image.shape[0]
+        w = image.shape[1]
+        b = self.binning
+        r_off = offset[0] / b
+        c_off = offset[1] / b
+        center = (h/(b*2) + r_off, w/(b*2) + c_off)
+
+        if not (h % b == 0 and w % b == 0):
+            print('Height or width is not divisible by binning, returning (h/2,w/2)')
+            return center
+
+        self.set_kernel(image)
+        hb = self.kernel.hb
+        wb = self.kernel.wb
+
+        if self.background is not None:
+            self.update_background(image, offset)
+
+        if prediction is None:
+            prediction = self.predict()
+        if prediction is not None:
+            prediction = (prediction[0] - r_off, prediction[1] - c_off)
+
+        result = None
+        if prediction is not None:
+            r = min(max(int(prediction[0]), 0), hb - 1)
+            c = min(max(int(prediction[1]), 0), wb - 1)
+            r0 = max(r - self.window, 0)
+            r1 = min(r + self.window + 1, hb)
+            c0 = max(c - self.window, 0)
+            c1 = min(c + self.window + 1, wb)
+            result = self.search(image, r0, r1, c0, c1, prediction)
+
+            #a feature touching the window border is only partially seen
+            if result is not None and result[1]:
+                if (r0, r1, c0, c1) != (0, hb, 0, wb):
+                    result = None
+
+        if result is None:
+            self.full_searches += 1
+            result = self.search(image, 0, hb, 0, wb, prediction)
+
+        if result is None:
+            self.last_cms = None
+            self.prev_cms = None
+            self.moments = None
+            self.found = False
+            return center
+
+        self.moments = result[0]
+        self.moments[0] += r_off
+        self.moments[1] += c_off
+        self.prev_cms = self.last_cms
+        self.last_cms = (self.moments[0], self.moments[1])
+        self.found = True
+        return self.last_cms
+
 class PIDController(object):
     '''
-    PID controller object, takes in an error signal (float) and output a feedback
+    PID controller object, takes in an error signal and output a feedback. The
+    error is either a float or a vector with one entry per axis (e.g. x and y),
+    every axis keeps its own integral and derivative state
     '''
     
-    def __init__(self, p = 1, i = 0, d = 0, msize = 5):
+    def __init__(self, p = 1, i = 0, d = 0, msize = 5, naxis = 1, period = None):
         '''
         initialize the controller
         
@@ -65,48 +720,321 @@ class PIDController(object):
         i: integral factor (float)
         d: derivative factor (float)
         msize: the size of memory used for integration (int)
+        naxis: number of independent axes (int)
+        period: nominal time between two feedback calls in seconds (float),
+                the derivative is the change of error per period measured with
+                the real elapsed time. If None, the change per second is used
         '''
         self.p = p
         self.i = i
         self.d = d
         self.msize = msize
-        self.memory = np.zeros((self.msize,))
-        self.last_error = 0
+        self.naxis = naxis
+        self.period = period
+        self.memory = np.zeros((self.msize, self.naxis))
+        self.memory_sum = np.zeros((self.naxis,))
+        self.last_error = np.zeros((self.naxis,))
+        self.last_deriv = np.zeros((self.naxis,))
+        self.output = np.zeros((self.naxis,))
+        self.reset()
+        
+    def reset(self):
+        '''
+        clear the integral memory and the derivative history
+        '''
+        self.memory[:] = 0
+        self.memory_sum[:] = 0
+        self.memory_index = 0
+        self.last_error[:] = 0
+        self.last_deriv[:] = 0
+        self.last_time = None
         self.first_trial = True
         
     def memorize_error(self,error):
         '''
-        take in a new error and put it into internal memory
+        take in a new error and put it into internal memory, the memory is a
+        ring buffer with a running sum so the integral costs O(1)
         '''
-        self.memory[0:-1] = self.memory[1:]
-        self.memory[-1] = error
+        slot = self.memory[self.memory_index]
+        self.memory_sum -= slot
+        slot[:] = error
+        self.memory_sum += slot
+        self.memory_index += 1
+        if self.memory_index == self.msize:
+            self.memory_index = 0
+            #resum once per turn so rounding errors do not build up
+            self.memory.sum(axis = 0, out = self.memory_sum)
     
-    def diff_error(self,error):
+    def diff_error(self,error,dt):
         '''
         differentiate the error signal to find the derivative
+        
+        dt: time since the last error in seconds, the last derivative is
+            kept when it is not positive (duplicate or out of order times)
         '''
-        return error - self.last_error
+        if dt <= 0:
+            return self.last_deriv
+        deriv = self.last_deriv
+        np.subtract(error, self.last_error, out = deriv)
+        if self.period is None:
+            deriv /= dt
+        else:
+            deriv *= self.period / dt
+        return deriv
     
-    def feedback(self,error):
+    def feedback(self,error,t = None):
         '''
         take an error and give a PID feedback
+        
+        error: float, or array with one error per axis
+        t: time the error was measured in seconds, defaults to now
+        return: feedback with the same shape as error
         '''
-        output = 0
-        output += self.p * error
+        scalar = np.ndim(error) == 0
+        error = np.asarray(error, dtype = np.float64).reshape((self.naxis,))
+        if t is None:
+            t = time.perf_counter()
+            
+        output = self.output
+        np.multiply(error, self.p, out = output)
         if not self.i == 0:
             self.memorize_error(error)
-            output += self.i * self.memory.sum()
+            output += self.i * self.memory_sum
         if not self.d == 0:
             if self.first_trial:
                 self.first_trial = False
+                self.last_error[:] = error
+                self.last_time = t
             else:
-                deriv = self.diff_error(error)
+                dt = t - self.last_time
+                deriv = self.diff_error(error, dt)
                 output += self.d * deriv
-            self.last_error = error
-        return output
+                #an out of order error does not move the derivative history
+                if dt > 0:
+                    self.last_error[:] = error
+                    self.last_time = t
+        if scalar:
+            return float(output[0])
+        return output.copy()
+            
             
+        
+
+
+class ConstantVelocityKalman(object):
+    '''
+    Kalman filter with a constant velocity model, one independent filter per
+    axis. Used to predict where the ant will be when a stage move completes
+    '''
+
+    def __init__(self, naxis = 2, process_noise = 500.0, measurement_noise = 0.2, gate = 100.0):
+        '''
+        naxis: number of independent axes (int)
+        process_noise: spectral density of the random acceleration (unit**2/s**3)
+        measurement_noise: standard deviation of a position measurement (unit)
+        gate: normalized innovation squared above which the filter restarts
+              from the measurement, e.g. after the ant was lost (float)
+        '''
+        self.naxis = naxis
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.gate = gate
+        self.position = np.zeros((naxis,))
+        self.velocity = np.zeros((naxis,))
+        #covariance entries of [position, velocity] for every axis
+        self.p_pp = np.zeros((naxis,))
+        self.p_pv = np.zeros((naxis,))
+        self.p_vv = np.zeros((naxis,))
+        self.innovation = np.zeros((naxis,))
+        self.innovation_sum = np.zeros((naxis,))
+        self.innovation_sq_sum = np.zeros((naxis,))
+        self.initialized = False
+        self.reset_stats()
+        self.reset()
+
+    def reset(self):
+        '''
+        forget the state, the next measurement initializes the filter. The
+        innovation statistics are kept, a reset of a running filter is
+        counted as a dropout
+        '''
+        if self.initialized:
+            self.dropouts += 1
+        self.last_time = None
+        self.initialized = False
+        self.velocity[:] = 0
+        self.innovation[:] = 0
+        self.nis = 0.0
+
+    def reset_stats(self):
+        '''
+        clear the innovation statistics and the restart and dropout counts
+        '''
+        self.innovation_sum[:] = 0
+        self.innovation_sq_sum[:] = 0
+        self.nis_sum = 0.0
+        self.count = 0
+        self.restarts = 0
+        self.dropouts = 0
+
+    def initialize(self, z, t):
+        '''
+        start the filter at a measured position with unknown velocity
+        '''
+        self.position[:] = z
+        self.velocity[:] = 0
+        self.p_pp[:] = self.measurement_noise**2
+        self.p_pv[:] = 0
+        #unknown velocity, start with a large variance
+        self.p_vv[:] = self.process_noise
+        self.last_time = t
+        self.initialized = True
+
+    def propagate(self, t):
+        '''
+        move the state and covariance forward to time t
+        '''
+        dt = t - self.last_time
+        if dt <= 0:
+            return
+        q = self.process_noise
+        self.position += self.velocity * dt
+        self.p_pp += dt * (2 * self.p_pv + dt * self.p_vv) + q * dt**3 / 3
+        self.p_pv += dt * self.p_vv + q * dt**2 / 2
+        self.p_vv += q * dt
+        self.last_time = t
+
+    def update(self, z, t):
+        '''
+        add a position measurement
+
+        z: measured position, one entry per axis
+        t: time of the measurement in seconds
+        return: estimated position
+        '''
+        z = np.asarray(z, dtype = np.float64).reshape((self.naxis,))
+        if not self.initialized:
+            self.initialize(z, t)
+            return self.position
+
+        self.propagate(t)
+        np.subtract(z, self.position, out = self.innovation)
+        s = self.p_pp + self.measurement_noise**2
+        nis = float(np.sum(self.innovation**2 / s))
+        if nis > self.gate:
+            self.restarts += 1
+            self.initialize(z, t)
+            return self.position
+
+        k_p = self.p_pp / s
+        k_v = self.p_pv / s
+        self.position += k_p * self.innovation
+        self.velocity += k_v * self.innovation
+        p_pp = self.p_pp.copy()
+        p_pv = self.p_pv.copy()
+        self.p_pp -= k_p * p_pp
+        self.p_pv -= k_p * p_pv
+        self.p_vv -= k_v * p_pv
+
+        self.nis = nis
+        self.nis_sum += nis
+        self.innovation_sum += self.innovation
+        self.innovation_sq_sum += self.innovation**2
+        self.count += 1
+        return self.position
+
+    def predict(self, t):
+        '''
+        predicted position at time t, does not change the state
+        '''
+        if not self.initialized:
+            return None
+        return self.position + self.velocity * (t - self.last_time)
+
+    def get_innovation_stats(self):
+        '''
+        return: dict with the mean and rms innovation per axis and the mean
+        normalized innovation squared (close to naxis for a consistent filter)
+        since reset_stats, and the number of restarts and dropouts
+        '''
+        n = max(self.count, 1)
+        return {'count': self.count,
+                'restarts': self.restarts,
+                'dropouts': self.dropouts,
+                'mean': self.innovation_sum / n,
+                'rms': np.sqrt(self.innovation_sq_sum / n),
+                'nis': self.nis_sum / n}
+
+
+class OdorGen(object):
+    '''
+    Object generate a time series of odor
+    '''
+    
+    def __init__(self,nchan = 8, T = 3000):
+        self.tick = 0 # millisecond time counter
+        self.nchan = nchan #number of channels
+        self.T = T # size of the output time series
+        self.odor_buffer = np.zeros((self.nchan,self.T))
+        self.odor_buffer_disp = np.zeros((self.nchan,self.T))
+        self.on = False
+    
+    def step(self):
+        '''
+        output the next odor level in the time series
+        '''
+        default_output = np.zeros((self.nchan,))
+        default_output[0] = 100
+        if self.on:
+            if self.tick < self.T -1:
+                self.tick += 1 
+                return self.odor_buffer[:,self.tick].squeeze(),self.odor_buffer_disp[:,self.tick].squeeze()
+            else:
+                self.on = False
+                self.odor_buffer[:] = 0
+                return default_output,default_output
+        else:
+            return default_output,default_output
             
+    
+    def new_trial(self, channel = 4, level = 30, Tpulse = 50, interval = 2000):
+        '''
+        generate new time series
+        called from a task
+        '''
+        self.tick = 0 #reset tick
+        '''
+        Exponential Process Generation
+        '''
+        base_intervals = np.random.exponential(scale = interval, size = (50,)) #pulses are exponentially distributed
+        base_onsets = base_intervals.cumsum().astype(int)
         
+        '''
+        Spike generation
+        '''
+        full_length = int(base_intervals.sum()+2000)
+        spike_trace = np.zeros((full_length,))
+        spike_trace[base_onsets] = 1
+        spike_trace = spike_trace[0:self.T]
+        '''
+        Covolution with a kernel for valve control
+        '''
+        y = np.ones((Tpulse,)) * level
+        output_trace_disp = np.convolve(spike_trace,y)[0:self.T] 
+        y[0:3] = 100
+        y[3:5] = 90
+        y[5:10] = 80
+        output_trace = np.convolve(spike_trace,y)[0:self.T]
+        output_trace =output_trace.clip(0,100) #amke sure output is with in range
+        '''
+        output to both solenoid valve buffer and display
+        '''
+        clean_trace = 100 - output_trace_disp
+        clean_trace = clean_trace.clip(0,100)
+        self.odor_buffer[0,:] = clean_trace
+        self.odor_buffer[channel,:] = output_trace
+        self.odor_buffer_disp[channel,:] = output_trace_disp
+        self.on = True
 
 
 if __name__ == '__main__':
@@ -0,0 +1,97 @@
+import numpy as np
+
+'''
+LatencyLog timestamps every frame at the boundaries of the tracking loop,
+from the capture of the frame to the last pulse sent to the stage. The
+stamps of the last frames are kept in a preallocated ring, and the time
+spent between two stages is added to a histogram when the later stage is
+stamped, so the histograms cover the whole session at a fixed cost per frame
+'''
+
+class LatencyLog(object):
+    '''
+    Ring of per-frame stage timestamps and session histograms of the time
+    between consecutive stages and of the total time
+    '''
+    def __init__(self, stages, size = 4096, bin_width = 0.001, nbins = 250):
+        '''
+        stages: names of the stage boundaries, in the order they are passed
+        size: number of frames kept in the ring
+        bin_width: width of a histogram bin in seconds
+        nbins: number of bins, the last bin holds every longer interval
+        '''
+        self.stages = list(stages)
+        self.size = size
+        self.bin_width = bin_width
+        self.nbins = nbins
+        #perf_counter time of every stage, NaN if the frame did not reach it
+        self.stamps = np.full((size, len(self.stages)), np.nan)
+        self.seqs = np.full(size, -1, dtype = np.int64)
+        #row 0 is the total time from the first to the last stage, row k the
+        #time from stage k-1 to stage k
+        self.hist = np.zeros((len(self.stages), nbins), dtype = np.int64)
+
+    def start(self, seq, t):
+        '''
+        stamp the first stage of a frame, the row of the frame seq - size is reused
+
+        seq: capture sequence number of the frame
+        t: time of the first stage on the perf_counter clock
+        '''
+        row = seq % self.size
+        self.stamps[row, :] = np.nan
+        self.stamps[row, 0] = t
+        self.seqs[row] = seq
+
+    def stamp(self, seq, stage, t):
+        '''
+        stamp a later stage of a frame
+
+        stage: index of the stage in stages
+        '''
+        row = seq % self.size
+        if self.seqs[row] != seq:
+            return
+        self.stamps[row, stage] = t
+        prev = self.stamps[row, stage - 1]
+        if not np.isnan(prev):
+            self.add(stage, t - prev)
+        if stage == len(self.stages) - 1:
+            self.add(0, t - self.stamps[row, 0])
+
+    def add(self, k, dt):
+        self.hist[k, min(max(int(dt / self.bin_width), 0), self.nbins - 1)] += 1
+
+    def percentile(self, k, q):
+        '''
+        percentile of a histogram, from the upper edge of the bins
+
+        k: histogram row, 0 for the total
+        q: percentile, 0 - 100
+        return: time in seconds, NaN if the histogram is empty
+        '''
+        counts = np.cumsum(self.hist[k])
+        if counts[-1] == 0:
+            return np.nan
+        return (np.searchsorted(counts, q / 100.0 * counts[-1]) + 1) * self.bin_width
+
+    def interval_names(self):
+        '''
+        return: names of the histogram rows
+        '''
+        return (['%s-%s' % (self.stages[0], self.stages[-1])] +
+                ['%s-%s' % (self.stages[k - 1], self.stages[k]) for k in range(1, len(self.stages))])
+
+    def save(self, group):
+        '''
+        write the histograms and the stamps in the ring to a h5 group
+        '''
+        hist = group.create_dataset('latency_hist', data = self.hist)
+        hist.attrs['intervals'] = self.interval_names()
+        hist.attrs['bin_width'] = self.bin_width
+        valid = self.seqs >= 0
+        order = np.argsort(self.seqs[valid])
+        stamps = group.create_dataset('latency_stamps', data = self.stamps[valid][order])
+        stamps.attrs['stages'] = self.stages
+        stamps.attrs['units'] = 'seconds on the perf_counter clock'
+        group.create_dataset('latency_seq', data = self.seqs[valid][order])
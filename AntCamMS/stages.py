@@ -0,0 +1,164 @@
+try:
+    import h5py
+except ImportError:
+    #the location file of the motors needs h5py
+    h5py = None
+import numpy as np
+import time
+from AntCamHW.daqmotor.motor_helper_funcs import rotate_cord
+
+'''
+Stage adapters of AntWatchEngine. An adapter has get_position and
+get_target (x, y in mm), get_limits ((min_x, max_x), (min_y, max_y)) and
+move_to(x, y), which returns once the move is done with the perf_counter
+time the last pulse was sent. They are called by the motor thread of the
+engine for every frame, so they do not go through LoggedQuantities
+'''
+
+class DAQMotorDevStage(object):
+    '''
+    Stage of a DAQMotorDev without ScopeFoundry, counts the steps like
+    DAQMotorHW and keeps them in the same location file
+    '''
+    def __init__(self, dev, location_file = None, x_factor = 0.01733812949, y_factor = 0.01733812949,
+                 angle = 45, limits = ((0, 400), (0, 400))):
+        '''
+        dev: DAQMotorDev
+        location_file: h5 file with the step counts of DAQMotorHW, the stage
+                       starts at zero steps if None
+        x_factor, y_factor: mm per step
+        angle: rotation of the motor axes in degrees
+        limits: (min, max) of x and y in mm
+        '''
+        self.dev = dev
+        self.x_factor = x_factor
+        self.y_factor = y_factor
+        self.angle = angle
+        self.limits = limits
+        self.loc_file = None
+        self.loc_dset = None
+        self.steps = np.zeros(2, dtype = np.int64)
+        if location_file is not None:
+            if h5py is None:
+                raise RuntimeError('h5py is not installed, unable to read %s' % location_file)
+            self.loc_file = h5py.File(location_file, 'r+')
+            self.loc_dset = self.loc_file['/loc_data']
+            self.steps[:] = self.loc_dset[:]
+        self.target = self.get_position()
+
+    def get_position(self):
+        return self.steps[0] * self.x_factor, self.steps[1] * self.y_factor
+
+    def get_target(self):
+        return self.target
+
+    def get_limits(self):
+        return self.limits
+
+    def move_to(self, x, y):
+        '''
+        same steps as DAQMotorHW.move_to_auto
+        '''
+        self.target = (x, y)
+        old_x, old_y = self.get_position()
+        cord = np.array([int((x - old_x) / self.x_factor), int((y - old_y) / self.y_factor)])
+        cord[1] *= -1
+        direction, pulses = rotate_cord(cord, self.angle)
+        self.dev.move(direction, pulses)
+        self.steps[0] += cord[0]
+        self.steps[1] -= cord[1]
+        if self.loc_dset is not None:
+            self.loc_dset[:] = self.steps
+        return self.dev.get_move_times()[1]
+
+    def close(self):
+        self.dev.close()
+        if self.loc_file is not None:
+            self.loc_file.close()
+
+class DAQMotorStage(DAQMotorDevStage):
+    '''
+    Stage of the DAQMotorHW hardware component, used by AntWatchMeasure.
+    The steps are counted here and only published to the settings of
+    DAQMotorHW by publish, so the manual moves and the reset of DAQMotorHW
+    are disabled from the creation of the stage until close
+    '''
+    def __init__(self, daqmotor):
+        '''
+        daqmotor: connected DAQMotorHW
+        '''
+        settings = daqmotor.settings
+        DAQMotorDevStage.__init__(self, daqmotor._dev,
+                                  x_factor = settings['x_factor'],
+                                  y_factor = settings['y_factor'],
+                                  angle = settings['angle'])
+        self.daqmotor = daqmotor
+        daqmotor.set_external(True)
+        #the location file stays open in DAQMotorHW
+        self.loc_dset = daqmotor.loc_dset
+        self.steps[:] = (settings['x_steps'], settings['y_steps'])
+        self.target = self.get_position()
+        self.read_limits()
+
+    def read_limits(self):
+        '''
+        take the bounds from the settings, call again when they change
+        '''
+        settings = self.daqmotor.settings
+        self.limits = ((settings['bound_x'], settings.move_to_x.vmax),
+                       (settings['bound_y'], settings.move_to_y.vmax))
+
+    def publish(self):
+        '''
+        write the steps and the target to the settings of DAQMotorHW
+        '''
+        steps = self.steps.copy()
+        target = self.target
+        settings = self.daqmotor.settings
+        settings['x_steps'] = steps[0]
+        settings['y_steps'] = steps[1]
+        self.daqmotor.update_cord()
+        settings['move_to_x'] = target[0]
+        settings['move_to_y'] = target[1]
+
+    def close(self):
+        #the device belongs to DAQMotorHW
+        self.publish()
+        self.daqmotor.set_external(False)
+
+class SimStage(object):
+    '''
+    Stage without hardware, moves at a fixed speed and waits for the move
+    like the motors do
+    '''
+    def __init__(self, x = 200, y = 200, speed = 8000 * 0.01733812949, limits = ((0, 400), (0, 400))):
+        '''
+        x, y: start position in mm
+        speed: speed of both axes in mm/s, 0 to move instantly, default
+               is the speed of DAQMotorHW at 8000 steps/s
+        limits: (min, max) of x and y in mm
+        '''
+        self.position = (x, y)
+        self.target = (x, y)
+        self.speed = speed
+        self.limits = limits
+
+    def get_position(self):
+        return self.position
+
+    def get_target(self):
+        return self.target
+
+    def get_limits(self):
+        return self.limits
+
+    def move_to(self, x, y):
+        self.target = (x, y)
+        if self.speed > 0:
+            distance = max(abs(x - self.position[0]), abs(y - self.position[1]))
+            time.sleep(distance / self.speed)
+        self.position = (x, y)
+        return time.perf_counter()
+
+    def close(self):
+        pass
@@ -0,0 +1,100 @@
+import time
+import numpy as np
+
+'''
+TrajectoryLog keeps one row per tracked frame in an HDF5 group. Every
+column is its own chunked dataset without a length limit, so a column can
+be read on its own (e.g. /measurement/ant_watch/buffer for the stage
+position) and new columns do not change the layout of the old ones. Rows
+are staged in memory and appended a block at a time, the file is flushed
+with every block instead of with every frame
+'''
+
+class TrajectoryLog(object):
+    '''
+    Append-only table of HDF5 datasets, one per column
+    '''
+    def __init__(self, group, columns, block_rows = 256, flush_period = 1.0):
+        '''
+        group: h5py group the datasets are created in
+        columns: list of (name, dtype, shape) of the columns, shape is the
+                 shape of one row, () for a scalar
+        block_rows: rows staged before they are written, also the chunk size
+        flush_period: staged rows are written at least this often, in seconds
+        '''
+        self.group = group
+        self.block_rows = block_rows
+        self.flush_period = flush_period
+        self.datasets = dict()
+        self.staged = dict()
+        self.fill = dict()
+        self.rows = 0
+        self.n_staged = 0
+        for name, dtype, shape in columns:
+            self.add_column(name, dtype, shape)
+        self.last_flush = time.perf_counter()
+        self.closed = False
+
+    def add_column(self, name, dtype, shape = ()):
+        '''
+        add a column, rows written before it was added are filled with NaN
+        (float), -1 (int) or zeros
+        '''
+        dtype = np.dtype(dtype)
+        shape = tuple(shape)
+        if dtype.kind == 'f':
+            fill = np.nan
+        elif dtype.kind in 'iu':
+            fill = -1
+        else:
+            fill = np.zeros((), dtype = dtype)
+        self.fill[name] = fill
+        self.datasets[name] = self.group.create_dataset(name, shape = (0,) + shape,
+                                                        maxshape = (None,) + shape,
+                                                        dtype = dtype,
+                                                        chunks = (self.block_rows,) + shape,
+                                                        fillvalue = fill)
+        self.staged[name] = np.empty((self.block_rows,) + shape, dtype = dtype)
+        self.staged[name][:] = fill
+        if self.rows > 0:
+            self.datasets[name].resize(self.rows, axis = 0)
+
+    def append(self, **values):
+        '''
+        stage a row, columns without a value keep their fill value
+
+        values: column name and value of the row
+        '''
+        k = self.n_staged
+        for name, value in values.items():
+            self.staged[name][k] = value
+        self.n_staged += 1
+        if (self.n_staged == self.block_rows or
+                time.perf_counter() - self.last_flush >= self.flush_period):
+            self.flush()
+
+    def flush(self):
+        '''
+        write the staged rows and flush the file
+        '''
+        n = self.n_staged
+        if n > 0:
+            for name, dset in self.datasets.items():
+                dset.resize(self.rows + n, axis = 0)
+                dset[self.rows:self.rows + n] = self.staged[name][:n]
+                self.staged[name][:n] = self.fill[name]
+            self.rows += n
+            self.n_staged = 0
+            self.group.file.flush()
+        self.last_flush = time.perf_counter()
+
+    def __len__(self):
+        return self.rows + self.n_staged
+
+    def close(self):
+        '''
+        write the staged rows, the file is closed by its owner
+        '''
+        if not self.closed:
+            self.flush()
+            self.closed = True
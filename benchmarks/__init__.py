@@ -0,0 +1,12 @@
+'''
+Benchmarks for the tracking and control kernels and the recording backends
+of AntCam
+
+Run from the base directory of the repository:
+
+    python -m benchmarks --out bench.json
+    python -m benchmarks --out new.json --compare bench.json
+
+Only numpy and scipy are needed, PySpin, DAQmx and Qt are not imported.
+The recording cases need h5py, the avi cases also PySpin
+'''
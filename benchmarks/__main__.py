@@ -0,0 +1,70 @@
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+import numpy as np
+import scipy
+from .timing import measure
+from .bench_tracking import iter_cases, RESOLUTIONS, BINNINGS
+from . import bench_recording
+
+def case_key(result):
+    params = ','.join('%s=%s' % item for item in sorted(result['params'].items()))
+    return '%s[%s]' % (result['name'], params)
+
+def run(n = 1000, resolutions = RESOLUTIONS, binnings = BINNINGS, names = None, record = True):
+    results = []
+    cases = iter_cases(resolutions, binnings)
+    if record:
+        cases = itertools.chain(cases, bench_recording.iter_cases())
+    for name, params, func in cases:
+        if names and name not in names:
+            continue
+        result = {'name': name, 'params': params}
+        result.update(measure(func, n = n))
+        results.append(result)
+        print('%-60s p50 %9.1f us  p99 %9.1f us  peak %10.0f B' % (case_key(result),
+              result['p50_us'], result['p99_us'], result['alloc_peak_bytes']))
+    return results
+
+def compare(results, fname):
+    '''
+    print the change of the median latency against an earlier result file
+    '''
+    with open(fname) as f:
+        old = {case_key(r): r for r in json.load(f)['results']}
+    print('\nchange of p50 against %s' % fname)
+    for result in results:
+        key = case_key(result)
+        if key in old:
+            ratio = result['p50_us'] / old[key]['p50_us']
+            print('%-60s %6.2fx' % (key, ratio))
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark the AntCam tracking and control kernels')
+    parser.add_argument('--out', help = 'JSON file to save the results to')
+    parser.add_argument('--compare', help = 'JSON file of an earlier run to compare with')
+    parser.add_argument('-n', type = int, default = 1000, help = 'number of timed calls per case')
+    parser.add_argument('--binning', type = int, nargs = '+', default = list(BINNINGS))
+    parser.add_argument('--case', nargs = '+', help = 'only run these cases')
+    parser.add_argument('--no-record', dest = 'record', action = 'store_false',
+                        help = 'skip the recording cases, they write n frames per backend to disk')
+    args = parser.parse_args(argv)
+
+    results = run(n = args.n, binnings = args.binning, names = args.case, record = args.record)
+    if args.out:
+        meta = {'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'python': sys.version.split()[0],
+                'numpy': np.__version__,
+                'scipy': scipy.__version__,
+                'platform': platform.platform(),
+                'processor': platform.processor()}
+        with open(args.out, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent = 1)
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main()
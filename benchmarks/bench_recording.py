@@ -0,0 +1,44 @@
+import os
+import shutil
+import tempfile
+from AntCamHW.flircam.flirrec_dev import RECORDERS, PySpin, h5py
+from .synthetic import synthetic_sequence
+
+# frame size of the track camera
+RECORD_RESOLUTIONS = ((1024, 1024),)
+
+# file format and compress flag of every recording backend, h5 is lossless
+# (lzf or raw), avi is MJPG or uncompressed and needs PySpin
+BACKENDS = (('h5', True), ('h5', False), ('avi', True), ('avi', False))
+
+def available(file_format):
+    if file_format == 'avi':
+        return PySpin is not None
+    return h5py is not None
+
+def iter_cases(resolutions = RECORD_RESOLUTIONS, nframes = 32):
+    '''
+    generate a write case for every available backend. Frames are written
+    with Recorder.write on the calling thread, so the time is the cost of
+    encoding and writing one frame without the queue. The files are written
+    to a temporary directory that is removed afterwards
+
+    return: iterator of (name, params, function to time)
+    '''
+    tmpdir = tempfile.mkdtemp(prefix = 'antcam_bench_')
+    try:
+        for shape in resolutions:
+            frames = synthetic_sequence(shape, nframes = nframes)
+            for file_format, compress in BACKENDS:
+                if not available(file_format):
+                    continue
+                fname = os.path.join(tmpdir, '%s_%i' % (file_format, compress))
+                recorder = RECORDERS[file_format](fname, 50, compress)
+                params = {'height': shape[0], 'width': shape[1],
+                          'format': file_format, 'compress': compress}
+                try:
+                    yield 'record', params, lambda i, recorder = recorder: recorder.write(frames[i % nframes], i)
+                finally:
+                    recorder.close()
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors = True)
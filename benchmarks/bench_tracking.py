@@ -0,0 +1,89 @@
+import numpy as np
+from AntCamMS.helper_funcs import (rebin, find_centroid, BinningKernel, CentroidTracker,
+                                   BackgroundModel, PIDController, ConstantVelocityKalman, OdorGen)
+from AntCamHW.daqmotor.motor_helper_funcs import rotate_cord
+from .synthetic import synthetic_sequence
+
+# frame sizes of the track camera (1024x1024) and the wide camera (1200x1920)
+RESOLUTIONS = ((1024, 1024), (1200, 1920))
+BINNINGS = (8, 16)
+
+# every case is a function taking the frames, the resolution and the binning
+# and returning the function to time, frame cases run for every resolution
+# and binning, the other cases run once
+FRAME_CASES = []
+CONTROL_CASES = []
+
+def frame_case(func):
+    FRAME_CASES.append(func)
+    return func
+
+def control_case(func):
+    CONTROL_CASES.append(func)
+    return func
+
+@frame_case
+def bench_rebin(frames, shape, binning):
+    binned = (shape[0] // binning, shape[1] // binning)
+    return lambda i: rebin(frames[i % len(frames)], binned)
+
+@frame_case
+def bench_find_centroid(frames, shape, binning):
+    return lambda i: find_centroid(frames[i % len(frames)], threshold = 85, binning = binning)
+
+@frame_case
+def bench_binning_kernel(frames, shape, binning):
+    kernel = BinningKernel(shape, binning)
+    def func(i):
+        sums = kernel.bin(frames[i % len(frames)])
+        kernel.center_of_mass(kernel.threshold(sums, 85))
+    return func
+
+@frame_case
+def bench_tracker(frames, shape, binning):
+    tracker = CentroidTracker(threshold = 85, binning = binning)
+    return lambda i: tracker.track(frames[i % len(frames)])
+
+@frame_case
+def bench_tracker_background(frames, shape, binning):
+    background = BackgroundModel((shape[0] // binning, shape[1] // binning), binning = binning)
+    tracker = CentroidTracker(threshold = 85, binning = binning, background = background)
+    return lambda i: tracker.track(frames[i % len(frames)])
+
+@control_case
+def bench_pid_feedback():
+    pid = PIDController(p = 0.12, i = 0.01, d = 0.05, naxis = 2, period = 0.02)
+    errors = np.random.default_rng(0).normal(0, 1, size = (64, 2))
+    return lambda i: pid.feedback(errors[i % 64], t = i * 0.02)
+
+@control_case
+def bench_kalman_update():
+    kf = ConstantVelocityKalman(naxis = 2)
+    return lambda i: kf.update((0.1 * i, -0.05 * i), i * 0.02)
+
+@control_case
+def bench_rotate_cord():
+    cords = np.random.default_rng(0).integers(-500, 500, size = (64, 2))
+    return lambda i: rotate_cord(cords[i % 64], 45)
+
+@control_case
+def bench_odorgen_new_trial():
+    odorgen = OdorGen()
+    return lambda i: odorgen.new_trial()
+
+def iter_cases(resolutions = RESOLUTIONS, binnings = BINNINGS, nframes = 32):
+    '''
+    generate every benchmark case
+
+    return: iterator of (name, params, function to time)
+    '''
+    for shape in resolutions:
+        frames = synthetic_sequence(shape, nframes = nframes)
+        for binning in binnings:
+            if shape[0] % binning or shape[1] % binning:
+                continue
+            params = {'height': shape[0], 'width': shape[1], 'binning': binning}
+            for make in FRAME_CASES:
+                yield make.__name__[6:], params, make(frames, shape, binning)
+    for make in CONTROL_CASES:
+        yield make.__name__[6:], {}, make()
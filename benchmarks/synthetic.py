@@ -0,0 +1,50 @@
+import numpy as np
+
+def synthetic_frame(shape, center, angle = 0.0, length = 60, width = 20,
+                    background = 200, ant = 20, noise = 5, rng = None):
+    '''
+    make a track camera frame with a dark elliptical ant on a bright, noisy
+    background
+
+    shape: (height, width) of the frame in pixels
+    center: (row, col) of the ant in pixels
+    angle: heading of the ant in radians from the row axis
+    length, width: size of the ant in pixels
+    background, ant: pixel values of the background and of the ant
+    noise: standard deviation of the gaussian pixel noise
+    rng: numpy random Generator
+    return: uint8 image array
+    '''
+    if rng is None:
+        rng = np.random.default_rng(0)
+    rows = np.arange(shape[0])[:, None] - center[0]
+    cols = np.arange(shape[1])[None, :] - center[1]
+    c, s = np.cos(angle), np.sin(angle)
+    along = rows * c + cols * s
+    across = -rows * s + cols * c
+    body = (along / (length / 2))**2 + (across / (width / 2))**2 <= 1
+
+    frame = rng.normal(background, noise, size = shape)
+    frame[body] = rng.normal(ant, noise, size = int(body.sum()))
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+def synthetic_sequence(shape, nframes = 32, speed = 8.0, seed = 0, **kwargs):
+    '''
+    make a sequence of frames of an ant walking on a circle around the center
+    of the frame
+
+    shape: (height, width) of the frames in pixels
+    nframes: number of frames
+    speed: distance walked between two frames in pixels
+    seed: seed of the random generator
+    kwargs: passed on to synthetic_frame
+    return: list of uint8 image arrays
+    '''
+    rng = np.random.default_rng(seed)
+    radius = min(shape) / 4
+    frames = []
+    for i in range(nframes):
+        phi = i * speed / radius
+        center = (shape[0] / 2 + radius * np.sin(phi), shape[1] / 2 + radius * np.cos(phi))
+        frames.append(synthetic_frame(shape, center, angle = phi, rng = rng, **kwargs))
+    return frames
@@ -0,0 +1,54 @@
+import time
+import tracemalloc
+import numpy as np
+
+PERCENTILES = (50, 90, 99)
+
+def measure(func, n = 1000, warmup = 20, alloc_calls = 50):
+    '''
+    time a function and trace the memory it allocates
+
+    func: function taking the call index (int)
+    n: number of timed calls
+    warmup: number of calls before timing, to fill caches and buffers
+    alloc_calls: number of calls traced with tracemalloc, tracing slows the
+                 calls down so it is done separately from the timing
+    return: dict with the latency percentiles in microseconds, and the mean
+    peak and net bytes allocated per call
+    '''
+    for i in range(warmup):
+        func(i)
+
+    latency = np.zeros((n,))
+    clock = time.perf_counter
+    for i in range(n):
+        t0 = clock()
+        func(i)
+        latency[i] = clock() - t0
+    latency *= 1e6
+
+    #peak is the largest amount of memory held at once during the call,
+    #net is what is still held after the call returned
+    peak = np.zeros((alloc_calls,))
+    net = np.zeros((alloc_calls,))
+    tracemalloc.start()
+    try:
+        for i in range(alloc_calls):
+            start, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            func(i)
+            end, top = tracemalloc.get_traced_memory()
+            peak[i] = top - start
+            net[i] = end - start
+    finally:
+        tracemalloc.stop()
+
+    result = {'n': n,
+              'mean_us': float(latency.mean()),
+              'min_us': float(latency.min()),
+              'max_us': float(latency.max())}
+    for q in PERCENTILES:
+        result['p%d_us' % q] = float(np.percentile(latency, q))
+    result['alloc_peak_bytes'] = float(peak.mean())
+    result['alloc_net_bytes'] = float(net.mean())
+    return result